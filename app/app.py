@@ -1,11 +1,39 @@
-import os
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
-import httpx
-from .controllers import users
+from .controllers import metrics, users
+from .services import autocomplete, changes, graph, recommendations, registry
+from .utils.config import AUTH_MODE, SOCIAL_GRAPH_ENABLED, env
 from fastapi import FastAPI, HTTPException, Request, status
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry.registry_client.open()
+    background_tasks = []
+    if env != "test":
+        background_tasks.append(asyncio.create_task(registry.bootstrap()))
+        background_tasks.append(asyncio.create_task(autocomplete.keep_index_fresh()))
+        background_tasks.append(asyncio.create_task(changes.keep_listening()))
+        background_tasks.append(
+            asyncio.create_task(recommendations.keep_recommendations_fresh())
+        )
+        if SOCIAL_GRAPH_ENABLED:
+            background_tasks.append(asyncio.create_task(graph.keep_graph_fresh()))
+    if AUTH_MODE == "token":
+        background_tasks.append(asyncio.create_task(registry.keep_keyset_fresh()))
+
+    yield
+
+    for task in background_tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await registry.registry_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.exception_handler(RequestValidationError)
@@ -90,34 +118,30 @@ async def validation_exception_handler(request: Request, exc: HTTPException):
     )
 
 
-env = os.getenv("ENV")
-
 if env != "test":
 
     @app.middleware("http")
     async def validate_api_key(request: Request, call_next):
-        async with httpx.AsyncClient() as client:
-            if request.url.path in ["/docs", "/redoc", "/openapi.json", "/users/ping"]:
-                return await call_next(request)
-
-            api_key = request.headers.get("Authorization")
+        if request.url.path in [
+            "/docs",
+            "/redoc",
+            "/openapi.json",
+            "/users/ping",
+            "/users/ready",
+        ]:
+            return await call_next(request)
 
-            if not api_key:
-                return JSONResponse(
-                    status_code=401, content={"detail": "Missing API key"}
-                )
+        api_key = request.headers.get("Authorization")
 
-            response = await client.get(
-                f"https://services-registry.onrender.com/api/registry/validate?apiKey={api_key}"
-            )
+        if not api_key:
+            return JSONResponse(status_code=401, content={"detail": "Missing API key"})
 
-            if response.status_code == 401:
-                return JSONResponse(
-                    status_code=401, content={"detail": "Invalid API key"}
-                )
+        if not await registry.is_authorized(api_key):
+            return JSONResponse(status_code=401, content={"detail": "Invalid API key"})
 
-            response = await call_next(request)
-            return response
+        response = await call_next(request)
+        return response
 
 
+app.include_router(metrics.router)
 app.include_router(users.router)
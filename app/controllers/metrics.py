@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+
+from ..repositories import database
+from ..services import autocomplete, changes, graph, profiles, registry
+from ..utils.config import SOCIAL_GRAPH_ENABLED
+
+router = APIRouter(prefix="/users/metrics", tags=["metrics"])
+
+
+@router.get("")
+def get_metrics():
+    metrics = {
+        "api_key_cache": registry.api_key_cache.stats(),
+        "api_key_validations": registry.api_key_validations.stats(),
+        "registry_client": registry.registry_client.stats(),
+        "keyset": registry.keyset.stats(),
+        "registration": registry.registration.stats(),
+        "db_pool": database.pool_stats(),
+        "autocomplete": autocomplete.user_index.stats(),
+        "profile_cache": profiles.profile_cache.stats(),
+        "changes_listener": changes.changes_listener.stats(),
+    }
+    if SOCIAL_GRAPH_ENABLED:
+        metrics["social_graph"] = graph.social_graph.stats()
+    return metrics
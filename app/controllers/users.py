@@ -1,69 +1,222 @@
 import logging
 import os
 from uuid import UUID
-from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response, status
-from app.utils.errors import BlockedUser, NotAllowed, UserNotFound
+from typing import Iterator
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Response,
+    status,
+)
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from app.utils.errors import BlockedUser, InvalidCursor, NotAllowed, UserNotFound
 from ..repositories import models
+from ..services import registry
 from ..services import users as users_service
-from sqlalchemy.orm import Session
 from ..utils import schemas
-from ..repositories.database import engine, get_db
+from ..utils.config import RECOMMENDATIONS_PER_USER, USERS_BATCH_MAX_SIZE
+from ..repositories.database import (
+    DbSession,
+    SessionLocal,
+    engine,
+    get_session,
+    run_in_session,
+)
 from pydantic import EmailStr
 
 models.Base.metadata.create_all(bind=engine)
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+# The read endpoints get the users from the service as plain values and send
+# them as an ORJSONResponse, which FastAPI doesn't validate and serialize
+# again, their response_model is only for the docs
+
+
+def __cursor_headers(next_cursor: str | None) -> dict[str, str]:
+    return {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
 
 @router.get("/", response_model=list[schemas.User])
-def get_users(db: Session = Depends(get_db)):
-    return users_service.fetch_users(db)
+async def get_users(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    db: DbSession = Depends(get_session),
+):
+    """
+    - **limit**: maximum amount of users in the page.
+    - **cursor**: the `X-Next-Cursor` header of the previous page, the header
+    is missing on the last page.
+    """
+    try:
+        users, next_cursor = await run_in_session(
+            db, users_service.fetch_users, limit, cursor
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    return ORJSONResponse(users, headers=__cursor_headers(next_cursor))
 
 
 @router.get("/search", response_model=list[schemas.User])
-def search_users(user: str, limit: int, db: Session = Depends(get_db)):
-    return users_service.search_users(db, user, limit)
+async def search_users(user: str, limit: int, db: DbSession = Depends(get_session)):
+    return ORJSONResponse(
+        await run_in_session(db, users_service.search_users, user, limit)
+    )
+
+
+@router.get("/autocomplete", response_model=list[schemas.UserSuggestion])
+async def autocomplete(
+    q: str = Query(min_length=1), limit: int = Query(10, ge=1, le=50)
+):
+    """
+    - **q**: start of the user name or of any word of the name, case
+    insensitive. Served from memory, blocked users are left out.
+    """
+    return users_service.autocomplete_users(q, limit)
+
+
+@router.get("/ready")
+def ready(res: Response):
+    if not registry.registration.ready:
+        res.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": registry.registration.ready}
+
+
+def __etag(version: int, expand: list[schemas.UserExpansion]) -> str:
+    # Each set of expansions is a different representation of the user
+    return '"' + ".".join([str(version), *sorted(e.value for e in expand)]) + '"'
+
+
+def __not_modified(if_none_match: str, etag: str) -> bool:
+    # If-None-Match compares ignoring whether the tags are weak
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
 
 
 @router.get("/{user_id}", response_model=schemas.User)
-def get_user(user_id: UUID, db: Session = Depends(get_db)) -> schemas.User:
+async def get_user(
+    user_id: UUID,
+    expand: list[schemas.UserExpansion] = Query([]),
+    if_none_match: str | None = Header(None),
+    db: DbSession = Depends(get_session),
+) -> schemas.User:
+    """
+    - **expand**: full lists to include besides their counts, e.g:
+    `?expand=followers&expand=followeds`.
+    - **If-None-Match**: the `ETag` of a previous response, answered with a
+    304 and no body when the user didn't change since.
+    """
+    version = None
+    if if_none_match:
+        version = await run_in_session(db, users_service.fetch_user_version, user_id)
+        etag = __etag(version, expand) if version is not None else None
+        if etag and __not_modified(if_none_match, etag):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+            )
     try:
-        user = users_service.fetch_user_by_id(db=db, id=user_id)
+        user = await run_in_session(
+            db,
+            users_service.fetch_user_by_id,
+            id=user_id,
+            expand=expand,
+            # Not older than the version the ETag was compared to
+            min_version=version,
+        )
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        return user
+        return ORJSONResponse(user, headers={"ETag": __etag(user["version"], expand)})
     except BlockedUser as e:
         raise HTTPException(status_code=403, detail=e.message)
 
 
 @router.get("/followeds/{user_id}/search", response_model=list[schemas.User])
-def search_followeds(
-    user_id: UUID, user: str, limit: int, db: Session = Depends(get_db)
+async def search_followeds(
+    user_id: UUID, user: str, limit: int, db: DbSession = Depends(get_session)
 ):
     try:
-        return users_service.search_followeds(db, user_id, user, limit)
+        followeds = await run_in_session(
+            db, users_service.search_followeds, user_id, user, limit
+        )
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
+    return ORJSONResponse(followeds)
 
 
 @router.get("/email/{email}", response_model=schemas.User)
-def get_user_by_email(email: EmailStr, db: Session = Depends(get_db)) -> schemas.User:
+async def get_user_by_email(
+    email: EmailStr,
+    expand: list[schemas.UserExpansion] = Query([]),
+    if_none_match: str | None = Header(None),
+    db: DbSession = Depends(get_session),
+) -> schemas.User:
+    """
+    - **expand**: full lists to include besides their counts, e.g:
+    `?expand=followers&expand=followeds`.
+    - **If-None-Match**: the `ETag` of a previous response, answered with a
+    304 and no body when the user didn't change since.
+    """
+    version = None
+    if if_none_match:
+        version = await run_in_session(
+            db, users_service.fetch_user_version_by_email, email
+        )
+        etag = __etag(version, expand) if version is not None else None
+        if etag and __not_modified(if_none_match, etag):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+            )
     try:
-        user = users_service.fetch_user_by_email(db=db, email=email)
+        user = await run_in_session(
+            db,
+            users_service.fetch_user_by_email,
+            email=email,
+            expand=expand,
+            min_version=version,
+        )
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        return user
+        return ORJSONResponse(user, headers={"ETag": __etag(user["version"], expand)})
     except BlockedUser as e:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=e.message)
 
 
+@router.post("/batch", response_model=schemas.UsersBatch)
+async def get_users_batch(
+    query: schemas.UsersBatchQuery, db: DbSession = Depends(get_session)
+) -> schemas.UsersBatch:
+    """
+    Summaries of many users at once, for other services to hydrate them.
+    - **ids**, **emails**: the users to look up, together at most
+    `USERS_BATCH_MAX_SIZE`. The ones of no user are listed in `missing` and
+    the ones of blocked users in `blocked`.
+    """
+    if len(query.ids) + len(query.emails) > USERS_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {USERS_BATCH_MAX_SIZE} ids and emails can be looked up",
+        )
+    return ORJSONResponse(
+        await run_in_session(
+            db, users_service.fetch_user_summaries, query.ids, query.emails
+        )
+    )
+
+
 @router.post(
     "/signup", status_code=status.HTTP_201_CREATED, response_model=schemas.User
 )
-def create_account(user_data: schemas.SignUpSchema, db: Session = Depends(get_db)):
+async def create_account(
+    user_data: schemas.SignUpSchema, db: DbSession = Depends(get_session)
+):
     try:
         logging.info(f"user_data: {user_data}")
-        user = users_service.signup(db=db, new_user=user_data)
+        user = await run_in_session(db, users_service.signup, new_user=user_data)
         return user
     except users_service.ExistentUserError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
@@ -74,16 +227,18 @@ def create_account(user_data: schemas.SignUpSchema, db: Session = Depends(get_db
     status_code=status.HTTP_201_CREATED,
     response_model=schemas.User,
 )
-def set_location(
+async def set_location(
     user_id: UUID,
     location: schemas.Location = Body(examples={"location": "ARG"}),
-    db: Session = Depends(get_db),
+    db: DbSession = Depends(get_session),
 ):
     """
     - **location**: Location must be in  ISO 3166-1 alpha-3 format, e.g: ARG for Argentina.
     """
     try:
-        return users_service.set_location(db, user_id, location.location)
+        return await run_in_session(
+            db, users_service.set_location, user_id, location.location
+        )
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
 
@@ -93,11 +248,15 @@ def set_location(
     status_code=status.HTTP_201_CREATED,
     response_model=schemas.User,
 )
-def set_interests(
-    user_id: UUID, interest_list: list[schemas.Interests], db: Session = Depends(get_db)
+async def set_interests(
+    user_id: UUID,
+    interest_list: list[schemas.Interests],
+    db: DbSession = Depends(get_session),
 ):
     try:
-        return users_service.set_interests(db, user_id, interest_list)
+        return await run_in_session(
+            db, users_service.set_interests, user_id, interest_list
+        )
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
 
@@ -105,24 +264,37 @@ def set_interests(
 @router.post(
     "/goals/{user_id}", status_code=status.HTTP_201_CREATED, response_model=schemas.User
 )
-def set_goals(user_id: UUID, goals_list: list[str], db: Session = Depends(get_db)):
+async def set_goals(
+    user_id: UUID, goals_list: list[str], db: DbSession = Depends(get_session)
+):
     try:
-        return users_service.set_goals(db, user_id, goals_list)
+        return await run_in_session(db, users_service.set_goals, user_id, goals_list)
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
 
 
 @router.post("/follow/{source_id}", status_code=status.HTTP_201_CREATED)
-def follow(
+async def follow(
     source_id: UUID,
     followed_id: UUID = Body(embed=False),
-    db: Session = Depends(get_db),
-):
+    full: bool = False,
+    db: DbSession = Depends(get_session),
+) -> schemas.Follow | schemas.User:
+    """
+    - **full**: respond with the whole follower user instead of the follow
+    and the new counts.
+    """
     logging.debug("received followed_id: ", followed_id)
     if source_id == followed_id:
         raise HTTPException(status_code=403, detail="A user cannot follow himself")
     try:
-        return users_service.follow(db=db, source_id=source_id, followed_id=followed_id)
+        return await run_in_session(
+            db,
+            users_service.follow,
+            source_id=source_id,
+            followed_id=followed_id,
+            full=full,
+        )
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
     except NotAllowed as e:
@@ -130,14 +302,25 @@ def follow(
 
 
 @router.delete("/follow/{source_id}")
-def unfollow(
-    source_id: UUID, followed_id: UUID = Query(), db: Session = Depends(get_db)
-):
+async def unfollow(
+    source_id: UUID,
+    followed_id: UUID = Query(),
+    full: bool = False,
+    db: DbSession = Depends(get_session),
+) -> schemas.Follow | schemas.User:
+    """
+    - **full**: respond with the whole follower user instead of the removed
+    follow and the new counts.
+    """
     if source_id == followed_id:
         raise HTTPException(status_code=403, detail="A user cannot unfollow himself")
     try:
-        return users_service.unfollow(
-            db=db, source_id=source_id, followed_id=followed_id
+        return await run_in_session(
+            db,
+            users_service.unfollow,
+            source_id=source_id,
+            followed_id=followed_id,
+            full=full,
         )
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
@@ -146,29 +329,96 @@ def unfollow(
 
 
 @router.get("/followers/{user_id}", response_model=list[schemas.User])
-def get_followers(user_id: UUID, db: Session = Depends(get_db)):
+async def get_followers(
+    user_id: UUID,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    db: DbSession = Depends(get_session),
+):
+    """
+    - **limit**: maximum amount of followers in the page.
+    - **cursor**: the `X-Next-Cursor` header of the previous page, the header
+    is missing on the last page.
+    """
     try:
-        return users_service.get_followers(db, user_id)
+        followers, next_cursor = await run_in_session(
+            db, users_service.get_followers, user_id, limit, cursor
+        )
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    return ORJSONResponse(followers, headers=__cursor_headers(next_cursor))
 
 
 @router.get("/followeds/{user_id}", response_model=list[schemas.User])
-def get_followeds(user_id: UUID, db: Session = Depends(get_db)):
+async def get_followeds(
+    user_id: UUID,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    db: DbSession = Depends(get_session),
+):
+    """
+    - **limit**: maximum amount of followeds in the page.
+    - **cursor**: the `X-Next-Cursor` header of the previous page, the header
+    is missing on the last page.
+    """
+    try:
+        followeds, next_cursor = await run_in_session(
+            db, users_service.get_followeds, user_id, limit, cursor
+        )
+    except UserNotFound as e:
+        raise HTTPException(status_code=404, detail=e.message)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    return ORJSONResponse(followeds, headers=__cursor_headers(next_cursor))
+
+
+def __stream_export(export, user_id: UUID) -> StreamingResponse:
+    # The request session is closed before a streamed body is sent, so the
+    # export keeps its own session open until the last line
+    db = SessionLocal()
     try:
-        return users_service.get_followeds(db, user_id)
+        lines = export(db, user_id)
     except UserNotFound as e:
+        db.close()
         raise HTTPException(status_code=404, detail=e.message)
 
+    def closing(lines: Iterator[str], db: Session) -> Iterator[str]:
+        try:
+            yield from lines
+        finally:
+            db.close()
+
+    return StreamingResponse(closing(lines, db), media_type="application/x-ndjson")
+
+
+@router.get("/followers/{user_id}/export")
+def export_followers(user_id: UUID) -> StreamingResponse:
+    """
+    Every follower of the user, one JSON user per line.
+    """
+    return __stream_export(users_service.export_followers, user_id)
+
+
+@router.get("/followeds/{user_id}/export")
+def export_followeds(user_id: UUID) -> StreamingResponse:
+    """
+    Every user the user follows, one JSON user per line.
+    """
+    return __stream_export(users_service.export_followeds, user_id)
+
 
 @router.post(
     "/admin/signup", status_code=status.HTTP_201_CREATED, response_model=schemas.Admin
 )
-def create_admin_account(
-    admin_data: schemas.SignUpAdminSchema, db: Session = Depends(get_db)
+async def create_admin_account(
+    admin_data: schemas.SignUpAdminSchema, db: DbSession = Depends(get_session)
 ):
     try:
-        admin = users_service.signup_admin(db=db, new_admin=admin_data)
+        admin = await run_in_session(
+            db, users_service.signup_admin, new_admin=admin_data
+        )
         return admin
     except users_service.ExistentUserError as e:
         print(e.message)
@@ -176,8 +426,10 @@ def create_admin_account(
 
 
 @router.get("/admin/{admin_id}", response_model=schemas.Admin)
-def get_admin(user_id: UUID, db: Session = Depends(get_db)) -> schemas.Admin:
-    admin = users_service.fetch_admin_by_id(db=db, id=user_id)
+async def get_admin(
+    user_id: UUID, db: DbSession = Depends(get_session)
+) -> schemas.Admin:
+    admin = await run_in_session(db, users_service.fetch_admin_by_id, id=user_id)
     if not admin:
         raise HTTPException(status_code=404, detail="User not found")
     return admin
@@ -189,35 +441,54 @@ def get_interests():
 
 
 @router.put("/name/{user_id}", response_model=schemas.User)
-def update_name(user_id: UUID, name: str = Query(), db: Session = Depends(get_db)):
+async def update_name(
+    user_id: UUID, name: str = Query(), db: DbSession = Depends(get_session)
+):
     try:
-        return users_service.update_name(db, user_id, name)
+        return await run_in_session(db, users_service.update_name, user_id, name)
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
 
 
 @router.get("/recommendations/{user_id}")
-def get_recommendations(
-    user_id: UUID, db: Session = Depends(get_db)
+async def get_recommendations(
+    user_id: UUID,
+    res: Response,
+    limit: int = Query(20, ge=1, le=RECOMMENDATIONS_PER_USER),
+    cursor: str | None = None,
+    db: DbSession = Depends(get_session),
 ) -> list[schemas.RecommendationUser]:
+    """
+    - **limit**: maximum amount of recommendations in the page, the best
+    scored first.
+    - **cursor**: the `X-Next-Cursor` header of the previous page, the header
+    is missing on the last page.
+    """
     try:
-        return users_service.get_recommendations(db, user_id)
+        recommendations, next_cursor = await run_in_session(
+            db, users_service.get_recommendations, user_id, limit, cursor
+        )
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    if next_cursor:
+        res.headers["X-Next-Cursor"] = next_cursor
+    return recommendations
 
 
 @router.patch("/block/{user_id}")
-def block(user_id: UUID, db: Session = Depends(get_db)) -> schemas.User:
+async def block(user_id: UUID, db: DbSession = Depends(get_session)) -> schemas.User:
     try:
-        return users_service.block_user(db, user_id)
+        return await run_in_session(db, users_service.block_user, user_id)
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
 
 
 @router.patch("/unblock/{user_id}")
-def unblock(user_id: UUID, db: Session = Depends(get_db)) -> schemas.User:
+async def unblock(user_id: UUID, db: DbSession = Depends(get_session)) -> schemas.User:
     try:
-        return users_service.unblock_user(db, user_id)
+        return await run_in_session(db, users_service.unblock_user, user_id)
     except UserNotFound as e:
         raise HTTPException(status_code=404, detail=e.message)
 
@@ -231,5 +502,6 @@ def ping(res: Response):
 @router.put("/apiKey")
 def set_api_key(api_key: str):
     os.environ["API_KEY"] = api_key
+    registry.registration.api_key = api_key
     print(f"New API Key: {os.getenv('API_KEY')}")
     return {"apiKey": api_key}
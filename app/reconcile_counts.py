@@ -0,0 +1,22 @@
+"""
+Recomputes the followers and followeds counts of every user from the
+followers table. Follows written without going through the service, like a
+bulk import or a restore, leave them wrong until this runs.
+
+Usage:
+    ENV=<env> python -m app.reconcile_counts
+"""
+
+from .repositories import users
+from .repositories.database import SessionLocal
+
+
+def main():
+    with SessionLocal() as db:
+        # Notifies the workers, which drop every cached profile
+        fixed = users.reconcile_follow_counts(db)
+    print(f"Fixed the follow counts of {fixed} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,5 @@ from app.repositories.models import UsersGoals
 from app.repositories.models import UserInterests
 from app.repositories.models import UserTwitsnaps
 from app.repositories.models import Admins
+from app.repositories.models import UserRecommendations
+from app.repositories.models import UserRecommendationsComputed
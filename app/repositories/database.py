@@ -1,18 +1,187 @@
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import create_engine
-from ..utils.config import database_url
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, TypeVar
+from uuid import uuid4
 
-engine = create_engine(database_url)
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy import NullPool, Pool, QueuePool, create_engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from ..utils.config import (
+    DB_MAX_OVERFLOW,
+    DB_MODE,
+    DB_PGBOUNCER,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_SYNC_MAX_OVERFLOW,
+    DB_SYNC_POOL_SIZE,
+    database_url,
+    env,
+)
+
+T = TypeVar("T")
+
+DbSession = Session | AsyncSession
+
+pool_options = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# In async mode the endpoints use the asyncpg pool, and this one only serves
+# the exports and background jobs. The tests keep the whole pool, as their
+# helpers hold sync sessions until they are garbage collected.
+sync_pool_options = (
+    {
+        **pool_options,
+        "pool_size": DB_SYNC_POOL_SIZE,
+        "max_overflow": DB_SYNC_MAX_OVERFLOW,
+    }
+    if DB_MODE == "async" and env != "test"
+    else pool_options
+)
+
+engine = create_engine(database_url, **sync_pool_options)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
+class PoolMetrics:
+    """
+    Time the sessions spend waiting for a connection of the pool, plus how
+    many of them are waiting right now.
+    """
+
+    def __init__(self):
+        # Sessions wait for their connection on the threadpool's threads
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @contextmanager
+    def waiting_for_connection(self):
+        with self._lock:
+            self.waiting += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wait = time.perf_counter() - start
+            with self._lock:
+                self.waiting -= 1
+                self.checkouts += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+    def stats(self, pool: Pool) -> dict:
+        with self._lock:
+            stats = {
+                "pool": type(pool).__name__,
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "avg_wait_ms": (
+                    self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0
+                ),
+                "max_wait_ms": self.max_wait * 1000,
+            }
+        if isinstance(pool, QueuePool):
+            stats["size"] = pool.size()
+            stats["checked_out"] = pool.checkedout()
+            stats["checked_in"] = pool.checkedin()
+            stats["overflow"] = max(pool.overflow(), 0)
+        return stats
+
+
+pool_metrics = PoolMetrics()
+
+
 def get_db():
     db = SessionLocal()
     try:
+        # Checks out the connection upfront to measure the wait for it
+        with pool_metrics.waiting_for_connection():
+            db.connection()
         yield db
     finally:
         db.close()
 
+
+def async_database_url(url: str) -> str:
+    """
+    Same database as `url` through the asyncpg driver, which takes the
+    libpq `sslmode` option as `ssl`.
+    """
+    url = make_url(url).set(drivername="postgresql+asyncpg")
+    if "sslmode" in url.query:
+        ssl = url.query["sslmode"]
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": ssl})
+    return url.render_as_string(hide_password=False)
+
+
+async_engine = None
+AsyncSessionLocal = None
+
+if DB_MODE == "async":
+    # asyncpg connections belong to the event loop that opened them, and the
+    # test client may run each request in a different one
+    async_pool_options = {"poolclass": NullPool} if env == "test" else pool_options
+    if DB_PGBOUNCER:
+        async_pool_options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    async_engine = create_async_engine(
+        async_database_url(database_url), **async_pool_options
+    )
+    AsyncSessionLocal = async_sessionmaker(
+        autocommit=False, autoflush=False, bind=async_engine
+    )
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        with pool_metrics.waiting_for_connection():
+            await db.connection()
+        yield db
+
+
+def pool_stats() -> dict:
+    stats = pool_metrics.stats((async_engine or engine).pool)
+    if async_engine is not None and isinstance(engine.pool, QueuePool):
+        stats["sync_pool"] = {
+            "size": engine.pool.size(),
+            "checked_out": engine.pool.checkedout(),
+            "overflow": max(engine.pool.overflow(), 0),
+        }
+    return stats
+
+
+# Session dependency of the endpoints, according to DB_MODE
+get_session = get_async_db if DB_MODE == "async" else get_db
+
+
+async def run_in_session(
+    db: Session | AsyncSession, fn: Callable[..., T], *args, **kwargs
+) -> T:
+    """
+    Runs `fn(db, *args, **kwargs)`, where `fn` is one of the repository or
+    service functions, without blocking the event loop.
+
+    With an `AsyncSession`, `fn` gets its sync facade and every query it runs,
+    lazy loads included, goes through asyncpg on the event loop. With a
+    `Session`, `fn` runs on the threadpool.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
@@ -0,0 +1,31 @@
+"""Users twitsnaps changed trigger
+
+Revision ID: a4d9c2f7b6e1
+Revises: f1c7a3e9d5b2
+Create Date: 2026-10-19 00:41:27.318560
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.repositories.models import USERS_TWITSNAPS_CHANGED_TRIGGER
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d9c2f7b6e1'
+down_revision: Union[str, None] = 'f1c7a3e9d5b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Bumps the version of the users whose twitsnaps change and notifies it
+    for statement in USERS_TWITSNAPS_CHANGED_TRIGGER:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER users_twitsnaps_changed ON users_twitsnaps")
+    op.execute("DROP FUNCTION users_twitsnaps_changed()")
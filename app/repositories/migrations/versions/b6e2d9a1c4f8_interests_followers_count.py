@@ -0,0 +1,38 @@
+"""Interests followers count
+
+Revision ID: b6e2d9a1c4f8
+Revises: a4d9c2f7b6e1
+Create Date: 2026-10-19 10:14:52.601873
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6e2d9a1c4f8'
+down_revision: Union[str, None] = 'a4d9c2f7b6e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users_interests', sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        """
+        UPDATE users_interests
+        SET followers_count = users.followers_count
+        FROM users
+        WHERE users.id = users_interests.id_user
+        """
+    )
+    op.create_index('ix_users_interests_interest_followers_count', 'users_interests', ['interest', sa.text('followers_count DESC'), 'id_user'], unique=False)
+    op.drop_index('ix_users_interests_interest', table_name='users_interests')
+
+
+def downgrade() -> None:
+    op.create_index('ix_users_interests_interest', 'users_interests', ['interest'], unique=False)
+    op.drop_index('ix_users_interests_interest_followers_count', table_name='users_interests')
+    op.drop_column('users_interests', 'followers_count')
@@ -1,5 +1,22 @@
-from sqlalchemy import Column, ForeignKey, String, Boolean, UUID, Table, Enum, text
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    DDL,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Boolean,
+    UUID,
+    Table,
+    Enum,
+    event,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.orm import column_property, relationship
 
 from ..repositories.database import Base
 from ..utils.schemas import Interests
@@ -20,13 +37,33 @@ followers_table = Table(
         UUID,
         ForeignKey("users.id", ondelete="CASCADE"),
         primary_key=True,
-        index=True,
     ),
+    # The primary key already serves followeds in order, this one serves
+    # followers in order
+    Index("ix_followers_followed_id_follower_id", "followed_id", "follower_id"),
 )
 
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Trigram index for the similarity search by user name
+        Index(
+            "ix_users_user_trgm",
+            "user",
+            postgresql_using="gin",
+            postgresql_ops={"user": "gin_trgm_ops"},
+        ),
+        # The most followed users first, as the recommendation candidates
+        # sharing an interest and, by location, the ones in the same one
+        Index("ix_users_followers_count", text("followers_count DESC"), "id"),
+        Index(
+            "ix_users_location_followers_count",
+            "location",
+            text("followers_count DESC"),
+            "id",
+        ),
+    )
 
     id = Column(UUID, primary_key=True, server_default=text("uuid_generate_v4()"))
     email = Column(String, unique=True, index=True)
@@ -34,6 +71,14 @@ class User(Base):
     name = Column(String)
     location = Column(String)
     is_blocked = Column(Boolean, server_default="False")
+    # Kept up to date on every follow and unfollow, recomputed from the
+    # followers table by `python -m app.reconcile_counts`
+    followers_count = Column(Integer, nullable=False, server_default="0")
+    followeds_count = Column(Integer, nullable=False, server_default="0")
+    # Bumped by every change to the user, their follows included and their
+    # twitsnaps by the users_twitsnaps_changed trigger, it's the ETag of
+    # their profile
+    version = Column(Integer, nullable=False, server_default="1")
 
     goals = relationship("UsersGoals", cascade="all, delete", back_populates="user")
     interests = relationship(
@@ -84,6 +129,15 @@ class UsersGoals(Base):
 
 class UserInterests(Base):
     __tablename__ = "users_interests"
+    __table_args__ = (
+        # Serves the most followed recommendation candidates of each interest
+        Index(
+            "ix_users_interests_interest_followers_count",
+            "interest",
+            text("followers_count DESC"),
+            "id_user",
+        ),
+    )
 
     id_user = Column(
         UUID, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
@@ -93,6 +147,8 @@ class UserInterests(Base):
         nullable=False,
         primary_key=True,
     )  # The user's interest, part of the composite key
+    # Copy of the user's followers_count, kept up to date along with it
+    followers_count = Column(Integer, nullable=False, server_default="0")
 
     user = relationship("User", back_populates="interests")
 
@@ -106,6 +162,77 @@ class UserTwitsnaps(Base):
     user = relationship("User", back_populates="twitsnaps")
 
 
+# The twitsnaps are written by their own service, so the database bumps the
+# version of their users and notifies the workers to drop them from the cache.
+# Shared with the migration that installs it, every statement can run again.
+USERS_TWITSNAPS_CHANGED_TRIGGER = (
+    """
+    CREATE OR REPLACE FUNCTION users_twitsnaps_changed() RETURNS trigger AS $$
+    BEGIN
+        UPDATE users SET version = version + 1
+        WHERE id IN (NEW.id_user, OLD.id_user);
+        PERFORM pg_notify('users_changes', 'twitsnaps:' || changed.id_user)
+        FROM (SELECT DISTINCT unnest(ARRAY[NEW.id_user, OLD.id_user])) AS
+            changed(id_user)
+        WHERE changed.id_user IS NOT NULL;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS users_twitsnaps_changed ON users_twitsnaps",
+    """
+    CREATE TRIGGER users_twitsnaps_changed
+    AFTER INSERT OR UPDATE OR DELETE ON users_twitsnaps
+    FOR EACH ROW EXECUTE FUNCTION users_twitsnaps_changed()
+    """,
+)
+for statement in USERS_TWITSNAPS_CHANGED_TRIGGER:
+    event.listen(UserTwitsnaps.__table__, "after_create", DDL(statement))
+
+
+class UserRecommendations(Base):
+    """Precomputed recommendations of each user, the best scored first"""
+
+    __tablename__ = "users_recommendations"
+
+    id_user = Column(UUID, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    id_recommended = Column(
+        UUID, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    score = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_users_recommendations_id_user_score", "id_user", "score"),
+    )
+
+
+class UserRecommendationsComputed(Base):
+    """
+    When the recommendations of each user were computed, -infinity for the
+    ones to compute first. A missing row means never computed or invalidated
+    since.
+    """
+
+    __tablename__ = "users_recommendations_computed"
+
+    id_user = Column(UUID, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    # Serves the rebuild, which computes the oldest recommendations first
+    computed_at = Column(
+        DateTime, nullable=False, server_default=func.now(), index=True
+    )
+
+
+# Loaded the first time it's accessed, or with `undefer_group("counts")`
+User.twitsnaps_count = column_property(
+    select(func.count())
+    .where(UserTwitsnaps.id_user == User.id)
+    .correlate_except(UserTwitsnaps)
+    .scalar_subquery(),
+    deferred=True,
+    group="counts",
+)
+
+
 class Admins(Base):
     __tablename__ = "admins"
 
@@ -1,10 +1,38 @@
 # from app.repositories.schemas import NewUser, User
+from datetime import datetime
+from typing import Iterator
 from uuid import uuid4, UUID
+
+import numpy as np
+from numpy.lib.recfunctions import repack_fields
 from pydantic import EmailStr
-from sqlalchemy import and_, func, or_, select, text
-from sqlalchemy.orm import Session
+from sqlalchemy import (
+    Integer,
+    String,
+    any_,
+    bindparam,
+    case,
+    cast,
+    delete,
+    func,
+    or_,
+    select,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.orm import Session, selectinload, undefer_group
 
 from app.utils import schemas
+from app.utils.config import (
+    RECOMMENDATIONS_CANDIDATES_PER_SOURCE,
+    RECOMMENDATIONS_FOLLOWS_WEIGHT,
+    RECOMMENDATIONS_INTERESTS_WEIGHT,
+    RECOMMENDATIONS_LOCATION_WEIGHT,
+    RECOMMENDATIONS_PER_USER,
+    SEARCH_SIMILARITY_THRESHOLD,
+)
 from app.utils.errors import NotAllowed, UserNotFound
 
 from . import models
@@ -15,20 +43,159 @@ from . import models
 # logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
 
 
-def get_users(db: Session) -> list[models.User]:
-    return db.query(models.User).all()
+# Loads what a User response needs for a whole list of users in a constant
+# number of queries, instead of several lazy loads per user
+LIST_LOADING = (
+    selectinload(models.User.goals),
+    selectinload(models.User.interests),
+    undefer_group("counts"),
+)
+
+# Channel notified of every committed change to a user as "<kind>:<id>", or
+# "<kind>:" for a change to every user, so each worker drops what it caches
+# about them
+CHANGES_CHANNEL = "users_changes"
+
+
+def __notify_changes(db: Session, kind: str, *user_ids: UUID):
+    """
+    Notifies "kind:id:..." with the ids of the changed users, in the order
+    the kind gives them, like the follower then the followed, or "kind:"
+    when every user changed
+    """
+    # Postgres only delivers it if the transaction commits
+    payload = ":".join([kind, *map(str, user_ids)]) if user_ids else f"{kind}:"
+    db.execute(select(func.pg_notify(CHANGES_CHANNEL, payload)))
+
+
+def get_users(db: Session, limit: int, after: UUID | None = None) -> list[models.User]:
+    query = db.query(models.User).options(*LIST_LOADING)
+    if after:
+        # Seeks past the last user of the previous page through the primary
+        # key index instead of skipping rows with an offset
+        query = query.filter(models.User.id > after)
+    return query.order_by(models.User.id).limit(limit).all()
+
+
+def __similar_users(db: Session, query: str):
+    # `%` compares against pg_trgm.similarity_threshold and, unlike a
+    # similarity() filter, can use the trigram index on users.user. The
+    # threshold is set for the current transaction only.
+    db.execute(
+        select(
+            func.set_config(
+                "pg_trgm.similarity_threshold", str(SEARCH_SIMILARITY_THRESHOLD), True
+            )
+        )
+    )
+    return (
+        db.query(models.User)
+        .options(*LIST_LOADING)
+        .filter(models.User.user.op("%")(query))
+        .order_by(func.similarity(models.User.user, query).desc())
+    )
 
 
 def search_users(db: Session, query: str, limit: int) -> list[models.User]:
+    return __similar_users(db, query).limit(limit).all()
+
+
+def get_searchable_users(db: Session) -> Iterator[tuple[UUID, str, str]]:
+    """(id, user, name) of every user that isn't blocked, streamed in chunks"""
     return (
-        db.query(models.User)
-        .filter(func.similarity(models.User.user, query) > 0.1)
-        .order_by(func.similarity(models.User.user, query).desc())
-        .limit(limit)
-        .all()
+        db.query(models.User.id, models.User.user, models.User.name)
+        .filter(models.User.is_blocked.isnot(True))
+        .yield_per(10_000)
+    )
+
+
+def get_searchable_user(db: Session, user_id: UUID) -> tuple[UUID, str, str] | None:
+    """(id, user, name) of the user, None if it's blocked or doesn't exist"""
+    return (
+        db.query(models.User.id, models.User.user, models.User.name)
+        .filter(models.User.id == user_id, models.User.is_blocked.isnot(True))
+        .first()
     )
 
 
+class __CopiedRows:
+    """
+    File for psycopg2's copy_expert, taking the `fields` of the rows of a
+    binary COPY, all of the fixed size `dtype`, into arrays as they arrive
+    """
+
+    # The signature, the flags and an empty header extension
+    HEADER = 19
+
+    def __init__(self, dtype: np.dtype, fields: list[str]):
+        self.dtype, self.fields = dtype, fields
+        self.buffer = bytearray()
+        self.skip = self.HEADER
+        self.chunks: list[np.ndarray] = []
+
+    def write(self, data: bytes):
+        self.buffer += data
+        if len(self.buffer) >= 1 << 22:
+            self.take()
+
+    def take(self):
+        count = (len(self.buffer) - self.skip) // self.dtype.itemsize
+        if count > 0:
+            rows = np.frombuffer(self.buffer, self.dtype, count, self.skip)
+            self.chunks.append(repack_fields(rows[self.fields]))
+            del rows
+            del self.buffer[: self.skip + count * self.dtype.itemsize]
+            self.skip = 0
+
+    def rows(self) -> np.ndarray:
+        # What is left is the trailer
+        self.take()
+        empty = repack_fields(np.zeros(0, self.dtype)[self.fields])
+        return np.concatenate([empty, *self.chunks])
+
+
+def __copy_rows(db: Session, query, dtype: np.dtype, fields: list[str]):
+    copied = __CopiedRows(dtype, fields)
+    sql = query.compile(dialect=db.get_bind().dialect)
+    with db.connection().connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY ({sql}) TO STDOUT (FORMAT binary)", copied)
+    return copied.rows()
+
+
+# Binary COPY rows: the field count, then each field's length and 16 bytes
+USER_ID_ROW = np.dtype([("fields", ">i2"), ("id_length", ">i4"), ("id", "V16")])
+FOLLOW_ROW = np.dtype(
+    [
+        ("fields", ">i2"),
+        ("follower_length", ">i4"),
+        ("follower", "V16"),
+        ("followed_length", ">i4"),
+        ("followed", "V16"),
+    ]
+)
+
+
+def get_all_user_ids(db: Session) -> np.ndarray:
+    """
+    Id of every user in order, as their 16 bytes, copied straight into an
+    array
+    """
+    query = select(models.User.id).order_by(models.User.id)
+    return __copy_rows(db, query, USER_ID_ROW, ["id"])["id"]
+
+
+def get_all_follows(db: Session) -> np.ndarray:
+    """
+    Every follow ordered by follower then followed, as the 16 bytes of the
+    "follower" and "followed" ids, copied straight into an array
+    """
+    follows = models.followers_table.c
+    query = select(follows.follower_id, follows.followed_id).order_by(
+        follows.follower_id, follows.followed_id
+    )
+    return __copy_rows(db, query, FOLLOW_ROW, ["follower", "followed"])
+
+
 def insert_user(db: Session, new_user: models.User) -> models.User:
     db_user = models.User(
         id=uuid4(),
@@ -44,6 +211,7 @@ def insert_user(db: Session, new_user: models.User) -> models.User:
     )
 
     db.add(db_user)
+    __notify_changes(db, "signup", db_user.id)
     db.commit()
     db.refresh(db_user)
     return db_user
@@ -82,6 +250,32 @@ def get_user_by_id(db: Session, user_id: UUID) -> models.User:
     return user
 
 
+def get_user_summaries(db: Session, ids: list[UUID], emails: list[str]):
+    """
+    The id, email, user name, name and whether they are blocked of the users
+    with any of the ids or emails, in one query whatever the amount of them
+    """
+    ids = bindparam("ids", ids, type_=ARRAY(models.User.id.type))
+    emails = bindparam("emails", emails, type_=ARRAY(models.User.email.type))
+    return db.execute(
+        select(
+            models.User.id,
+            models.User.email,
+            models.User.user,
+            models.User.name,
+            models.User.is_blocked,
+        ).where(or_(models.User.id == any_(ids), models.User.email == any_(emails)))
+    ).all()
+
+
+def get_user_version_by_id(db: Session, user_id: UUID) -> int | None:
+    return db.scalar(select(models.User.version).where(models.User.id == user_id))
+
+
+def get_user_version_by_email(db: Session, email: EmailStr) -> int | None:
+    return db.scalar(select(models.User.version).where(models.User.email == email))
+
+
 def get_admin_by_id(db: Session, admin_id: UUID) -> models.Admins:
     admin = db.query(models.Admins).filter(models.Admins.id == admin_id).first()
     return admin
@@ -93,12 +287,13 @@ def search_followeds(
     user: models.User = get_user_by_id(db, user_id)
     if not user:
         raise UserNotFound("No user was found for the given id")
-    followeds = [followed.id for followed in user.followeds]
     return (
-        db.query(models.User)
-        .filter(models.User.id.in_(followeds))
-        .filter(func.similarity(models.User.user, query) > 0.1)
-        .order_by(func.similarity(models.User.user, query).desc())
+        __similar_users(db, query)
+        .join(
+            models.followers_table,
+            models.followers_table.c.followed_id == models.User.id,
+        )
+        .filter(models.followers_table.c.follower_id == user_id)
         .limit(limit)
         .all()
     )
@@ -116,6 +311,9 @@ def set_location(db: Session, user_id: UUID, location: str) -> models.User:
         raise UserNotFound()
 
     user.location = location
+    user.version = models.User.version + 1
+    __invalidate_recommendations(db, user.id)
+    __notify_changes(db, "location", user.id)
     db.commit()
     db.refresh(user)
     return user
@@ -128,7 +326,12 @@ def set_interests(
     if not user:
         raise UserNotFound()
 
+    for interest in interests:
+        interest.followers_count = user.followers_count
     user.interests.extend(interests)
+    user.version = models.User.version + 1
+    __invalidate_recommendations(db, user.id)
+    __notify_changes(db, "interests", user.id)
     db.commit()
     db.refresh(user)
     return user
@@ -140,77 +343,227 @@ def set_goals(db: Session, user_id: UUID, goals: list[models.UsersGoals]):
         raise UserNotFound()
 
     user.goals.extend(goals)
+    user.version = models.User.version + 1
+    __notify_changes(db, "goals", user.id)
     db.commit()
     db.refresh(user)
 
     return user
 
 
-def __user_is_following(follower_user: models.User, followed_user: models.User) -> bool:
-    return True if followed_user in frozenset(follower_user.followeds) else False
+def __follow_users(
+    db: Session, source_id: UUID, followed_id: UUID
+) -> tuple[models.User, models.User]:
+    """The follower and followed users, both fetched by id in one query"""
+    source_id, followed_id = UUID(str(source_id)), UUID(str(followed_id))
+    found = {
+        user.id: user
+        for user in db.query(models.User)
+        .filter(models.User.id.in_([source_id, followed_id]))
+        .all()
+    }
 
+    if source_id not in found:
+        raise UserNotFound("Follower user not found")
+    if followed_id not in found:
+        raise UserNotFound("Followed user not found")
 
-def add_follower(db: Session, source_id: UUID, followed_id: str) -> models.User:
-    source_user = get_user_by_id(db=db, user_id=source_id)
+    return found[source_id], found[followed_id]
 
-    if not source_user:
-        raise UserNotFound("Follower user not found")
 
-    followed_user = get_user_by_id(db=db, user_id=followed_id)
+def __update_follow_counts(db: Session, follower_id: UUID, followed_id: UUID, by: int):
+    db.execute(
+        update(models.User)
+        .where(models.User.id.in_([follower_id, followed_id]))
+        .values(
+            followeds_count=models.User.followeds_count
+            + case((models.User.id == follower_id, by), else_=0),
+            followers_count=models.User.followers_count
+            + case((models.User.id == followed_id, by), else_=0),
+            version=models.User.version + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(
+        update(models.UserInterests)
+        .where(models.UserInterests.id_user == followed_id)
+        .values(followers_count=models.UserInterests.followers_count + by)
+        .execution_options(synchronize_session=False)
+    )
 
-    if not followed_user:
-        raise UserNotFound("Followed user not found")
 
-    if __user_is_following(follower_user=source_user, followed_user=followed_user):
+def add_follower(db: Session, source_id: UUID, followed_id: str) -> models.User:
+    source_user, followed_user = __follow_users(db, source_id, followed_id)
+
+    inserted = db.execute(
+        insert(models.followers_table)
+        .values(follower_id=source_user.id, followed_id=followed_user.id)
+        .on_conflict_do_nothing()
+    ).rowcount
+    if not inserted:
         raise NotAllowed(message=f"The user is already following {followed_user.name}")
 
-    followed_user.followers.append(source_user)
-
+    __update_follow_counts(db, source_user.id, followed_user.id, 1)
+    __invalidate_recommendations(db, source_user.id)
+    __notify_changes(db, "follow", source_user.id, followed_user.id)
     db.commit()
-    db.refresh(followed_user)
-    db.refresh(source_user)
 
     return source_user
 
 
 def remove_follow(db: Session, source_id: UUID, followed_id: str) -> models.User:
-    source_user = get_user_by_id(db=db, user_id=source_id)
-
-    if not source_user:
-        raise UserNotFound("Follower user not found")
-
-    followed_user = get_user_by_id(db=db, user_id=followed_id)
-
-    if not followed_user:
-        raise UserNotFound("Followed user not found")
-
-    if not __user_is_following(follower_user=source_user, followed_user=followed_user):
+    source_user, followed_user = __follow_users(db, source_id, followed_id)
+
+    follows = models.followers_table.c
+    deleted = db.execute(
+        delete(models.followers_table)
+        .where(follows.follower_id == source_user.id)
+        .where(follows.followed_id == followed_user.id)
+    ).rowcount
+    if not deleted:
         raise NotAllowed(
             message=f"Cannot unfollow an unfollowed user: {followed_user.name}"
         )
 
-    if followed_user in source_user.followeds:
-        source_user.followeds.remove(followed_user)
-
+    __update_follow_counts(db, source_user.id, followed_user.id, -1)
+    __invalidate_recommendations(db, source_user.id)
+    __notify_changes(db, "unfollow", source_user.id, followed_user.id)
     db.commit()
-    db.refresh(followed_user)
-    db.refresh(source_user)
 
     return source_user
 
 
-def get_followers(db: Session, user_id: UUID) -> models.User:
+def get_follow_counts(
+    db: Session, follower_id: UUID, followed_id: UUID
+) -> tuple[int, int]:
+    """Followeds of the follower and followers of the followed, in one query"""
+    counts = {
+        row.id: row
+        for row in db.query(
+            models.User.id, models.User.followers_count, models.User.followeds_count
+        ).filter(models.User.id.in_([follower_id, followed_id]))
+    }
+    return counts[follower_id].followeds_count, counts[followed_id].followers_count
+
+
+def reconcile_follow_counts(db: Session) -> int:
+    """
+    Recomputes the followers and followeds counts of every user from the
+    followers table, returns how many users had them wrong
+    """
+    fixed = db.execute(
+        text(
+            """
+            UPDATE users
+            SET followers_count = counts.followers,
+                followeds_count = counts.followeds,
+                version = users.version + 1
+            FROM (
+                SELECT users.id,
+                       COALESCE(followers.amount, 0) AS followers,
+                       COALESCE(followeds.amount, 0) AS followeds
+                FROM users
+                LEFT JOIN (
+                    SELECT followed_id AS id, COUNT(*) AS amount
+                    FROM followers GROUP BY followed_id
+                ) followers ON (followers.id = users.id)
+                LEFT JOIN (
+                    SELECT follower_id AS id, COUNT(*) AS amount
+                    FROM followers GROUP BY follower_id
+                ) followeds ON (followeds.id = users.id)
+            ) counts
+            WHERE users.id = counts.id
+            AND (users.followers_count, users.followeds_count)
+                IS DISTINCT FROM (counts.followers, counts.followeds)
+            """
+        )
+    ).rowcount
+    db.execute(
+        text(
+            """
+            UPDATE users_interests
+            SET followers_count = users.followers_count
+            FROM users
+            WHERE users.id = users_interests.id_user
+            AND users_interests.followers_count != users.followers_count
+            """
+        )
+    )
+    if fixed:
+        __notify_changes(db, "counts")
+    db.commit()
+    return fixed
+
+
+def get_followers(
+    db: Session, user_id: UUID, limit: int, after: UUID | None = None
+) -> list[models.User]:
     user = get_user_by_id(db, user_id)
     if not user:
         raise UserNotFound("No user was found for the given id")
-    return user.followers
+    follower_id = models.followers_table.c.follower_id
+    query = (
+        db.query(models.User)
+        .join(models.followers_table, follower_id == models.User.id)
+        .filter(models.followers_table.c.followed_id == user_id)
+    )
+    if after:
+        query = query.filter(follower_id > after)
+    # Ordered by the follows table itself so the (followed_id, follower_id)
+    # index serves both the filter and the order
+    return query.order_by(follower_id).options(*LIST_LOADING).limit(limit).all()
 
 
-def get_followeds(db: Session, user_id: UUID) -> models.User:
+def get_followeds(
+    db: Session, user_id: UUID, limit: int, after: UUID | None = None
+) -> list[models.User]:
     user = get_user_by_id(db, user_id)
     if not user:
         raise UserNotFound("No user was found for the given id")
-    return user.followeds
+    followed_id = models.followers_table.c.followed_id
+    query = (
+        db.query(models.User)
+        .join(models.followers_table, followed_id == models.User.id)
+        .filter(models.followers_table.c.follower_id == user_id)
+    )
+    if after:
+        query = query.filter(followed_id > after)
+    return query.order_by(followed_id).options(*LIST_LOADING).limit(limit).all()
+
+
+# The ids of the expanded lists are read as text, turning 100k rows into
+# UUID objects only for the response to turn them back into strings costs
+# more than the query
+def get_follower_ids(db: Session, user_id: UUID) -> list[str]:
+    follows = models.followers_table.c
+    return list(
+        db.scalars(
+            select(cast(follows.follower_id, String)).where(
+                follows.followed_id == user_id
+            )
+        )
+    )
+
+
+def get_followed_ids(db: Session, user_id: UUID) -> list[str]:
+    follows = models.followers_table.c
+    return list(
+        db.scalars(
+            select(cast(follows.followed_id, String)).where(
+                follows.follower_id == user_id
+            )
+        )
+    )
+
+
+def get_twitsnap_ids(db: Session, user_id: UUID) -> list[str]:
+    return list(
+        db.scalars(
+            select(cast(models.UserTwitsnaps.id_twitsnap, String)).where(
+                models.UserTwitsnaps.id_user == user_id
+            )
+        )
+    )
 
 
 def update_name(db: Session, user_id: UUID, name: str) -> models.User:
@@ -218,48 +571,225 @@ def update_name(db: Session, user_id: UUID, name: str) -> models.User:
     if not user:
         raise UserNotFound("No user was found for the given id")
     user.name = name
+    user.version = models.User.version + 1
+    __notify_changes(db, "name", user.id)
     db.commit()
     db.refresh(user)
     return user
 
 
-def get_recommendations(db: Session, user_id: UUID) -> list[models.User]:
+def __invalidate_recommendations(db: Session, user_id: UUID):
+    # The rebuild computes them again, until then the stored ones are served
+    db.query(models.UserRecommendationsComputed).filter(
+        models.UserRecommendationsComputed.id_user == user_id
+    ).delete()
+
+
+# The candidates are the most followed of the users followed by the followed
+# users, of the ones sharing each interest of the user and of the ones in the
+# same location, a bounded amount whatever the size of the country. Each one
+# is scored by the weighted sum of their followers among the followed users,
+# interests in common and location match, leaving out the user, the users
+# they follow and blocked users.
+__SCORE_RECOMMENDATIONS = """
+        WITH me AS (
+            SELECT id, location FROM users WHERE id = :user_id
+        ),
+        followeds AS (
+            SELECT followed_id AS id FROM followers WHERE follower_id = :user_id
+        ),
+        mutual AS ({mutual}),
+        candidates AS (
+            SELECT users.id, users.location
+            FROM mutual
+            JOIN users ON (users.id = mutual.id)
+            WHERE users.is_blocked IS NOT TRUE
+            UNION
+            SELECT users.id, users.location
+            FROM users_interests mine
+            CROSS JOIN LATERAL (
+                SELECT theirs.id_user
+                FROM users_interests theirs
+                WHERE theirs.interest = mine.interest
+                ORDER BY theirs.followers_count DESC, theirs.id_user
+                LIMIT :per_source
+            ) theirs
+            JOIN users ON (users.id = theirs.id_user)
+            WHERE mine.id_user = :user_id
+            AND users.is_blocked IS NOT TRUE
+            UNION
+            (
+                SELECT others.id, others.location
+                FROM me
+                JOIN users others ON (others.location = me.location)
+                WHERE others.is_blocked IS NOT TRUE
+                ORDER BY others.followers_count DESC, others.id
+                LIMIT :per_source
+            )
+        )
+        INSERT INTO users_recommendations (id_user, id_recommended, score)
+        SELECT me.id, candidate.id, scored.score
+        FROM me
+        CROSS JOIN candidates candidate
+        LEFT JOIN mutual ON (mutual.id = candidate.id)
+        CROSS JOIN LATERAL (
+            SELECT CAST(:follows_weight AS float) * COALESCE(mutual.follows, 0)
+                + CAST(:interests_weight AS float) * (
+                    SELECT COUNT(*)
+                    FROM users_interests mine
+                    JOIN users_interests theirs ON (theirs.interest = mine.interest)
+                    WHERE mine.id_user = me.id AND theirs.id_user = candidate.id
+                )
+                + CASE WHEN candidate.location = me.location
+                    THEN CAST(:location_weight AS float) ELSE 0 END AS score
+        ) scored
+        WHERE candidate.id != me.id
+        AND candidate.id NOT IN (SELECT id FROM followeds)
+        ORDER BY scored.score DESC, candidate.id DESC
+        LIMIT :size
+        ON CONFLICT (id_user, id_recommended) DO UPDATE SET score = EXCLUDED.score
+    """
+
+# The users followed by the most followed users, and by how many of them,
+# ranked like `SocialGraph.two_hop_candidates`
+__SCORE_RECOMMENDATIONS_FROM_FOLLOWS = text(
+    __SCORE_RECOMMENDATIONS.format(
+        mutual="""
+            SELECT theirs.followed_id AS id, COUNT(*) AS follows
+            FROM followeds
+            JOIN followers theirs ON (theirs.follower_id = followeds.id)
+            WHERE theirs.followed_id != :user_id
+            AND theirs.followed_id NOT IN (SELECT id FROM followeds)
+            GROUP BY theirs.followed_id
+            ORDER BY follows DESC, theirs.followed_id
+            LIMIT :per_source
+        """
+    )
+)
+
+# The same users, already found in the social graph
+__SCORE_RECOMMENDATIONS_FROM_GRAPH = text(
+    __SCORE_RECOMMENDATIONS.format(
+        mutual="""
+            SELECT * FROM unnest(:mutual_ids, :mutual_follows) AS mutual (id, follows)
+        """
+    )
+).bindparams(
+    bindparam("mutual_ids", type_=ARRAY(models.User.id.type)),
+    bindparam("mutual_follows", type_=ARRAY(Integer)),
+)
+
+
+def add_missing_recommendations(db: Session) -> int:
+    """
+    Marks as stale the users whose recommendations were never computed or
+    were invalidated since, for `lock_stale_recommendations` to find them
+    first, and returns how many were
+    """
+    computed = models.UserRecommendationsComputed
+    missing = select(models.User.id, text("'-infinity'::timestamp")).where(
+        ~select(computed.id_user).where(computed.id_user == models.User.id).exists()
+    )
+    return db.execute(
+        insert(computed)
+        .from_select([computed.id_user, computed.computed_at], missing)
+        .on_conflict_do_nothing(index_elements=[computed.id_user])
+    ).rowcount
+
+
+def lock_stale_recommendations(
+    db: Session, computed_before: datetime, limit: int
+) -> list[UUID]:
+    """
+    The users whose recommendations were computed before `computed_before`,
+    the oldest first, locked until the transaction ends. The ones another
+    transaction already locked are skipped.
+    """
+    computed = models.UserRecommendationsComputed
+    return list(
+        db.scalars(
+            select(computed.id_user)
+            .where(computed.computed_at < computed_before)
+            .order_by(computed.computed_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+    )
+
+
+def compute_recommendations(
+    db: Session, user_id: UUID, two_hop: list[tuple[UUID, int]] | None = None
+):
+    """
+    Replaces the stored recommendations of the user with fresh ones, to be
+    committed by the caller. `two_hop` are the users followed by the
+    followed users and by how many of them, when already known, otherwise
+    they are read from the follows.
+    """
+    db.query(models.UserRecommendations).filter(
+        models.UserRecommendations.id_user == user_id
+    ).delete()
+    params = {
+        "user_id": user_id,
+        "size": RECOMMENDATIONS_PER_USER,
+        "per_source": RECOMMENDATIONS_CANDIDATES_PER_SOURCE,
+        "follows_weight": RECOMMENDATIONS_FOLLOWS_WEIGHT,
+        "interests_weight": RECOMMENDATIONS_INTERESTS_WEIGHT,
+        "location_weight": RECOMMENDATIONS_LOCATION_WEIGHT,
+    }
+    if two_hop is None:
+        db.execute(__SCORE_RECOMMENDATIONS_FROM_FOLLOWS, params)
+    else:
+        db.execute(
+            __SCORE_RECOMMENDATIONS_FROM_GRAPH,
+            {
+                **params,
+                "mutual_ids": [user_id for user_id, _ in two_hop],
+                "mutual_follows": [follows for _, follows in two_hop],
+            },
+        )
+    db.execute(
+        insert(models.UserRecommendationsComputed)
+        .values(id_user=user_id)
+        .on_conflict_do_update(
+            index_elements=[models.UserRecommendationsComputed.id_user],
+            set_={"computed_at": func.now()},
+        )
+    )
+
+
+def get_recommendations(
+    db: Session,
+    user_id: UUID,
+    limit: int,
+    after: tuple[float, UUID] | None = None,
+) -> list[dict]:
+    """
+    The best scored of the stored recommendations of the user, which the
+    rebuild computes, none until it first does. `after` is the score and id
+    of the last recommendation of the previous page, which needn't be stored
+    anymore.
+    """
     user = get_user_by_id(db, user_id)
     if not user:
         raise UserNotFound("No user was found for the given id")
 
-    statement = text(
-        """
-            WITH direct_followed AS (
-                SELECT followed_id
-                FROM followers
-                WHERE follower_id =:user_id
-            )
-            SELECT users.id, users.name, users.user
-            FROM direct_followed df
-            JOIN followers uf ON df.followed_id = uf.follower_id
-            JOIN users ON (uf.followed_id=users.id) 
-            WHERE uf.followed_id NOT IN (
-                SELECT followed_id
-                FROM followers
-                WHERE follower_id =:user_id
-            )
-            UNION
-            SELECT u1.id, u1.name, u1.user FROM users u1
-            JOIN users_interests ui ON (u1.id = ui.id_user)
-            WHERE ui.interest IN (
-            SELECT ui.interest FROM users u
-            JOIN users_interests ui ON (u.id = ui.id_user)
-            WHERE u.id =:user_id
-            ) 
-            AND u1.id !=:user_id
-            UNION
-            SELECT u1.id, u1.name, u1.user FROM users u1
-            WHERE u1.location =:user_location
-            AND u1.id !=:user_id
-                     """
+    recommended = models.UserRecommendations
+    statement = (
+        select(models.User.id, models.User.name, models.User.user, recommended.score)
+        .join(recommended, recommended.id_recommended == models.User.id)
+        .where(recommended.id_user == user.id)
+        # Blocked since the recommendations were computed
+        .where(models.User.is_blocked.is_not(True))
     )
-    result = db.execute(statement, {"user_id": user.id, "user_location": user.location})
+    if after is not None:
+        statement = statement.where(
+            tuple_(recommended.score, recommended.id_recommended) < tuple_(*after)
+        )
+    statement = statement.order_by(
+        recommended.score.desc(), recommended.id_recommended.desc()
+    ).limit(limit)
+    result = db.execute(statement)
 
     recommendations = [dict(row) for row in result.mappings()]
 
@@ -272,6 +802,8 @@ def modify_block_status(db: Session, user_id: UUID, block_status: bool):
         raise UserNotFound("No user was found for the given id")
 
     user.is_blocked = block_status
+    user.version = models.User.version + 1
+    __notify_changes(db, "block" if block_status else "unblock", user.id)
     db.commit()
     db.refresh(user)
     return user
@@ -0,0 +1,193 @@
+import asyncio
+import heapq
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+from typing import Callable, Iterable, Iterator
+from uuid import UUID
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.repositories import users
+from app.repositories.database import SessionLocal
+from app.utils.config import AUTOCOMPLETE_REBUILD_INTERVAL
+
+
+class PrefixIndex:
+    """
+    In-process index answering which users have a user name, or a word of
+    their name, starting with a prefix.
+
+    The keys, lowercased, are kept in a sorted list next to a parallel list
+    with the id of their user as an int, ordered by (key, id). A prefix
+    lookup is a binary search plus a walk over the matching slice. Every
+    string is interned, so users sharing a name share it, and a lowercase
+    user name is the same string as its key.
+
+    Inserting into lists of millions of keys moves them all, so `build` lays
+    out the bulk of the index at once and later changes go to a small delta
+    with the same layout. The built keys of users changed since are skipped
+    until the next build.
+
+    Each worker has its own copy. It sees this worker's changes right away
+    through `add`/`remove` and the other workers' signups, renames, blocks
+    and unblocks as the changes listener is notified of them. The next
+    `build` catches up with whatever was missed.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys: list[str] = []
+        self._ids: list[int] = []
+        self._delta_keys: list[str] = []
+        self._delta_ids: list[int] = []
+        self._outdated: set[int] = set()
+        self._users: dict[int, tuple[str, str]] = {}
+        # Changes made while a build reads the users, replayed over its result
+        self._changes: list[tuple] | None = None
+        self.built_at: float | None = None
+
+    @staticmethod
+    def __keys_of(user: str, name: str) -> set[str]:
+        return set(map(sys.intern, f"{user} {name}".lower().split()))
+
+    def build(self, entries: Iterable[tuple[UUID, str, str | None]]):
+        """Replaces the whole index with the given (id, user, name) entries"""
+        with self._lock:
+            self._changes = []
+
+        try:
+            users = {
+                user_id.int: (sys.intern(user), sys.intern(name or ""))
+                for user_id, user, name in entries
+            }
+        except BaseException:
+            with self._lock:
+                self._changes = None
+            raise
+        pairs = [
+            (key, user_id)
+            for user_id in sorted(users)
+            for key in self.__keys_of(*users[user_id])
+        ]
+        # Already ordered by id, the stable sort by key leaves them by (key, id)
+        pairs.sort(key=itemgetter(0))
+        keys = list(map(itemgetter(0), pairs))
+        ids = list(map(itemgetter(1), pairs))
+
+        with self._lock:
+            self._keys, self._ids, self._users = keys, ids, users
+            self._delta_keys, self._delta_ids = [], []
+            self._outdated = set()
+            changes, self._changes = self._changes, None
+            for change in changes:
+                self.__apply(*change)
+            self.built_at = self._clock()
+
+    def add(self, user_id: UUID, user: str, name: str | None):
+        """Adds the user, or updates it if it's already in the index"""
+        with self._lock:
+            self.__apply(user_id.int, sys.intern(user), sys.intern(name or ""))
+
+    def remove(self, user_id: UUID):
+        with self._lock:
+            self.__apply(user_id.int, None, None)
+
+    def __apply(self, user_id: int, user: str | None, name: str | None):
+        if self._changes is not None:
+            self._changes.append((user_id, user, name))
+
+        old = self._users.pop(user_id, None)
+        if old is not None:
+            self._outdated.add(user_id)
+            for key in self.__keys_of(*old):
+                i = self.__delta_position(key, user_id)
+                if i < len(self._delta_ids) and self._delta_ids[i] == user_id:
+                    del self._delta_keys[i]
+                    del self._delta_ids[i]
+
+        if user is not None:
+            self._users[user_id] = (user, name)
+            for key in self.__keys_of(user, name):
+                i = self.__delta_position(key, user_id)
+                self._delta_keys.insert(i, key)
+                self._delta_ids.insert(i, user_id)
+
+    def __delta_position(self, key: str, user_id: int) -> int:
+        start = bisect_left(self._delta_keys, key)
+        end = bisect_right(self._delta_keys, key, start)
+        return bisect_left(self._delta_ids, user_id, start, end)
+
+    @staticmethod
+    def __matches(
+        keys: list[str], ids: list[int], prefix: str, skipped: set[int]
+    ) -> Iterator[tuple[str, int]]:
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            if ids[i] not in skipped:
+                yield keys[i], ids[i]
+            i += 1
+
+    def search(self, prefix: str, limit: int) -> list[tuple[UUID, str, str]]:
+        """
+        Up to `limit` (id, user, name) of the users matching `prefix`, in the
+        order of the matching keys
+        """
+        prefix = prefix.lower()
+        found: dict[int, tuple[str, str]] = {}
+        with self._lock:
+            matches = heapq.merge(
+                self.__matches(self._keys, self._ids, prefix, self._outdated),
+                self.__matches(self._delta_keys, self._delta_ids, prefix, set()),
+            )
+            for _, user_id in matches:
+                if len(found) >= limit:
+                    break
+                found.setdefault(user_id, self._users[user_id])
+        return [
+            (UUID(int=user_id), user, name) for user_id, (user, name) in found.items()
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._keys, self._ids = [], []
+            self._delta_keys, self._delta_ids = [], []
+            self._outdated = set()
+            self._users = {}
+            self.built_at = None
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "keys": len(self._keys),
+            "delta_keys": len(self._delta_keys),
+            "outdated_users": len(self._outdated),
+            "built_at": self.built_at,
+        }
+
+
+user_index = PrefixIndex()
+
+
+def rebuild(index: PrefixIndex = user_index):
+    with SessionLocal() as db:
+        index.build(users.get_searchable_users(db))
+
+
+async def keep_index_fresh(
+    interval: float = AUTOCOMPLETE_REBUILD_INTERVAL, index: PrefixIndex = user_index
+):
+    """
+    Builds `index` from the database and rebuilds it every `interval` seconds
+    until cancelled, to pick up the changes made by other workers
+    """
+    while True:
+        try:
+            await run_in_threadpool(rebuild, index)
+        except Exception:
+            logging.exception("Failed to build the autocomplete index")
+        await asyncio.sleep(interval)
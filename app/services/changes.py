@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from typing import Callable
+from uuid import UUID
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import make_url
+
+from app.repositories import users
+from app.repositories.database import SessionLocal, engine
+from app.repositories.users import CHANGES_CHANNEL
+from app.services import autocomplete, graph, profiles
+from app.services.autocomplete import PrefixIndex
+from app.services.graph import SocialGraph
+from app.services.profiles import ProfileCache
+from app.utils.config import (
+    CHANGES_DATABASE_URL,
+    CHANGES_RECONNECT_INTERVAL,
+    DB_PGBOUNCER,
+    SOCIAL_GRAPH_ENABLED,
+)
+
+
+def connect():
+    """
+    A connection of its own, outside of the pool, as it's held forever. To
+    the CHANGES_DATABASE_URL if given, as LISTEN needs a session of its own,
+    which a transaction pooler like PgBouncer doesn't keep.
+    """
+    url = make_url(CHANGES_DATABASE_URL) if CHANGES_DATABASE_URL else engine.url
+    args, kwargs = engine.dialect.create_connect_args(url)
+    connection = engine.dialect.loaded_dbapi.connect(*args, **kwargs)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+    return connection
+
+
+def read_searchable_user(user_id: UUID) -> tuple[UUID, str, str] | None:
+    with SessionLocal() as db:
+        return users.get_searchable_user(db, user_id)
+
+
+class ChangesListener:
+    """
+    Applies the changes of any worker, which the repository notifies through
+    Postgres once each of them is committed, to the in-process copies of
+    this one: drops the changed users from `cache`, updates them in the
+    autocomplete `index` and the follows in the social `graph`, if any.
+
+    The worker that made a change already applied it and gets it again,
+    which leaves the same result.
+
+    The notifications are read on the event loop as soon as the connection
+    has them, without polling.
+    """
+
+    def __init__(
+        self,
+        cache: ProfileCache = profiles.profile_cache,
+        connect: Callable = connect,
+        index: PrefixIndex = autocomplete.user_index,
+        graph: SocialGraph | None = (
+            graph.social_graph if SOCIAL_GRAPH_ENABLED else None
+        ),
+        read_user: Callable = read_searchable_user,
+    ):
+        self.cache = cache
+        self.index = index
+        self.graph = graph
+        self._connect = connect
+        self._read_user = read_user
+        self.connected = False
+        self.connections = 0
+        self.received = 0
+
+    async def apply(self, payload: str):
+        kind, *user_ids = payload.split(":")
+        user_ids = [UUID(user_id) for user_id in user_ids if user_id]
+        self.received += 1
+        # The cache may call the shared tier, which would block the loop
+        if not user_ids:
+            # Every user changed, like when a command reconciles the counts
+            # outside any worker, so each one drops the shared tier too
+            await run_in_threadpool(self.cache.invalidate_all)
+            return
+
+        # The worker that made the change already dropped the shared one
+        await run_in_threadpool(self.cache.invalidate, *user_ids, shared=False)
+        if kind in ["follow", "unfollow"] and self.graph is not None:
+            follower_id, followed_id = user_ids
+            if kind == "follow":
+                self.graph.follow(follower_id, followed_id)
+            else:
+                self.graph.unfollow(follower_id, followed_id)
+        elif kind == "block":
+            self.index.remove(user_ids[0])
+        elif kind in ["signup", "name", "unblock"]:
+            # Only the id is notified, the user is read again
+            user = await run_in_threadpool(self._read_user, user_ids[0])
+            if user is None:
+                self.index.remove(user_ids[0])
+            else:
+                self.index.add(*user)
+
+    async def listen(self):
+        """Applies the notifications until cancelled or disconnected"""
+        connection = await run_in_threadpool(self._connect)
+        loop = asyncio.get_running_loop()
+        notified = asyncio.Event()
+        loop.add_reader(connection.fileno(), notified.set)
+        try:
+            # Whatever changed while not listening was missed
+            await run_in_threadpool(self.cache.invalidate_all, shared=False)
+            self.connected = True
+            self.connections += 1
+            while True:
+                await notified.wait()
+                notified.clear()
+                connection.poll()
+                while connection.notifies:
+                    await self.apply(connection.notifies.pop(0).payload)
+        finally:
+            self.connected = False
+            loop.remove_reader(connection.fileno())
+            connection.close()
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "connections": self.connections,
+            "received": self.received,
+        }
+
+
+changes_listener = ChangesListener()
+
+
+async def keep_listening(
+    interval: float = CHANGES_RECONNECT_INTERVAL,
+    listener: ChangesListener = changes_listener,
+):
+    """
+    Listens to the changes until cancelled, connecting again `interval`
+    seconds after losing the connection
+    """
+    if DB_PGBOUNCER and not CHANGES_DATABASE_URL:
+        logging.warning(
+            "Not listening to the users changes, which needs a direct "
+            "connection to Postgres: set CHANGES_DATABASE_URL"
+        )
+        return
+    while True:
+        try:
+            await listener.listen()
+        except Exception:
+            logging.exception("Lost the connection listening to the users changes")
+        await asyncio.sleep(interval)
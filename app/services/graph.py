@@ -0,0 +1,331 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Callable, Iterable
+from uuid import UUID
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from app.repositories import users
+from app.repositories.database import SessionLocal
+from app.utils.config import (
+    RECOMMENDATIONS_CANDIDATES_PER_SOURCE,
+    SOCIAL_GRAPH_ENABLED,
+    SOCIAL_GRAPH_REBUILD_INTERVAL,
+)
+
+
+class Adjacency:
+    """
+    Neighbours of every user by index: a CSR base, where the neighbours of
+    user `i` are the sorted `targets[offsets[i]:offsets[i + 1]]`, plus the
+    neighbours added and removed since it was laid out.
+    """
+
+    def __init__(
+        self, offsets: np.ndarray | None = None, targets: np.ndarray | None = None
+    ):
+        self.offsets = offsets if offsets is not None else np.zeros(1, np.int64)
+        self.targets = targets if targets is not None else np.zeros(0, np.int32)
+        self.added: dict[int, set[int]] = {}
+        self.removed: dict[int, set[int]] = {}
+
+    @classmethod
+    def from_rows(
+        cls, size: int, sources: np.ndarray, targets: np.ndarray
+    ) -> "Adjacency":
+        """
+        Lays out the (sources[k], targets[k]) pairs of `size` users, which
+        must come ordered by source then target
+        """
+        counts = np.bincount(sources, minlength=size)
+        return cls(np.concatenate(([0], np.cumsum(counts))), targets)
+
+    def transposed(self) -> "Adjacency":
+        """The same pairs the other way round, only the base is transposed"""
+        size = len(self.offsets) - 1
+        sources = np.repeat(np.arange(size, dtype=np.int32), np.diff(self.offsets))
+        # A stable sort by target keeps the sources of every row in order
+        order = np.argsort(self.targets, kind="stable")
+        return Adjacency.from_rows(size, self.targets[order], sources[order])
+
+    def __row(self, i: int) -> tuple[int, int]:
+        if i + 1 < len(self.offsets):
+            return int(self.offsets[i]), int(self.offsets[i + 1])
+        return 0, 0
+
+    def __in_base(self, i: int, j: int) -> bool:
+        start, end = self.__row(i)
+        k = start + int(np.searchsorted(self.targets[start:end], j))
+        return k < end and self.targets[k] == j
+
+    def contains(self, i: int, j: int) -> bool:
+        if j in self.added.get(i, ()):
+            return True
+        return j not in self.removed.get(i, ()) and self.__in_base(i, j)
+
+    def neighbours(self, i: int) -> set[int]:
+        start, end = self.__row(i)
+        found = set(self.targets[start:end].tolist())
+        found.difference_update(self.removed.get(i, ()))
+        found.update(self.added.get(i, ()))
+        return found
+
+    def degree(self, i: int) -> int:
+        start, end = self.__row(i)
+        return end - start - len(self.removed.get(i, ())) + len(self.added.get(i, ()))
+
+    def add(self, i: int, j: int):
+        if j in self.removed.get(i, ()):
+            self.removed[i].discard(j)
+        elif not self.__in_base(i, j):
+            self.added.setdefault(i, set()).add(j)
+
+    def discard(self, i: int, j: int):
+        if j in self.added.get(i, ()):
+            self.added[i].discard(j)
+        elif self.__in_base(i, j):
+            self.removed.setdefault(i, set()).add(j)
+
+    def changes(self) -> int:
+        return sum(map(len, self.added.values())) + sum(map(len, self.removed.values()))
+
+
+# A user id as its 16 bytes, which sort like the uuids in the database
+ID = np.dtype("V16")
+FOLLOW = np.dtype([("follower", ID), ("followed", ID)])
+
+
+def _as_ids(user_ids: np.ndarray | Iterable[UUID]) -> np.ndarray:
+    if isinstance(user_ids, np.ndarray):
+        return user_ids
+    return np.frombuffer(b"".join(user_id.bytes for user_id in user_ids), ID)
+
+
+def _as_follows(follows: np.ndarray | Iterable[tuple[UUID, UUID]]) -> np.ndarray:
+    if isinstance(follows, np.ndarray):
+        return follows
+    pairs = b"".join(follower.bytes + followed.bytes for follower, followed in follows)
+    return np.frombuffer(pairs, FOLLOW)
+
+
+class SocialGraph:
+    """
+    In-process copy of the follows graph, answering follow queries without
+    going to the database.
+
+    Users get consecutive int indexes, in the order of their ids when the
+    graph is built, so the follows read ordered by ids are already laid out
+    as the CSR rows of the followeds of each user. The followers are the
+    same rows transposed. Each follow takes 4 bytes per direction. The
+    arrays are built with numpy, the ids of the users found by a binary
+    search over their sorted bytes, so no step of a build loops over the
+    follows in Python.
+
+    Later follows and unfollows are kept on top of the arrays until the
+    next build, with users new since the build indexed after the built
+    ones. Like the autocomplete index, each worker has its own copy,
+    seeing its own changes right away and the other workers' ones as the
+    changes listener is notified of them.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._ids = np.zeros(0, ID)
+        self._new_indexes: dict[UUID, int] = {}
+        self._new_ids: list[UUID] = []
+        self._followeds = Adjacency()
+        self._followers = Adjacency()
+        # Changes made while a build reads the follows, replayed over its result
+        self._changes: list[tuple] | None = None
+        self.built_at: float | None = None
+
+    def build(
+        self,
+        user_ids: np.ndarray | Iterable[UUID],
+        follows: np.ndarray | Iterable[tuple[UUID, UUID]],
+    ):
+        """
+        Replaces the whole graph with the given users, ordered by id, and
+        (follower, followed) follows between them, ordered by follower then
+        followed. Both are either uuids or arrays of `ID` and `FOLLOW`.
+        """
+        with self._lock:
+            self._changes = []
+
+        try:
+            ids, follows = _as_ids(user_ids), _as_follows(follows)
+            sources = np.searchsorted(ids, follows["follower"]).astype(np.int32)
+            targets = np.searchsorted(ids, follows["followed"]).astype(np.int32)
+            del follows
+            followeds = Adjacency.from_rows(len(ids), sources, targets)
+            del sources
+            followers = followeds.transposed()
+        except BaseException:
+            with self._lock:
+                self._changes = None
+            raise
+
+        with self._lock:
+            self._ids, self._new_indexes, self._new_ids = ids, {}, []
+            self._followeds, self._followers = followeds, followers
+            changes, self._changes = self._changes, None
+            for change in changes:
+                self.__apply(*change)
+            self.built_at = self._clock()
+
+    def follow(self, follower_id: UUID, followed_id: UUID):
+        with self._lock:
+            self.__apply(follower_id, followed_id, True)
+
+    def unfollow(self, follower_id: UUID, followed_id: UUID):
+        with self._lock:
+            self.__apply(follower_id, followed_id, False)
+
+    def __apply(self, follower_id: UUID, followed_id: UUID, following: bool):
+        if self._changes is not None:
+            self._changes.append((follower_id, followed_id, following))
+
+        follower, followed = self.__index(follower_id), self.__index(followed_id)
+        if following:
+            self._followeds.add(follower, followed)
+            self._followers.add(followed, follower)
+        else:
+            self._followeds.discard(follower, followed)
+            self._followers.discard(followed, follower)
+
+    def __find(self, user_id: UUID) -> int | None:
+        i = int(np.searchsorted(self._ids, np.void(user_id.bytes)))
+        if i < len(self._ids) and bytes(self._ids[i]) == user_id.bytes:
+            return i
+        return self._new_indexes.get(user_id)
+
+    def __index(self, user_id: UUID) -> int:
+        i = self.__find(user_id)
+        if i is None:
+            i = self._new_indexes[user_id] = len(self._ids) + len(self._new_ids)
+            self._new_ids.append(user_id)
+        return i
+
+    def __uuid(self, i: int) -> UUID:
+        if i < len(self._ids):
+            return UUID(bytes=bytes(self._ids[i]))
+        return self._new_ids[i - len(self._ids)]
+
+    def __uuids(self, indexes: Iterable[int]) -> list[UUID]:
+        return [self.__uuid(i) for i in indexes]
+
+    def is_following(self, follower_id: UUID, followed_id: UUID) -> bool:
+        with self._lock:
+            follower = self.__find(follower_id)
+            followed = self.__find(followed_id)
+            if follower is None or followed is None:
+                return False
+            return self._followeds.contains(follower, followed)
+
+    def followers_count(self, user_id: UUID) -> int:
+        with self._lock:
+            i = self.__find(user_id)
+            return 0 if i is None else self._followers.degree(i)
+
+    def followeds_count(self, user_id: UUID) -> int:
+        with self._lock:
+            i = self.__find(user_id)
+            return 0 if i is None else self._followeds.degree(i)
+
+    def mutual_follows(self, user_id: UUID) -> list[UUID]:
+        """The users followed by the user who follow them back"""
+        with self._lock:
+            i = self.__find(user_id)
+            if i is None:
+                return []
+            mutuals = self._followeds.neighbours(i) & self._followers.neighbours(i)
+            return self.__uuids(sorted(mutuals))
+
+    def common_followers(self, user_id: UUID, other_id: UUID) -> list[UUID]:
+        with self._lock:
+            i = self.__find(user_id)
+            j = self.__find(other_id)
+            if i is None or j is None:
+                return []
+            common = self._followers.neighbours(i) & self._followers.neighbours(j)
+            return self.__uuids(sorted(common))
+
+    def two_hop_candidates(self, user_id: UUID, limit: int) -> list[tuple[UUID, int]]:
+        """
+        Up to `limit` users followed by the users the user follows, which the
+        user doesn't follow yet, with how many of their followeds follow
+        them, the most followed first and then by id, as the database ranks
+        them
+        """
+        with self._lock:
+            i = self.__find(user_id)
+            if i is None:
+                return []
+            followeds = self._followeds.neighbours(i)
+            paths = Counter()
+            for followed in followeds:
+                paths.update(self._followeds.neighbours(followed))
+            for excluded in [i, *followeds]:
+                paths.pop(excluded, None)
+            best = heapq.nsmallest(
+                limit, paths.items(), key=lambda item: (-item[1], self.__uuid(item[0]))
+            )
+            return [(self.__uuid(j), count) for j, count in best]
+
+    def clear(self):
+        with self._lock:
+            self._ids, self._new_indexes, self._new_ids = np.zeros(0, ID), {}, []
+            self._followeds, self._followers = Adjacency(), Adjacency()
+            self.built_at = None
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._ids) + len(self._new_ids),
+            "built_follows": len(self._followeds.targets),
+            "changed_follows": self._followeds.changes(),
+            "built_at": self.built_at,
+        }
+
+
+social_graph = SocialGraph()
+
+
+def two_hop_candidates(
+    user_id: UUID, graph: SocialGraph = social_graph
+) -> list[tuple[UUID, int]] | None:
+    """
+    The recommendation candidates followed by the followeds of the user, the
+    most followed `RECOMMENDATIONS_CANDIDATES_PER_SOURCE` of them. None until
+    the graph is enabled and built, for them to be read from the database.
+    """
+    if not SOCIAL_GRAPH_ENABLED or graph.built_at is None:
+        return None
+    return graph.two_hop_candidates(user_id, RECOMMENDATIONS_CANDIDATES_PER_SOURCE)
+
+
+def rebuild(graph: SocialGraph = social_graph):
+    with SessionLocal() as db:
+        # Both reads see the same snapshot, so every follow is between read users
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        graph.build(users.get_all_user_ids(db), users.get_all_follows(db))
+
+
+async def keep_graph_fresh(
+    interval: float = SOCIAL_GRAPH_REBUILD_INTERVAL, graph: SocialGraph = social_graph
+):
+    """
+    Builds `graph` from the database and rebuilds it every `interval`
+    seconds until cancelled, to pick up the follows of other workers
+    """
+    while True:
+        try:
+            await run_in_threadpool(rebuild, graph)
+        except Exception:
+            logging.exception("Failed to build the social graph")
+        await asyncio.sleep(interval)
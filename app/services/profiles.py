@@ -0,0 +1,330 @@
+import importlib.util
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator, Protocol
+from uuid import UUID
+
+import orjson
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+
+from app.utils.config import (
+    PROFILE_CACHE_MAX_SIZE,
+    PROFILE_CACHE_REDIS_URL,
+    PROFILE_CACHE_TTL,
+)
+
+
+class SharedTier(Protocol):
+    """The part of the Redis protocol the cache uses, as in `redis.Redis`"""
+
+    def get(self, key: str) -> bytes | None: ...
+
+    def set(self, key: str, value: str | bytes, px: int): ...
+
+    def delete(self, *keys: str): ...
+
+    def scan_iter(self, match: str, count: int) -> Iterator[bytes]: ...
+
+
+class ProfileCache:
+    """
+    Read-through cache of the profiles served by `GET /users/{id}` and
+    `GET /users/email/{email}` without expansions.
+
+    Profiles are the plain values the endpoints render, as built by the users
+    service. The first tier is an in-process LRU of `max_size` profiles, the second
+    an optional `shared` one every worker reads and fills. Entries live
+    `ttl` seconds in both, which bounds how stale a profile can get when
+    this worker isn't notified of its change.
+
+    Profiles are kept by id and an email only points to the id of its user,
+    emails never change, so invalidating a user only drops its id.
+
+    A profile read from the database before its user was invalidated may be
+    outdated, so `set` only caches it if the user wasn't invalidated since
+    the `generation` taken before reading it. The last invalidation of each
+    user is remembered for as many users as profiles are kept, older ones
+    turn down every profile read before them.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_size: int,
+        shared: SharedTier | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.shared = shared
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._profiles: OrderedDict[UUID, tuple[dict, float]] = OrderedDict()
+        self._emails: OrderedDict[str, UUID] = OrderedDict()
+        # Bumped by every invalidation
+        self._generation = 0
+        # Generation of the last invalidation of each user, the oldest first,
+        # and the one up to which they were forgotten
+        self._invalidated: OrderedDict[UUID, int] = OrderedDict()
+        self._forgotten = 0
+        # Generation of the profiles this worker put in the shared tier, which
+        # it drops from there if their user is invalidated after all
+        self._shared_fills: OrderedDict[UUID, int] = OrderedDict()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.shared_errors = 0
+        self.hits_age = 0.0
+        self.max_hit_age = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    def generation(self) -> int:
+        """To pass to `set` along with the profile read after calling it"""
+        return self._generation
+
+    def __is_current(self, user_id: UUID, generation: int) -> bool:
+        """Whether the user wasn't invalidated since `generation`"""
+        return (
+            self._forgotten <= generation
+            and self._invalidated.get(user_id, 0) <= generation
+        )
+
+    def get_by_id(self, user_id: UUID) -> dict | None:
+        if not self.enabled:
+            return None
+        with self._lock:
+            profile = self.__get_local(user_id)
+        if profile is None:
+            profile = self.__get_shared(user_id)
+        if profile is None:
+            self.misses += 1
+        return profile
+
+    def get_by_email(self, email: str) -> dict | None:
+        if not self.enabled:
+            return None
+        with self._lock:
+            user_id = self._emails.get(email)
+            profile = self.__get_local(user_id) if user_id else None
+        if profile is None:
+            user_id = self.__shared_call("get", f"users:email:{email}")
+            if user_id is not None:
+                profile = self.__get_shared(UUID(user_id.decode()))
+        if profile is None:
+            self.misses += 1
+        return profile
+
+    def __get_local(self, user_id: UUID) -> dict | None:
+        entry = self._profiles.get(user_id)
+        if entry is None:
+            return None
+
+        profile, cached_at = entry
+        age = self._clock() - cached_at
+        if age >= self.ttl:
+            del self._profiles[user_id]
+            return None
+
+        self._profiles.move_to_end(user_id)
+        self.hits += 1
+        self.hits_age += age
+        self.max_hit_age = max(self.max_hit_age, age)
+        return profile
+
+    def __get_shared(self, user_id: UUID) -> dict | None:
+        generation = self._generation
+        profile = self.__shared_call("get", f"users:profile:{user_id}")
+        if profile is None:
+            return None
+
+        profile = orjson.loads(profile)
+        self.shared_hits += 1
+        with self._lock:
+            if self.__is_current(user_id, generation):
+                self.__set_local(profile)
+        return profile
+
+    def set(self, profile: dict, generation: int):
+        """Caches `profile` unless its user was invalidated since `generation`"""
+        if not self.enabled:
+            return
+        user_id = UUID(str(profile["id"]))
+        with self._lock:
+            if not self.__is_current(user_id, generation):
+                return
+            self.__set_local(profile)
+            if self.shared is not None:
+                self.__remember(self._shared_fills, user_id, generation)
+
+        ttl_ms = int(self.ttl * 1000)
+        self.__shared_call(
+            "set", f"users:profile:{user_id}", orjson.dumps(profile), px=ttl_ms
+        )
+        self.__shared_call(
+            "set", f"users:email:{profile['email']}", profile["id"], px=ttl_ms
+        )
+        with self._lock:
+            is_current = self.__is_current(user_id, generation)
+        if not is_current:
+            # Invalidated while being put in the shared tier
+            self.__shared_call("delete", f"users:profile:{user_id}")
+
+    def __remember(self, generations: OrderedDict, user_id: UUID, generation: int):
+        """Keeps the `generation` of the user in `generations`, the oldest first"""
+        generations[user_id] = generation
+        generations.move_to_end(user_id)
+        while len(generations) > self.max_size:
+            _, forgotten = generations.popitem(last=False)
+            if generations is self._invalidated:
+                self._forgotten = max(self._forgotten, forgotten)
+
+    def __set_local(self, profile: dict):
+        user_id, email = UUID(profile["id"]), profile["email"]
+        self._profiles[user_id] = (profile, self._clock())
+        self._profiles.move_to_end(user_id)
+        self._emails[email] = user_id
+        self._emails.move_to_end(email)
+        while len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
+            self.evictions += 1
+        while len(self._emails) > self.max_size:
+            self._emails.popitem(last=False)
+
+    def invalidate(self, *user_ids: UUID, shared: bool = True):
+        """
+        Drops the profiles of the users, to call once their change is
+        committed. From the shared tier only if `shared` or this worker may
+        have put an outdated one there.
+        """
+        with self._lock:
+            self._generation += 1
+            shared_ids = []
+            for user_id in user_ids:
+                self._profiles.pop(user_id, None)
+                self.__remember(self._invalidated, user_id, self._generation)
+                if shared or self._shared_fills.pop(user_id, None) is not None:
+                    shared_ids.append(user_id)
+            self.invalidations += len(user_ids)
+        if self.enabled and shared_ids:
+            self.__shared_call(
+                "delete", *(f"users:profile:{user_id}" for user_id in shared_ids)
+            )
+
+    def invalidate_all(self, shared: bool = True):
+        """
+        Drops every profile in this worker's memory and, if `shared`, in the
+        shared tier. Otherwise only the ones this worker may have put there
+        outdated.
+        """
+        with self._lock:
+            self._generation += 1
+            self._forgotten = self._generation
+            self._invalidated.clear()
+            self.invalidations += len(self._profiles)
+            self._profiles.clear()
+            self._emails.clear()
+            shared_ids = list(self._shared_fills)
+            self._shared_fills.clear()
+        if not self.enabled:
+            return
+        if shared:
+            keys = self.__shared_call("scan_iter", "users:profile:*", count=1000)
+            shared_ids = [
+                key.decode().removeprefix("users:profile:") for key in keys or ()
+            ]
+        for start in range(0, len(shared_ids), 1000):
+            self.__shared_call(
+                "delete",
+                *(
+                    f"users:profile:{user_id}"
+                    for user_id in shared_ids[start : start + 1000]
+                ),
+            )
+
+    def __shared_call(self, method: str, *args, **kwargs):
+        """
+        Calls the shared tier, which being down only makes it a miss. From a
+        function run on the event loop by `AsyncSession.run_sync`, the call
+        waits on the threadpool, leaving the loop to serve other requests.
+        """
+        if self.shared is None:
+            return None
+
+        def call():
+            result = getattr(self.shared, method)(*args, **kwargs)
+            # The scan is lazy, it has to run where it was called
+            return list(result) if method == "scan_iter" else result
+
+        try:
+            if in_greenlet():
+                return await_only(run_in_threadpool(call))
+            return call()
+        except Exception:
+            self.shared_errors += 1
+            logging.exception("Failed to reach the shared profile cache")
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._forgotten = self._generation
+            self._invalidated.clear()
+            self._shared_fills.clear()
+            self._profiles.clear()
+            self._emails.clear()
+            self.hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+            self.invalidations = 0
+            self.evictions = 0
+            self.shared_errors = 0
+            self.hits_age = 0.0
+            self.max_hit_age = 0.0
+
+    def stats(self) -> dict:
+        hits = self.hits + self.shared_hits
+        lookups = hits + self.misses
+        return {
+            "size": len(self._profiles),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "shared": self.shared is not None,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "shared_errors": self.shared_errors,
+            # How old the profiles served from memory were, in seconds
+            "avg_hit_age": self.hits_age / self.hits if self.hits else 0.0,
+            "max_hit_age": self.max_hit_age,
+        }
+
+
+def shared_tier(url: str | None) -> SharedTier | None:
+    """The shared tier at `url`, only used when the `redis` package is installed"""
+    if not url:
+        return None
+    if importlib.util.find_spec("redis") is None:
+        logging.warning("PROFILE_CACHE_REDIS_URL is set but redis is not installed")
+        return None
+
+    import redis
+
+    return redis.Redis.from_url(url)
+
+
+profile_cache = ProfileCache(
+    ttl=PROFILE_CACHE_TTL,
+    max_size=PROFILE_CACHE_MAX_SIZE,
+    shared=shared_tier(PROFILE_CACHE_REDIS_URL),
+)
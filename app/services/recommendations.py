@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+
+from app.repositories import users
+from app.repositories.database import SessionLocal
+from app.services import graph
+from app.utils.config import (
+    RECOMMENDATIONS_MAX_AGE,
+    RECOMMENDATIONS_REBUILD_BATCH_SIZE,
+    RECOMMENDATIONS_REBUILD_INTERVAL,
+)
+
+
+def rebuild(
+    max_age: float = RECOMMENDATIONS_MAX_AGE,
+    batch_size: int = RECOMMENDATIONS_REBUILD_BATCH_SIZE,
+) -> int:
+    """
+    Computes the recommendations of the users who have none or whose ones
+    were invalidated, then again the ones computed over `max_age` seconds
+    ago, the oldest first, and returns how many were.
+
+    Each batch of `batch_size` users is a transaction locking their rows, so
+    workers rebuilding at the same time split the stale users between them,
+    and no lock outlives the transaction, which PgBouncer in transaction mode
+    would hand to another client.
+    """
+    rebuilt = 0
+    with SessionLocal() as db:
+        users.add_missing_recommendations(db)
+        computed_before = db.scalar(
+            select(func.localtimestamp() - timedelta(seconds=max_age))
+        )
+        db.commit()
+        while user_ids := users.lock_stale_recommendations(
+            db, computed_before, batch_size
+        ):
+            for user_id in user_ids:
+                users.compute_recommendations(
+                    db, user_id, graph.two_hop_candidates(user_id)
+                )
+            db.commit()
+            rebuilt += len(user_ids)
+    return rebuilt
+
+
+async def keep_recommendations_fresh(
+    interval: float = RECOMMENDATIONS_REBUILD_INTERVAL,
+):
+    """
+    Every `interval` seconds until cancelled, computes the recommendations
+    of the new users and of the ones who followed, unfollowed or changed
+    their interests or location, and recomputes the ones older than
+    `RECOMMENDATIONS_MAX_AGE`, which picks up how the changes of the other
+    users affect them. Reads only serve what it stored.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            rebuilt = await run_in_threadpool(rebuild)
+            if rebuilt:
+                logging.info(f"Rebuilt the recommendations of {rebuilt} users")
+        except Exception:
+            logging.exception("Failed to rebuild the recommendations")
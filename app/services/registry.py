@@ -0,0 +1,506 @@
+import asyncio
+import importlib.util
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+import httpx
+import jwt
+
+from app.utils.config import (
+    API_KEY_CACHE_MAX_SIZE,
+    API_KEY_CACHE_NEGATIVE_TTL,
+    API_KEY_CACHE_TTL,
+    AUTH_MODE,
+    KEYSET_FALLBACK,
+    KEYSET_MAX_STALENESS,
+    KEYSET_REFRESH_INTERVAL,
+    REGISTRY_BOOTSTRAP_BACKOFF,
+    REGISTRY_BOOTSTRAP_MAX_BACKOFF,
+    REGISTRY_CONNECT_TIMEOUT,
+    REGISTRY_HTTP2,
+    REGISTRY_KEEPALIVE_EXPIRY,
+    REGISTRY_MAX_CONNECTIONS,
+    REGISTRY_MAX_KEEPALIVE_CONNECTIONS,
+    REGISTRY_TIMEOUT,
+    REGISTRY_URL,
+    SERVICE_ID,
+    TOKEN_AUDIENCE,
+    TOKEN_ISSUER,
+)
+
+T = TypeVar("T")
+
+# Only public keys are published to the services verifying tokens, so none of
+# them can sign one
+TOKEN_ALGORITHMS = ["RS256", "ES256", "EdDSA"]
+
+
+class ApiKeyCache:
+    """
+    In-process LRU cache of the API keys already checked against the registry.
+
+    Accepted keys are kept for `ttl` seconds and rejected keys for
+    `negative_ttl` seconds. When the cache holds `max_size` keys, the least
+    recently used one is evicted.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        negative_ttl: float,
+        max_size: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[bool, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, api_key: str) -> bool | None:
+        entry = self._entries.get(api_key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        is_valid, expires_at = entry
+        if expires_at <= self._clock():
+            del self._entries[api_key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(api_key)
+        self.hits += 1
+        return is_valid
+
+    def set(self, api_key: str, is_valid: bool):
+        ttl = self.ttl if is_valid else self.negative_ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        self._entries[api_key] = (is_valid, self._clock() + ttl)
+        self._entries.move_to_end(api_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class RegistryClient:
+    """
+    Pooled `httpx.AsyncClient` shared by every call to the registry.
+
+    The client is opened by the app lifespan and closed on shutdown, so
+    connections (and their TLS sessions) are reused between requests. HTTP/2
+    is only negotiated when the `h2` package, from `httpx[http2]`, is installed.
+    """
+
+    def __init__(
+        self,
+        limits: httpx.Limits,
+        timeout: httpx.Timeout,
+        http2: bool,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.limits = limits
+        self.timeout = timeout
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            logging.warning("REGISTRY_HTTP2 is set but h2 is not installed")
+        self._transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.http2_responses = 0
+
+    def open(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+                transport=self._transport,
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get(
+        self, url: str, timeout: float | None = None, **kwargs
+    ) -> httpx.Response:
+        client = self.open()
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await client.get(
+                url,
+                timeout=self.timeout if timeout is None else timeout,
+                **kwargs,
+            )
+            if response.http_version == "HTTP/2":
+                self.http2_responses += 1
+            return response
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "open": self._client is not None and not self._client.is_closed,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "http2_responses": self.http2_responses,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single in-flight call.
+
+    The first caller for a key starts the call and every caller that arrives
+    while it is running awaits the same task, so all of them get the same
+    result or the same exception. A caller being cancelled does not cancel
+    the shared call for the others.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self.__forget(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def __forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Avoids "exception was never retrieved" when every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "shared": self.shared,
+        }
+
+
+class KeySet:
+    """
+    Public keys the registry signs service tokens with, indexed by key id
+    (`kid`).
+
+    The keys are replaced as a whole on every successful refresh. Once the
+    last refresh is older than `max_staleness`, the `fallback` policy decides
+    whether tokens are still checked against these keys ("stale") or
+    rejected until a refresh succeeds ("reject").
+    """
+
+    def __init__(
+        self,
+        max_staleness: float,
+        fallback: str,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_staleness = max_staleness
+        self.fallback = fallback
+        self._clock = clock
+        self._keys: dict[str, jwt.PyJWK] = {}
+        self.refreshed_at: float | None = None
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.last_error: str | None = None
+
+    def replace(self, keys: dict[str, jwt.PyJWK]):
+        self._keys = dict(keys)
+        self.refreshed_at = self._clock()
+        self.refreshes += 1
+        self.last_error = None
+
+    def refresh_failed(self, error: Exception):
+        self.refresh_failures += 1
+        self.last_error = repr(error)
+
+    def is_stale(self) -> bool:
+        return (
+            self.refreshed_at is None
+            or self._clock() - self.refreshed_at > self.max_staleness
+        )
+
+    def get(self, kid: str) -> jwt.PyJWK | None:
+        if self.fallback == "reject" and self.is_stale():
+            return None
+        return self._keys.get(kid)
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._keys),
+            "stale": self.is_stale(),
+            "fallback": self.fallback,
+            "age": (
+                None if self.refreshed_at is None else self._clock() - self.refreshed_at
+            ),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "last_error": self.last_error,
+        }
+
+
+class ServiceRegistration:
+    """
+    Registration of this microservice in the registry.
+
+    `ready` turns true once the bootstrap finished, whether the registry had
+    an API key for this service or not.
+    """
+
+    def __init__(self):
+        self.api_key: str | None = None
+        self.ready = False
+        self.attempts = 0
+        self.last_error: str | None = None
+
+    def stats(self) -> dict:
+        return {
+            "service_id": SERVICE_ID,
+            "ready": self.ready,
+            "has_api_key": self.api_key is not None,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+        }
+
+
+registry_client = RegistryClient(
+    limits=httpx.Limits(
+        max_connections=REGISTRY_MAX_CONNECTIONS,
+        max_keepalive_connections=REGISTRY_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=REGISTRY_KEEPALIVE_EXPIRY,
+    ),
+    timeout=httpx.Timeout(REGISTRY_TIMEOUT, connect=REGISTRY_CONNECT_TIMEOUT),
+    http2=REGISTRY_HTTP2,
+)
+
+api_key_cache = ApiKeyCache(
+    ttl=API_KEY_CACHE_TTL,
+    negative_ttl=API_KEY_CACHE_NEGATIVE_TTL,
+    max_size=API_KEY_CACHE_MAX_SIZE,
+)
+
+api_key_validations = SingleFlight()
+
+keyset = KeySet(max_staleness=KEYSET_MAX_STALENESS, fallback=KEYSET_FALLBACK)
+
+registration = ServiceRegistration()
+
+
+async def is_authorized(credentials: str) -> bool:
+    """
+    Checks the `Authorization` header of a request according to `AUTH_MODE`.
+    """
+    if AUTH_MODE == "token":
+        return verify_token(credentials)
+    return await validate_api_key(credentials)
+
+
+async def validate_api_key(
+    api_key: str, client: RegistryClient = registry_client
+) -> bool:
+    """
+    Returns whether the registry accepts `api_key`, asking it only when the
+    answer is not cached.
+
+    Only a 2xx (valid) or a 401 (invalid) answer from the registry is cached,
+    any other status lets the request through without remembering it.
+    Concurrent validations of the same key share a single registry call.
+    """
+    is_valid = api_key_cache.get(api_key)
+    if is_valid is not None:
+        return is_valid
+
+    return await api_key_validations.do(
+        api_key, lambda: __ask_registry(api_key, client)
+    )
+
+
+async def __ask_registry(api_key: str, client: RegistryClient) -> bool:
+    response = await client.get(
+        f"{REGISTRY_URL}/api/registry/validate", params={"apiKey": api_key}
+    )
+
+    if response.status_code == 401:
+        api_key_cache.set(api_key, False)
+        return False
+
+    if response.is_success:
+        api_key_cache.set(api_key, True)
+    return True
+
+
+def verify_token(
+    token: str,
+    keys: KeySet = keyset,
+    audience: str = TOKEN_AUDIENCE,
+    issuer: str = TOKEN_ISSUER,
+) -> bool:
+    """
+    Verifies a service token locally, without any network call.
+
+    Tokens are JWTs signed by the registry with the private half of the key
+    their `kid` header names, issued by `issuer` for `audience` and with an
+    expiration. They may be sent with or without the `Bearer ` prefix.
+    """
+    token = token.removeprefix("Bearer ")
+    try:
+        key = keys.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            return False
+        jwt.decode(
+            token,
+            key.key,
+            algorithms=[key.algorithm_name],
+            audience=audience,
+            issuer=issuer,
+            options={"require": ["exp", "aud", "iss"]},
+        )
+        return True
+    except jwt.InvalidTokenError:
+        return False
+
+
+def public_keys(jwks: dict) -> dict[str, jwt.PyJWK]:
+    """
+    The keys of a JWK set indexed by `kid`, skipping the ones that are not
+    public keys of `TOKEN_ALGORITHMS`.
+    """
+    keys = {}
+    for jwk in jwks["keys"]:
+        key = jwt.PyJWK(jwk)
+        if key.algorithm_name not in TOKEN_ALGORITHMS or "d" in jwk:
+            logging.warning(f"Ignoring registry key {jwk.get('kid')}, not a public key")
+            continue
+        keys[jwk["kid"]] = key
+    return keys
+
+
+async def refresh_keyset(
+    client: RegistryClient = registry_client, keys: KeySet = keyset
+):
+    """
+    Replaces `keys` with the public keys published by the registry as a JWK
+    set, `{"keys": [{"kid": ..., "kty": ..., ...}, ...]}`.
+    """
+    try:
+        response = await client.get(f"{REGISTRY_URL}/api/registry/jwks")
+        response.raise_for_status()
+        keys.replace(public_keys(response.json()))
+    except (httpx.HTTPError, jwt.PyJWTError, ValueError, KeyError, TypeError) as e:
+        keys.refresh_failed(e)
+        logging.warning(f"Could not refresh the registry key set: {e!r}")
+
+
+async def keep_keyset_fresh(
+    interval: float = KEYSET_REFRESH_INTERVAL,
+    client: RegistryClient = registry_client,
+    keys: KeySet = keyset,
+):
+    """
+    Refreshes `keys` every `interval` seconds until cancelled. After a failed
+    refresh it retries sooner, without waiting for a whole interval.
+    """
+    while True:
+        await refresh_keyset(client, keys)
+        if keys.last_error is None:
+            await asyncio.sleep(interval)
+        else:
+            await asyncio.sleep(min(interval, 5))
+
+
+async def bootstrap(
+    service_id: str | None = SERVICE_ID,
+    client: RegistryClient = registry_client,
+    state: ServiceRegistration = registration,
+    backoff: float = REGISTRY_BOOTSTRAP_BACKOFF,
+    max_backoff: float = REGISTRY_BOOTSTRAP_MAX_BACKOFF,
+):
+    """
+    Fetches the API key of this service from the registry, retrying network
+    and server errors, and malformed answers, with an exponential backoff
+    until it gets one.
+    """
+    if not service_id:
+        logging.warning(
+            "No service id was provided. You have to register the microservice."
+        )
+        state.ready = True
+        return
+
+    delay = backoff
+    while True:
+        state.attempts += 1
+        try:
+            response = await client.get(f"{REGISTRY_URL}/api/registry/{service_id}")
+            if response.status_code == 200:
+                api_key = response.json()["apiKey"]
+                break
+            if response.status_code < 500:
+                api_key = None
+                break
+            state.last_error = f"registry answered {response.status_code}"
+        except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+            state.last_error = repr(e)
+
+        logging.warning(
+            f"Registry bootstrap attempt {state.attempts} failed "
+            f"({state.last_error}), retrying in {delay}s"
+        )
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_backoff)
+
+    if api_key is None:
+        logging.warning("There is no api key for this microservice")
+    state.api_key = api_key
+
+    state.last_error = None
+    state.ready = True
+    logging.info(f"SERVICE_ID: {service_id}")
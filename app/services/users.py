@@ -1,30 +1,66 @@
+import base64
+import binascii
+import struct
+import orjson
+from typing import Callable, Iterable, Iterator
 from uuid import UUID
 from sqlalchemy.orm import Session
 from app.repositories import users, models
 from app.repositories.database import engine
+from app.services import autocomplete, graph, profiles
+from app.utils.config import FOLLOWS_EXPORT_BATCH_SIZE, SOCIAL_GRAPH_ENABLED
 from pydantic_extra_types.country import CountryAlpha3
 from app.utils import schemas
 from pydantic import EmailStr
-from app.utils.errors import BlockedUser, ExistentUserError
+from app.utils.errors import BlockedUser, ExistentUserError, InvalidCursor
 
 
 models.Base.metadata.create_all(bind=engine)
 
 
-def __database_model_to_schema(user: schemas.DatabaseUser) -> schemas.User:
-    return schemas.User(
-        id=user.id,
-        email=user.email,
-        user=user.user,
-        name=user.name,
-        is_blocked=user.is_blocked,
-        location=user.location,
-        goals=[g.goal for g in user.goals],
-        interests=[schemas.Interests(interest.interest) for interest in user.interests],
-        twitsnaps=[twitsnap.id_twitsnap for twitsnap in user.twitsnaps],
-        followers=[follower.id for follower in user.followers],
-        followeds=[followed.id for followed in user.followeds],
-    )
+def __database_model_to_payload(
+    db: Session,
+    user: schemas.DatabaseUser,
+    expand: Iterable[schemas.UserExpansion] = (),
+) -> dict:
+    """
+    The User response of `user` as plain values, which the read endpoints
+    render straight to JSON instead of building a schemas.User that FastAPI
+    would validate and serialize again
+    """
+    return {
+        "id": str(user.id),
+        "email": user.email,
+        "user": user.user,
+        "name": user.name,
+        "is_blocked": user.is_blocked,
+        "location": user.location,
+        "goals": [g.goal for g in user.goals],
+        "interests": [interest.interest.value for interest in user.interests],
+        "followers_count": user.followers_count,
+        "followeds_count": user.followeds_count,
+        "twitsnaps_count": user.twitsnaps_count,
+        "version": user.version,
+        "followers": (
+            users.get_follower_ids(db, user.id)
+            if schemas.UserExpansion.followers in expand
+            else None
+        ),
+        "followeds": (
+            users.get_followed_ids(db, user.id)
+            if schemas.UserExpansion.followeds in expand
+            else None
+        ),
+        "twitsnaps": (
+            users.get_twitsnap_ids(db, user.id)
+            if schemas.UserExpansion.twitsnaps in expand
+            else None
+        ),
+    }
+
+
+def __database_model_to_schema(db: Session, user: schemas.DatabaseUser) -> schemas.User:
+    return schemas.User(**__database_model_to_payload(db, user))
 
 
 def __database_model_to_admin_schema(user: models.Admins) -> schemas.Admin:
@@ -34,42 +70,188 @@ def __database_model_to_admin_schema(user: models.Admins) -> schemas.Admin:
     )
 
 
-def fetch_users(db: Session) -> list[schemas.User]:
-    db_users: list[schemas.DatabaseUser] = users.get_users(db)
-
-    return [__database_model_to_schema(user) for user in db_users]
-
-
-def fetch_user_by_id(db: Session, id: UUID) -> schemas.User | None:
-    user: models.User = users.get_user_by_id(db=db, user_id=id)
-    print("user: {user}")
-
-    if user:
-        if user.is_blocked:
-            raise BlockedUser
-        return __database_model_to_schema(user)
+def __encode_cursor(user_id: UUID) -> str:
+    return base64.urlsafe_b64encode(user_id.bytes).decode().rstrip("=")
+
+
+def __decode_cursor(cursor: str) -> UUID:
+    try:
+        return UUID(bytes=base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise InvalidCursor
+
+
+def __encode_score_cursor(score: float, user_id: UUID) -> str:
+    cursor = struct.pack(">d", score) + user_id.bytes
+    return base64.urlsafe_b64encode(cursor).decode().rstrip("=")
+
+
+def __decode_score_cursor(cursor: str) -> tuple[float, UUID]:
+    try:
+        cursor = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        (score,) = struct.unpack(">d", cursor[:8])
+        return score, UUID(bytes=cursor[8:])
+    except (binascii.Error, ValueError, struct.error):
+        raise InvalidCursor
+
+
+def __paginate(
+    db: Session,
+    fetch_page: Callable[..., list[models.User]],
+    limit: int,
+    cursor: str | None,
+    *args,
+) -> tuple[list[dict], str | None]:
+    after = __decode_cursor(cursor) if cursor else None
+    # One extra row tells whether there is a next page without counting
+    db_users: list[schemas.DatabaseUser] = fetch_page(db, *args, limit + 1, after)
+
+    next_cursor = None
+    if len(db_users) > limit:
+        db_users = db_users[:limit]
+        next_cursor = __encode_cursor(db_users[-1].id)
+
+    return [__database_model_to_payload(db, user) for user in db_users], next_cursor
+
+
+def fetch_users(
+    db: Session, limit: int, cursor: str | None = None
+) -> tuple[list[dict], str | None]:
+    """
+    Returns a page of at most `limit` users and the cursor of the next page,
+    which is None on the last one
+    """
+    return __paginate(db, users.get_users, limit, cursor)
+
+
+def __fetch_profile(
+    db: Session,
+    cached: Callable[[], dict | None],
+    fetch: Callable[[], models.User | None],
+    expand: Iterable[schemas.UserExpansion],
+    min_version: int | None = None,
+) -> dict | None:
+    # Only the profiles without expansions are cached
+    user = None if expand else cached()
+    if user is not None and min_version is not None and user["version"] < min_version:
+        # Changed without this worker being notified yet
+        user = None
+    if user is None:
+        generation = profiles.profile_cache.generation()
+        db_user = fetch()
+        if not db_user:
+            return None
+        user = __database_model_to_payload(db, db_user, expand)
+        if not expand:
+            profiles.profile_cache.set(user, generation)
+
+    if user["is_blocked"]:
+        raise BlockedUser
+    return user
+
+
+def fetch_user_by_id(
+    db: Session,
+    id: UUID,
+    expand: Iterable[schemas.UserExpansion] = (),
+    min_version: int | None = None,
+) -> dict | None:
+    """
+    The profile of the user, read from the database if the cached one is
+    older than `min_version`
+    """
+    return __fetch_profile(
+        db,
+        lambda: profiles.profile_cache.get_by_id(id),
+        lambda: users.get_user_by_id(db=db, user_id=id),
+        expand,
+        min_version,
+    )
 
 
-def fetch_user_by_email(db: Session, email: EmailStr) -> schemas.User | None:
-    user: models.User = users.get_user_by_email(db=db, email=email)
-    if user:
-        if user.is_blocked:
-            raise BlockedUser
-        return __database_model_to_schema(user)
+def fetch_user_by_email(
+    db: Session,
+    email: EmailStr,
+    expand: Iterable[schemas.UserExpansion] = (),
+    min_version: int | None = None,
+) -> dict | None:
+    """
+    The profile of the user, read from the database if the cached one is
+    older than `min_version`
+    """
+    return __fetch_profile(
+        db,
+        lambda: profiles.profile_cache.get_by_email(email),
+        lambda: users.get_user_by_email(db=db, email=email),
+        expand,
+        min_version,
+    )
 
 
-def search_users(db: Session, user: str, limit: int) -> list[schemas.User]:
+__SUMMARY_FIELDS = ("id", "email", "user", "name")
+
+
+def fetch_user_summaries(db: Session, ids: list[UUID], emails: list[str]) -> dict:
+    """
+    The UsersBatch of the users with the ids and emails as plain values. The
+    ones in the profile cache come from there and the rest from one query.
+    """
+    ids, emails = list(dict.fromkeys(ids)), list(dict.fromkeys(emails))
+    found: dict[str, dict] = {}
+    cache_hits = 0
+    pending_ids = []
+    for user_id in ids:
+        if profile := profiles.profile_cache.get_by_id(user_id):
+            found[profile["id"]] = profile
+            cache_hits += 1
+        else:
+            pending_ids.append(user_id)
+    pending_emails = []
+    for email in emails:
+        if profile := profiles.profile_cache.get_by_email(email):
+            found[profile["id"]] = profile
+            cache_hits += 1
+        else:
+            pending_emails.append(email)
+
+    if pending_ids or pending_emails:
+        for row in users.get_user_summaries(db, pending_ids, pending_emails):
+            found[str(row.id)] = {**row._asdict(), "id": str(row.id)}
+
+    by_email = {user["email"]: user for user in found.values()}
+    asked = [(str(user_id), found.get(str(user_id))) for user_id in ids]
+    asked += [(email, by_email.get(email)) for email in emails]
+    batch = {"users": {}, "missing": [], "blocked": [], "cache_hits": cache_hits}
+    for key, user in asked:
+        if user is None:
+            batch["missing"].append(key)
+        elif user["is_blocked"]:
+            batch["blocked"].append(key)
+        else:
+            batch["users"][user["id"]] = {
+                field: user[field] for field in __SUMMARY_FIELDS
+            }
+    return batch
+
+
+def fetch_user_version(db: Session, id: UUID) -> int | None:
+    return users.get_user_version_by_id(db, id)
+
+
+def fetch_user_version_by_email(db: Session, email: EmailStr) -> int | None:
+    return users.get_user_version_by_email(db, email)
+
+
+def search_users(db: Session, user: str, limit: int) -> list[dict]:
     db_users: list[schemas.DatabaseUser] = users.search_users(db, user, limit)
-    return [__database_model_to_schema(user) for user in db_users]
+    return [__database_model_to_payload(db, user) for user in db_users]
 
 
-def search_followeds(
-    db: Session, user_id: UUID, user: str, limit: int
-) -> list[schemas.User]:
+def search_followeds(db: Session, user_id: UUID, user: str, limit: int) -> list[dict]:
     db_users: list[schemas.DatabaseUser] = users.search_followeds(
         db, user_id, user, limit
     )
-    return [__database_model_to_schema(user) for user in db_users]
+    return [__database_model_to_payload(db, user) for user in db_users]
 
 
 def signup(db: Session, new_user: schemas.SignUpSchema) -> schemas.User:
@@ -80,7 +262,8 @@ def signup(db: Session, new_user: schemas.SignUpSchema) -> schemas.User:
     if not user:
         # _res = firebase_admin.auth.create_user(email=str(new_user.email), password=new_user.password)
         db_user = users.insert_user(db=db, new_user=new_user)
-        return __database_model_to_schema(db_user)
+        autocomplete.user_index.add(db_user.id, db_user.user, db_user.name)
+        return __database_model_to_schema(db, db_user)
 
     # If here, then the user exists, so check for email or user repetition
     if user.email == new_user.email:
@@ -107,7 +290,9 @@ def fetch_admin_by_id(db: Session, id: UUID) -> schemas.Admin | None:
 
 
 def set_location(db: Session, user_id: UUID, location: CountryAlpha3) -> schemas.User:
-    return __database_model_to_schema(users.set_location(db, user_id, str(location)))
+    user = users.set_location(db, user_id, str(location))
+    profiles.profile_cache.invalidate(user_id)
+    return __database_model_to_schema(db, user)
 
 
 def set_interests(
@@ -117,56 +302,161 @@ def set_interests(
         models.UserInterests(interest=schemas.Interests(interest))
         for interest in interests
     ]
-    return __database_model_to_schema(users.set_interests(db, user_id, interests_list))
+    user = users.set_interests(db, user_id, interests_list)
+    profiles.profile_cache.invalidate(user_id)
+    return __database_model_to_schema(db, user)
 
 
 def set_goals(db: Session, user_id: UUID, goals: list[str]) -> schemas.User:
     goals_list = [models.UsersGoals(goal=goal) for goal in goals]
-    return __database_model_to_schema(users.set_goals(db, user_id, goals_list))
+    user = users.set_goals(db, user_id, goals_list)
+    profiles.profile_cache.invalidate(user_id)
+    return __database_model_to_schema(db, user)
+
 
+def __follow_response(
+    db: Session, user: models.User, source_id: UUID, followed_id: UUID, full: bool
+) -> schemas.Follow | schemas.User:
+    if full:
+        return __database_model_to_schema(db, user)
 
-def follow(db: Session, source_id: UUID, followed_id: str) -> schemas.User:
-    return __database_model_to_schema(
-        users.add_follower(db=db, source_id=source_id, followed_id=followed_id)
+    # Only the ids, the user expired on commit and would be loaded again
+    followeds_count, followers_count = users.get_follow_counts(
+        db, source_id, followed_id
+    )
+    return schemas.Follow(
+        follower_id=source_id,
+        followed_id=followed_id,
+        follower_followeds_count=followeds_count,
+        followed_followers_count=followers_count,
     )
 
 
-def unfollow(db: Session, source_id: UUID, followed_id: str) -> schemas.User:
-    return __database_model_to_schema(
-        users.remove_follow(db=db, source_id=source_id, followed_id=followed_id)
-    )
+def follow(
+    db: Session, source_id: UUID, followed_id: UUID, full: bool = False
+) -> schemas.Follow | schemas.User:
+    """
+    Returns the new follow with the updated counts, or the whole follower
+    user when `full`
+    """
+    user = users.add_follower(db=db, source_id=source_id, followed_id=followed_id)
+    profiles.profile_cache.invalidate(source_id, followed_id)
+    if SOCIAL_GRAPH_ENABLED:
+        graph.social_graph.follow(source_id, followed_id)
+    return __follow_response(db, user, source_id, followed_id, full)
+
+
+def unfollow(
+    db: Session, source_id: UUID, followed_id: UUID, full: bool = False
+) -> schemas.Follow | schemas.User:
+    """
+    Returns the removed follow with the updated counts, or the whole
+    follower user when `full`
+    """
+    user = users.remove_follow(db=db, source_id=source_id, followed_id=followed_id)
+    profiles.profile_cache.invalidate(source_id, followed_id)
+    if SOCIAL_GRAPH_ENABLED:
+        graph.social_graph.unfollow(source_id, followed_id)
+    return __follow_response(db, user, source_id, followed_id, full)
+
+
+def get_followers(
+    db: Session, user_id: UUID, limit: int, cursor: str | None = None
+) -> tuple[list[dict], str | None]:
+    return __paginate(db, users.get_followers, limit, cursor, user_id)
+
+
+def get_followeds(
+    db: Session, user_id: UUID, limit: int, cursor: str | None = None
+) -> tuple[list[dict], str | None]:
+    return __paginate(db, users.get_followeds, limit, cursor, user_id)
+
+
+def __export(
+    db: Session,
+    fetch_page: Callable[..., list[models.User]],
+    user_id: UUID,
+    page: list[models.User],
+    batch_size: int,
+) -> Iterator[bytes]:
+    while page:
+        yield b"".join(
+            orjson.dumps(__database_model_to_payload(db, user)) + b"\n" for user in page
+        )
+        if len(page) < batch_size:
+            return
+        after = page[-1].id
+        # Forgets the sent batch so the session doesn't grow with the list
+        db.expunge_all()
+        page = fetch_page(db, user_id, batch_size, after)
+
+
+def export_followers(
+    db: Session, user_id: UUID, batch_size: int = FOLLOWS_EXPORT_BATCH_SIZE
+) -> Iterator[bytes]:
+    """
+    Every follower of the user as NDJSON, fetched `batch_size` at a time.
+    The first batch is fetched right away, so UserNotFound is raised here
+    rather than while iterating.
+    """
+    page = users.get_followers(db, user_id, batch_size)
+    return __export(db, users.get_followers, user_id, page, batch_size)
+
+
+def export_followeds(
+    db: Session, user_id: UUID, batch_size: int = FOLLOWS_EXPORT_BATCH_SIZE
+) -> Iterator[bytes]:
+    page = users.get_followeds(db, user_id, batch_size)
+    return __export(db, users.get_followeds, user_id, page, batch_size)
 
 
-def get_followers(db: Session, user_id: UUID) -> list[schemas.User]:
-    return [
-        __database_model_to_schema(user) for user in users.get_followers(db, user_id)
-    ]
+def update_name(db: Session, user_id: UUID, name: str) -> schemas.User:
+    user = users.update_name(db, user_id, name)
+    profiles.profile_cache.invalidate(user_id)
+    if not user.is_blocked:
+        autocomplete.user_index.add(user.id, user.user, user.name)
+    return __database_model_to_schema(db, user)
 
 
-def get_followeds(db: Session, user_id: UUID) -> list[schemas.User]:
+def autocomplete_users(prefix: str, limit: int) -> list[schemas.UserSuggestion]:
     return [
-        __database_model_to_schema(user) for user in users.get_followeds(db, user_id)
+        schemas.UserSuggestion(id=user_id, user=user, name=name)
+        for user_id, user, name in autocomplete.user_index.search(prefix, limit)
     ]
 
 
-def update_name(db: Session, user_id: UUID, name: str) -> schemas.User:
-    return __database_model_to_schema(users.update_name(db, user_id, name))
+def get_recommendations(
+    db: Session, user_id: UUID, limit: int, cursor: str | None = None
+) -> tuple[list[schemas.RecommendationUser], str | None]:
+    """
+    Returns a page of at most `limit` recommendations, the best scored
+    first, and the cursor of the next page, which is None on the last one
+    """
+    # The cursor carries the score, a recomputation may drop the
+    # recommendation the previous page ended with
+    after = __decode_score_cursor(cursor) if cursor else None
+    page = users.get_recommendations(db, user_id, limit + 1, after)
 
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = __encode_score_cursor(page[-1]["score"], page[-1]["id"])
 
-def get_recommendations(db: Session, user_id: UUID) -> schemas.User:
     return [
         schemas.RecommendationUser(id=user["id"], user=user["user"], name=user["name"])
-        for user in users.get_recommendations(db, user_id)
-    ]
+        for user in page
+    ], next_cursor
 
 
 def block_user(db: Session, user_id: UUID) -> schemas.User:
-    return __database_model_to_schema(
-        users.modify_block_status(db, user_id, block_status=True)
-    )
+    user = users.modify_block_status(db, user_id, block_status=True)
+    profiles.profile_cache.invalidate(user_id)
+    autocomplete.user_index.remove(user.id)
+    return __database_model_to_schema(db, user)
 
 
 def unblock_user(db: Session, user_id: UUID) -> schemas.User:
-    return __database_model_to_schema(
-        users.modify_block_status(db, user_id, block_status=False)
-    )
+    user = users.modify_block_status(db, user_id, block_status=False)
+    profiles.profile_cache.invalidate(user_id)
+    autocomplete.user_index.add(user.id, user.user, user.name)
+    return __database_model_to_schema(db, user)
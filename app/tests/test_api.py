@@ -1,8 +1,15 @@
+import json
 from uuid import uuid4
 from fastapi import status
 from fastapi.testclient import TestClient
+from sqlalchemy import text
 from app.services.users import follow
 from app.main import app
+from app.repositories import database
+from app.repositories import users as users_repository
+from app.repositories import models
+from app.services import recommendations
+from app.services import users as users_service
 from app.utils.schemas import (
     Admin,
     SignUpAdminSchema,
@@ -12,6 +19,7 @@ from app.utils.schemas import (
     UserWithoutId,
 )
 from app.tests import utils
+from app.utils.config import USERS_BATCH_MAX_SIZE
 import pytest
 
 client = TestClient(app)
@@ -59,6 +67,47 @@ def test_get_users_returns_a_list_with_the_users():
     assert response.json() == [dumped_user]
 
 
+# Test getting users walks every user page by page
+def test_get_users_is_paginated_with_a_cursor():
+    created = set()
+    for i in range(5):
+        user: User = utils.create_user(
+            SignUpSchema(
+                email=f"page{i}@gmail.com",
+                password="pepo",
+                user=f"page{i}",
+                name=f"Page {i}",
+                location="ARG",
+            )
+        )
+        created.add(str(user.id))
+
+    seen = []
+    pages = 0
+    cursor = None
+    while True:
+        params = {"limit": 2} | ({"cursor": cursor} if cursor else {})
+        response = client.get("/users/", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()) <= 2
+        seen += [user["id"] for user in response.json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert pages == 3
+    assert seen == sorted(seen)
+    assert set(seen) == created
+
+
+# Test getting users with a malformed cursor returns bad request error
+def test_get_users_with_an_invalid_cursor_returns_bad_request_error():
+    response = client.get("/users/", params={"cursor": "not a cursor"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
 # Test getting user by ID with no users returns not found error
 def test_get_user_by_id_with_no_users_return_not_found_error():
     response = client.get(f"/users/{uuid4()}")
@@ -86,6 +135,55 @@ def test_get_user_by_id_returns_user_if_user_exists():
     assert response_json["id"]
 
 
+# Test getting a user returns counts instead of the follow lists
+def test_get_user_by_id_returns_counts_without_expanding_lists():
+    user: User = utils.create_user(test_user)
+    follower: User = utils.create_user(
+        SignUpSchema(
+            email="follower@test.com",
+            password="followerpass",
+            user="Follower",
+            name="Follower User",
+            location="ARG",
+        )
+    )
+    utils.follow(follower.id, user.id)
+
+    response_json = client.get(f"/users/{user.id}").json()
+
+    assert response_json["followers_count"] == 1
+    assert response_json["followeds_count"] == 0
+    assert response_json["twitsnaps_count"] == 0
+    assert response_json["followers"] is None
+    assert response_json["followeds"] is None
+    assert response_json["twitsnaps"] is None
+
+
+# Test expanding the follow lists of a user
+def test_get_user_by_id_expands_the_requested_lists():
+    user: User = utils.create_user(test_user)
+    follower: User = utils.create_user(
+        SignUpSchema(
+            email="follower@test.com",
+            password="followerpass",
+            user="Follower",
+            name="Follower User",
+            location="ARG",
+        )
+    )
+    utils.follow(follower.id, user.id)
+
+    response = client.get(
+        f"/users/email/{user.email}?expand=followers&expand=twitsnaps"
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    response_json = response.json()
+    assert response_json["followers"] == [str(follower.id)]
+    assert response_json["twitsnaps"] == []
+    assert response_json["followeds"] is None
+
+
 # Test signing up a new user
 def test_post_signup_creates_user():
     response = client.post(
@@ -146,6 +244,7 @@ def test_add_follower_updates_user_followers():
 
     response = client.post(
         f"/users/follow/{follower.id}",
+        params={"full": True},
         json=str(user.id),
     )
 
@@ -153,8 +252,10 @@ def test_add_follower_updates_user_followers():
     response_json = response.json()
     assert "id" in response_json
     assert response_json["user"] == follower.user
-    assert len(response_json["followeds"]) == 1
-    assert response_json["followeds"][0] == str(user.id)
+    assert response_json["followeds_count"] == 1
+
+    response = client.get(f"/users/{follower.id}?expand=followeds")
+    assert response.json()["followeds"] == [str(user.id)]
 
 
 def test_add_follower_already_following():
@@ -196,13 +297,84 @@ def test_remove_follower():
     # Now remove the follow
     response = client.delete(
         f"/users/follow/{follower.id}",
-        params={"followed_id": str(user.id)},
+        params={"followed_id": str(user.id), "full": True},
     )
 
     assert response.status_code == status.HTTP_200_OK
     response_json = response.json()
     assert response_json["id"] == str(follower.id)
-    assert len(response_json["followeds"]) == 0
+    assert response_json["followeds_count"] == 0
+
+
+def test_follow_and_unfollow_respond_with_the_follow_and_its_counts():
+    user: User = utils.create_user(test_user)
+    follower: User = utils.create_user(
+        SignUpSchema(
+            email="follower@test.com",
+            password="followerpass",
+            user="Follower",
+            name="Follower User",
+            location="ARG",
+        )
+    )
+
+    response = client.post(f"/users/follow/{follower.id}", json=str(user.id))
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == {
+        "follower_id": str(follower.id),
+        "followed_id": str(user.id),
+        "follower_followeds_count": 1,
+        "followed_followers_count": 1,
+    }
+
+    response = client.delete(
+        f"/users/follow/{follower.id}", params={"followed_id": str(user.id)}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "follower_id": str(follower.id),
+        "followed_id": str(user.id),
+        "follower_followeds_count": 0,
+        "followed_followers_count": 0,
+    }
+
+
+def test_reconcile_follow_counts_fixes_the_counts_of_follows_written_directly():
+    user: User = utils.create_user(test_user)
+    follower: User = utils.create_user(
+        SignUpSchema(
+            email="follower@test.com",
+            password="followerpass",
+            user="Follower",
+            name="Follower User",
+            location="ARG",
+        )
+    )
+    utils.follow(follower.id, user.id)
+    db = next(database.get_db())
+    # A follow inserted without going through the app, and a count gone wrong
+    db.execute(
+        text(
+            "INSERT INTO followers (follower_id, followed_id) "
+            "VALUES (:follower_id, :followed_id)"
+        ),
+        {"follower_id": user.id, "followed_id": follower.id},
+    )
+    db.execute(
+        text("UPDATE users SET followeds_count = 7 WHERE id = :id"),
+        {"id": follower.id},
+    )
+    db.commit()
+
+    assert users_repository.reconcile_follow_counts(db) == 2
+    assert users_repository.reconcile_follow_counts(db) == 0
+
+    for user_id in [user.id, follower.id]:
+        response_json = client.get(f"/users/{user_id}").json()
+        assert response_json["followers_count"] == 1
+        assert response_json["followeds_count"] == 1
 
 
 def test_remove_follower_not_following():
@@ -313,6 +485,76 @@ def test_get_followeds_of_non_existent_user():
     assert response_json["detail"] == "No user was found for the given id"
 
 
+def create_followers(user: User, amount: int) -> set[str]:
+    follower_ids = set()
+    for i in range(amount):
+        follower: User = utils.create_user(
+            SignUpSchema(
+                email=f"follower{i}@test.com",
+                password="followerpass",
+                user=f"Follower{i}",
+                name=f"Follower User {i}",
+                location="ARG",
+            )
+        )
+        utils.follow(follower.id, user.id)
+        follower_ids.add(str(follower.id))
+    return follower_ids
+
+
+# Test getting followers walks every follower page by page
+def test_get_followers_is_paginated_with_a_cursor():
+    user: User = utils.create_user(test_user)
+    follower_ids = create_followers(user, 5)
+
+    seen = []
+    response = client.get(f"/users/followers/{user.id}", params={"limit": 2})
+    seen += [follower["id"] for follower in response.json()]
+    while "X-Next-Cursor" in response.headers:
+        response = client.get(
+            f"/users/followers/{user.id}",
+            params={"limit": 2, "cursor": response.headers["X-Next-Cursor"]},
+        )
+        assert response.status_code == status.HTTP_200_OK
+        seen += [follower["id"] for follower in response.json()]
+
+    assert seen == sorted(seen)
+    assert set(seen) == follower_ids
+
+
+# Test exporting followers streams every follower as NDJSON
+def test_export_followers_streams_ndjson():
+    user: User = utils.create_user(test_user)
+    follower_ids = create_followers(user, 3)
+
+    response = client.get(f"/users/followers/{user.id}/export")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert {line["id"] for line in lines} == follower_ids
+
+
+# Test exporting followeds of a non-existent user
+def test_export_followeds_of_non_existent_user():
+    response = client.get(f"/users/followeds/{uuid4()}/export")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+# Test the export fetches the list in batches and across batch boundaries
+def test_export_followers_in_batches():
+    user: User = utils.create_user(test_user)
+    follower_ids = create_followers(user, 5)
+
+    db = next(database.get_db())
+    batches = list(users_service.export_followers(db, user.id, batch_size=2))
+
+    assert len(batches) == 3
+    lines = b"".join(batches).splitlines()
+    assert {json.loads(line)["id"] for line in lines} == follower_ids
+
+
 def test_post_admin_signup_creates_admin():
     response = client.post(
         "/users/admin/signup",
@@ -416,6 +658,30 @@ def test_search_users_returns_users_ordered_by_similarity():
     assert response_json[2]["id"] == str(user2.id)
 
 
+def test_search_users_only_returns_users_above_the_similarity_threshold(
+    monkeypatch,
+):
+    for name in ["therealuser", "therealuser2", "realuser3"]:
+        utils.create_user(
+            SignUpSchema(
+                email=f"{name}@gmail.com",
+                password="pass",
+                user=name,
+                name=name,
+                location="ARG",
+            )
+        )
+    monkeypatch.setattr(users_repository, "SEARCH_SIMILARITY_THRESHOLD", 0.75)
+
+    response = client.get("/users/search?user=therealuser&limit=10")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [user["user"] for user in response.json()] == [
+        "therealuser",
+        "therealuser2",
+    ]
+
+
 def test_search_followeds_returns_followeds_ordered_by_similarity():
     user1: User = utils.create_user(
         SignUpSchema(
@@ -516,6 +782,7 @@ def test_recommendations_with_location_coincidences():
         )
     )
 
+    recommendations.rebuild()
     res = client.get(f"/users/recommendations/{user1.id}")
 
     assert res.status_code == status.HTTP_200_OK
@@ -571,6 +838,7 @@ def test_recommendations_with_interest_coincidences():
         )
     )
 
+    recommendations.rebuild()
     res = client.get(f"/users/recommendations/{user1.id}")
 
     assert res.status_code == status.HTTP_200_OK
@@ -625,6 +893,7 @@ def test_recommendations_with_followeds_followeds():
     utils.follow(user3.id, user2.id)
     utils.follow(user2.id, user1.id)
 
+    recommendations.rebuild()
     res = client.get(f"/users/recommendations/{user3.id}")
 
     assert res.status_code == status.HTTP_200_OK
@@ -683,6 +952,7 @@ def test_recommendations_with_followeds_followeds_does_not_include_an_already_fo
     utils.follow(user3.id, user2.id)
     utils.follow(user2.id, user1.id)
 
+    recommendations.rebuild()
     res = client.get(f"/users/recommendations/{user3.id}")
 
     assert res.status_code == status.HTTP_200_OK
@@ -691,6 +961,239 @@ def test_recommendations_with_followeds_followeds_does_not_include_an_already_fo
     assert len(res_json) == 0
 
 
+def recommendable_user(
+    name: str, location: str, interests: tuple[str, ...] = ()
+) -> User:
+    return utils.create_user_with_all_fields(
+        UserWithoutId(
+            email=f"{name}@gmail.com",
+            password=f"{name}pass",
+            user=f"the{name}",
+            name=name,
+            location=location,
+            interests=[Interests(interest) for interest in interests],
+            goals=[],
+            followeds=[],
+            followers=[],
+            twitsnaps=[],
+        )
+    )
+
+
+def test_recommendations_are_ranked_by_score_and_limited():
+    user1 = recommendable_user("user1", "ARG", ["engineering"])
+    user2 = recommendable_user("user2", "ARG", ["engineering"])
+    user3 = recommendable_user("user3", "ARG")
+    user4 = recommendable_user("user4", "USA", ["engineering"])
+    user5 = recommendable_user("user5", "USA")
+    user6 = recommendable_user("user6", "USA")
+    user7 = recommendable_user("user7", "USA")
+    for followed in [user5, user7]:
+        utils.follow(user1.id, followed.id)
+        utils.follow(followed.id, user6.id)
+
+    recommendations.rebuild()
+    res = client.get(f"/users/recommendations/{user1.id}")
+
+    assert res.status_code == status.HTTP_200_OK
+    # 3 per followed user following them, 2 per interest and 1 for location
+    assert [user["id"] for user in res.json()] == [
+        str(user6.id),
+        str(user2.id),
+        str(user4.id),
+        str(user3.id),
+    ]
+
+    res = client.get(f"/users/recommendations/{user1.id}", params={"limit": 1})
+
+    assert [user["id"] for user in res.json()] == [str(user6.id)]
+
+
+def test_recommendations_are_paginated():
+    user1 = recommendable_user("user1", "ARG")
+    others = [recommendable_user(f"user{i}", "ARG") for i in range(2, 7)]
+
+    recommended = []
+    params = {"limit": 2}
+    recommendations.rebuild()
+    while True:
+        res = client.get(f"/users/recommendations/{user1.id}", params=params)
+        assert res.status_code == status.HTTP_200_OK
+        assert len(res.json()) <= 2
+        recommended += [user["id"] for user in res.json()]
+        if "X-Next-Cursor" not in res.headers:
+            break
+        params["cursor"] = res.headers["X-Next-Cursor"]
+
+    assert sorted(recommended) == sorted(str(user.id) for user in others)
+
+
+def test_recommendations_pages_go_on_after_the_last_one_was_dropped():
+    user1 = recommendable_user("user1", "ARG")
+    others = [recommendable_user(f"user{i}", "ARG") for i in range(2, 7)]
+
+    recommendations.rebuild()
+    res = client.get(f"/users/recommendations/{user1.id}", params={"limit": 2})
+    first_page = [user["id"] for user in res.json()]
+    # A recomputation no longer recommends the last user of the page
+    db = next(database.get_db())
+    db.execute(
+        text("DELETE FROM users_recommendations WHERE id_recommended = :id"),
+        {"id": first_page[-1]},
+    )
+    db.commit()
+
+    res = client.get(
+        f"/users/recommendations/{user1.id}",
+        params={"limit": 5, "cursor": res.headers["X-Next-Cursor"]},
+    )
+
+    assert sorted(first_page + [user["id"] for user in res.json()]) == sorted(
+        str(user.id) for user in others
+    )
+
+
+def test_recommendations_take_the_most_followed_candidates(monkeypatch):
+    monkeypatch.setattr(users_repository, "RECOMMENDATIONS_CANDIDATES_PER_SOURCE", 1)
+    user1 = recommendable_user("user1", "ARG", ["engineering"])
+    users = [
+        recommendable_user(f"user{i}", "ARG", ["engineering"]) for i in range(2, 6)
+    ]
+    follower = recommendable_user("follower", "USA")
+    most_followed = users[2]
+    utils.follow(follower.id, most_followed.id)
+
+    recommendations.rebuild()
+    res = client.get(f"/users/recommendations/{user1.id}")
+
+    assert [user["id"] for user in res.json()] == [str(most_followed.id)]
+
+
+def test_recommendations_take_the_most_followed_of_each_interest(monkeypatch):
+    monkeypatch.setattr(users_repository, "RECOMMENDATIONS_CANDIDATES_PER_SOURCE", 1)
+    user1 = recommendable_user("user1", "ARG", ["engineering", "sports"])
+    engineers = [
+        recommendable_user(f"eng{i}", "USA", ["engineering"]) for i in range(3)
+    ]
+    athletes = [recommendable_user(f"ath{i}", "URY", ["sports"]) for i in range(3)]
+    for followed in [engineers[1], athletes[2]]:
+        utils.follow(recommendable_user(f"fan{followed.name}", "BRA").id, followed.id)
+
+    recommendations.rebuild()
+    res = client.get(f"/users/recommendations/{user1.id}")
+
+    assert sorted(user["id"] for user in res.json()) == sorted(
+        [str(engineers[1].id), str(athletes[2].id)]
+    )
+
+
+def test_recommendations_with_an_invalid_cursor():
+    user1 = recommendable_user("user1", "ARG")
+
+    res = client.get(f"/users/recommendations/{user1.id}", params={"cursor": "nope"})
+
+    assert res.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_recommendations_leave_out_blocked_users():
+    user1 = recommendable_user("user1", "ARG")
+    user2 = recommendable_user("user2", "ARG")
+    user3 = recommendable_user("user3", "ARG")
+    client.patch(f"/users/block/{user2.id}")
+
+    recommendations.rebuild()
+    res = client.get(f"/users/recommendations/{user1.id}")
+    assert [user["id"] for user in res.json()] == [str(user3.id)]
+
+    # Also when blocked after the recommendations were computed
+    client.patch(f"/users/block/{user3.id}")
+
+    res = client.get(f"/users/recommendations/{user1.id}")
+    assert res.json() == []
+
+
+def test_recommendations_are_only_read_until_the_rebuild_computes_them():
+    user1 = recommendable_user("user1", "ARG")
+    user2 = recommendable_user("user2", "ARG")
+
+    with utils.count_queries() as statements:
+        res = client.get(f"/users/recommendations/{user1.id}")
+
+    assert res.json() == []
+    assert all(statement.lstrip().startswith("SELECT") for statement in statements)
+
+    # The users who never read theirs are computed too
+    assert recommendations.rebuild() == 2
+
+    res = client.get(f"/users/recommendations/{user1.id}")
+    assert [user["id"] for user in res.json()] == [str(user2.id)]
+
+
+def test_recommendations_are_computed_again_after_following():
+    user1 = recommendable_user("user1", "ARG")
+    user2 = recommendable_user("user2", "ARG")
+    recommendations.rebuild()
+
+    utils.follow(user1.id, user2.id)
+
+    # The stored ones until the rebuild
+    res = client.get(f"/users/recommendations/{user1.id}")
+    assert [user["id"] for user in res.json()] == [str(user2.id)]
+
+    # Only user1's, invalidated by the follow, before they get old
+    assert recommendations.rebuild() == 1
+
+    res = client.get(f"/users/recommendations/{user1.id}")
+    assert res.json() == []
+
+
+def test_recommendations_rebuild_picks_up_the_changes_of_other_users():
+    user1 = recommendable_user("user1", "ARG")
+    user2 = recommendable_user("user2", "USA")
+    user3 = recommendable_user("user3", "ATG")
+    utils.follow(user1.id, user2.id)
+    recommendations.rebuild()
+
+    res = client.get(f"/users/recommendations/{user1.id}")
+    assert res.json() == []
+
+    utils.follow(user2.id, user3.id)
+
+    # Until the rebuild, user1 gets the recommendations stored before
+    res = client.get(f"/users/recommendations/{user1.id}")
+    assert res.json() == []
+
+    assert recommendations.rebuild(max_age=0) == 3
+
+    res = client.get(f"/users/recommendations/{user1.id}")
+    assert [user["id"] for user in res.json()] == [str(user3.id)]
+
+
+def test_recommendations_rebuild_only_recomputes_the_stale_ones():
+    user1 = recommendable_user("user1", "ARG")
+    user2 = recommendable_user("user2", "ARG")
+    assert recommendations.rebuild() == 2
+
+    assert recommendations.rebuild(max_age=3600) == 0
+
+    # Another worker rebuilding user1's recommendations right now
+    other_worker = next(database.get_db())
+    locked = users_repository.lock_stale_recommendations(
+        other_worker, other_worker.scalar(text("SELECT localtimestamp")), 1
+    )
+    assert len(locked) == 1
+
+    assert recommendations.rebuild(max_age=0) == 1
+    other_worker.rollback()
+    assert recommendations.rebuild(max_age=0) == 2
+
+
+def test_recommendations_of_a_non_existent_user():
+    res = client.get(f"/users/recommendations/{uuid4()}")
+
+    assert res.status_code == status.HTTP_404_NOT_FOUND
+
+
 def test_block_non_existent_user():
     response = client.patch(
         f"/users/block/{uuid4()}",
@@ -718,6 +1221,7 @@ def test_block_user():
     response_user = user.model_dump()
     response_user["is_blocked"] = True
     response_user["id"] = str(response_user["id"])
+    response_user["version"] += 1
 
     assert response.status_code == status.HTTP_200_OK
     response_json = response.json()
@@ -768,3 +1272,351 @@ def test_unblock_blocked_user():
     response_json = response.json()
     assert response_json["id"] == str(user.id)
     assert response_json["is_blocked"] == False
+
+
+# Test autocomplete finds users right after they sign up
+def test_autocomplete_returns_users_by_prefix():
+    user: User = utils.create_user(test_user)
+
+    response = client.get("/users/autocomplete?q=pe")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [
+        {"id": str(user.id), "user": user.user, "name": user.name}
+    ]
+
+
+# Test autocomplete follows renames and blocks
+def test_autocomplete_follows_renames_and_blocks():
+    user: User = utils.create_user(test_user)
+
+    client.put(f"/users/name/{user.id}?name=Jose Perez")
+    assert client.get("/users/autocomplete?q=don").json() == []
+    assert [u["name"] for u in client.get("/users/autocomplete?q=jos").json()] == [
+        "Jose Perez"
+    ]
+
+    client.patch(f"/users/block/{user.id}")
+    assert client.get("/users/autocomplete?q=pepo").json() == []
+
+    client.patch(f"/users/unblock/{user.id}")
+    assert len(client.get("/users/autocomplete?q=pepo").json()) == 1
+
+
+def create_followed_hub(amount: int) -> User:
+    hub: User = utils.create_user(test_user)
+    for i in range(amount):
+        user = utils.create_user_with_all_fields(
+            UserWithoutId(
+                email=f"listuser{i}@gmail.com",
+                user=f"listuser{i}",
+                name=f"List User {i}",
+                location="ARG",
+                interests=[Interests("science"), Interests("games")],
+                goals=[],
+                followeds=[],
+                followers=[],
+                twitsnaps=[],
+            )
+        )
+        client.post(f"/users/goals/{user.id}", json=["Learn FastAPI"])
+        utils.follow(user.id, hub.id)
+        utils.follow(hub.id, user.id)
+    return hub
+
+
+@pytest.mark.parametrize(
+    "endpoint",
+    [
+        "/users/",
+        "/users/search?user=listuser&limit=50",
+        "/users/followers/{hub}",
+        "/users/followeds/{hub}",
+        "/users/followeds/{hub}/search?user=listuser&limit=50",
+    ],
+)
+def test_list_endpoints_run_the_same_queries_whatever_the_page_size(endpoint):
+    query_counts = []
+    for amount in [2, 8]:
+        utils.empty_database()
+        hub = create_followed_hub(amount)
+
+        with utils.count_queries() as statements:
+            response = client.get(endpoint.format(hub=hub.id))
+
+        assert response.status_code == status.HTTP_200_OK
+        listed = [u for u in response.json() if u["user"].startswith("listuser")]
+        assert len(listed) == amount
+        assert all(user["goals"] == ["Learn FastAPI"] for user in listed)
+        query_counts.append(len(statements))
+
+    assert query_counts[0] == query_counts[1]
+
+
+def test_follow_and_unfollow_run_the_same_queries_whatever_the_follows():
+    query_counts = []
+    for amount in [2, 8]:
+        utils.empty_database()
+        hub = create_followed_hub(amount)
+        newcomer: User = utils.create_user(
+            SignUpSchema(
+                email="newcomer@test.com",
+                password="newcomerpass",
+                user="Newcomer",
+                name="New Comer",
+                location="ARG",
+            )
+        )
+
+        with utils.count_queries() as statements:
+            response = client.post(f"/users/follow/{hub.id}", json=str(newcomer.id))
+            assert response.status_code == status.HTTP_201_CREATED
+            response = client.delete(
+                f"/users/follow/{hub.id}", params={"followed_id": str(newcomer.id)}
+            )
+            assert response.status_code == status.HTTP_200_OK
+
+        query_counts.append(len(statements))
+
+    assert query_counts[0] == query_counts[1]
+
+
+def test_follow_response_does_not_load_the_whole_user():
+    user: User = utils.create_user(test_user)
+    follower: User = utils.create_user(
+        SignUpSchema(
+            email="follower@test.com",
+            password="followerpass",
+            user="Follower",
+            name="Follower User",
+            location="ARG",
+        )
+    )
+
+    query_counts = []
+    for full in [False, True]:
+        with utils.count_queries() as statements:
+            client.post(
+                f"/users/follow/{follower.id}",
+                params={"full": full},
+                json=str(user.id),
+            ).raise_for_status()
+        client.delete(
+            f"/users/follow/{follower.id}", params={"followed_id": str(user.id)}
+        ).raise_for_status()
+        query_counts.append(len(statements))
+
+        if not full:
+            # The users lookup, the insert, the counts updates of the users
+            # and of the followed user's interests, the recommendations, the
+            # change notifications and reading the counts back
+            assert len(statements) == 7
+            assert not any("users_goals" in statement for statement in statements)
+
+    assert query_counts[0] < query_counts[1]
+
+
+def test_get_user_is_served_from_the_profile_cache():
+    user: User = utils.create_user(test_user)
+    client.get(f"/users/{user.id}").raise_for_status()
+
+    with utils.count_queries() as statements:
+        by_id = client.get(f"/users/{user.id}")
+        by_email = client.get(f"/users/email/{user.email}")
+
+    assert by_id.json() == by_email.json()
+    assert by_id.json()["name"] == "Don Pepo"
+    # Only the sessions checking out their connection
+    assert not any("FROM users" in statement for statement in statements)
+
+
+def test_writes_invalidate_the_cached_profiles_of_the_users_they_change():
+    user: User = utils.create_user(test_user)
+    follower: User = utils.create_user(
+        SignUpSchema(
+            email="follower@test.com",
+            password="followerpass",
+            user="Follower",
+            name="Follower User",
+            location="ARG",
+        )
+    )
+    for user_id in [user.id, follower.id]:
+        client.get(f"/users/{user_id}").raise_for_status()
+
+    client.put(f"/users/name/{user.id}", params={"name": "Pepo"}).raise_for_status()
+    client.post(f"/users/follow/{follower.id}", json=str(user.id)).raise_for_status()
+
+    assert client.get(f"/users/{user.id}").json()["name"] == "Pepo"
+    assert client.get(f"/users/email/{user.email}").json()["followers_count"] == 1
+    assert client.get(f"/users/{follower.id}").json()["followeds_count"] == 1
+
+    client.patch(f"/users/block/{user.id}").raise_for_status()
+
+    assert client.get(f"/users/{user.id}").status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_get_user_answers_if_none_match_with_not_modified():
+    user: User = utils.create_user(test_user)
+    etag = client.get(f"/users/{user.id}").headers["ETag"]
+
+    with utils.count_queries() as statements:
+        response = client.get(f"/users/{user.id}", headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    # Only the version, without the user or any of their lists
+    assert len(statements) == 1
+    assert "users.version" in statements[0]
+
+    by_email = client.get(
+        f"/users/email/{user.email}", headers={"If-None-Match": f"W/{etag}"}
+    )
+    assert by_email.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+def test_get_user_etag_changes_with_every_change_to_the_user():
+    user: User = utils.create_user(test_user)
+    follower: User = utils.create_user(
+        SignUpSchema(
+            email="follower@test.com",
+            password="followerpass",
+            user="Follower",
+            name="Follower User",
+            location="ARG",
+        )
+    )
+    etag = client.get(f"/users/{user.id}").headers["ETag"]
+    expanded_etag = client.get(
+        f"/users/{user.id}", params={"expand": "followers"}
+    ).headers["ETag"]
+    assert expanded_etag != etag
+
+    client.post(f"/users/follow/{follower.id}", json=str(user.id)).raise_for_status()
+    response = client.get(f"/users/{user.id}", headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["followers_count"] == 1
+    assert response.headers["ETag"] != etag
+
+    etag = response.headers["ETag"]
+    client.put(f"/users/name/{user.id}", params={"name": "Pepo"}).raise_for_status()
+    response = client.get(f"/users/{user.id}", headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["name"] == "Pepo"
+
+
+def test_get_user_etag_changes_with_the_twitsnaps_of_the_user():
+    user: User = utils.create_user(test_user)
+    etag = client.get(f"/users/{user.id}").headers["ETag"]
+
+    # Written by the twitsnaps service, straight to the database
+    db = next(database.get_db())
+    db.add(models.UserTwitsnaps(id_user=user.id, id_twitsnap=uuid4()))
+    db.commit()
+    response = client.get(f"/users/{user.id}", headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["twitsnaps_count"] == 1
+    assert response.headers["ETag"] != etag
+
+    etag = response.headers["ETag"]
+    db.query(models.UserTwitsnaps).filter_by(id_user=user.id).delete()
+    db.commit()
+    response = client.get(f"/users/email/{user.email}", headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["twitsnaps_count"] == 0
+
+
+def test_users_batch_returns_summaries_and_flags_missing_and_blocked_users():
+    user: User = utils.create_user(test_user)
+    other: User = utils.create_user(
+        SignUpSchema(
+            email="other@test.com",
+            password="otherpass",
+            user="Other",
+            name="Other User",
+            location="ARG",
+        )
+    )
+    blocked: User = utils.create_user(
+        SignUpSchema(
+            email="blocked@test.com",
+            password="blockedpass",
+            user="Blocked",
+            name="Blocked User",
+            location="ARG",
+        )
+    )
+    client.patch(f"/users/block/{blocked.id}").raise_for_status()
+    unknown = str(uuid4())
+
+    with utils.count_queries() as statements:
+        response = client.post(
+            "/users/batch",
+            json={
+                "ids": [str(user.id), unknown, str(blocked.id)],
+                "emails": [other.email, "nobody@test.com"],
+            },
+        )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "users": {
+            str(user.id): {
+                "id": str(user.id),
+                "email": user.email,
+                "user": "Pepo",
+                "name": "Don Pepo",
+            },
+            str(other.id): {
+                "id": str(other.id),
+                "email": other.email,
+                "user": "Other",
+                "name": "Other User",
+            },
+        },
+        "missing": [unknown, "nobody@test.com"],
+        "blocked": [str(blocked.id)],
+        "cache_hits": 0,
+    }
+    assert len(statements) == 1
+
+
+def test_users_batch_reuses_the_profile_cache():
+    user: User = utils.create_user(test_user)
+    other: User = utils.create_user(
+        SignUpSchema(
+            email="other@test.com",
+            password="otherpass",
+            user="Other",
+            name="Other User",
+            location="ARG",
+        )
+    )
+    client.get(f"/users/{user.id}").raise_for_status()
+
+    response = client.post(
+        "/users/batch", json={"ids": [str(user.id)], "emails": [other.email]}
+    )
+
+    assert response.json()["cache_hits"] == 1
+    assert set(response.json()["users"]) == {str(user.id), str(other.id)}
+
+    with utils.count_queries() as statements:
+        response = client.post("/users/batch", json={"ids": [str(user.id)]})
+
+    assert response.json()["cache_hits"] == 1
+    assert not statements
+
+
+def test_users_batch_with_too_many_users_returns_bad_request_error():
+    response = client.post(
+        "/users/batch",
+        json={"ids": [str(uuid4()) for _ in range(USERS_BATCH_MAX_SIZE + 1)]},
+    )
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,116 @@
+from uuid import uuid4
+
+from app.repositories import database
+from app.services import autocomplete
+from app.services import users as users_service
+from app.services.autocomplete import PrefixIndex
+from app.tests import utils
+from app.utils.schemas import SignUpSchema
+
+
+def users_of(index: PrefixIndex, prefix: str, limit: int = 10) -> list[str]:
+    return [user for _, user, _ in index.search(prefix, limit)]
+
+
+def test_search_matches_the_start_of_the_user_or_of_a_name_word():
+    index = PrefixIndex()
+    index.build(
+        [
+            (uuid4(), "pepo", "Don Pepo"),
+            (uuid4(), "maria99", "Maria Gonzalez"),
+            (uuid4(), "gonzo", "Juan Perez"),
+        ]
+    )
+
+    assert users_of(index, "pep") == ["pepo"]
+    assert users_of(index, "GON") == ["maria99", "gonzo"]
+    assert users_of(index, "perez") == ["gonzo"]
+    assert users_of(index, "ez") == []
+
+
+def test_search_returns_each_user_once_and_at_most_limit():
+    index = PrefixIndex()
+    index.build([(uuid4(), f"ana{i}", f"Ana {i}") for i in range(20)])
+
+    results = index.search("ana", limit=5)
+
+    assert len(results) == 5
+    assert len({user_id for user_id, _, _ in results}) == 5
+
+
+def test_add_updates_a_user_already_in_the_index():
+    index = PrefixIndex()
+    user_id = uuid4()
+    index.add(user_id, "pepo", "Don Pepo")
+
+    index.add(user_id, "pepo", "Jose Perez")
+
+    assert users_of(index, "don") == []
+    assert users_of(index, "jose") == ["pepo"]
+    assert index.stats()["users"] == 1
+    assert index.stats()["delta_keys"] == 3
+
+
+def test_changes_after_a_build_skip_the_outdated_built_keys():
+    index = PrefixIndex()
+    renamed, blocked = uuid4(), uuid4()
+    index.build([(renamed, "pepo", "Don Pepo"), (blocked, "pepa", "Dona Pepa")])
+
+    index.add(renamed, "pepo", "Jose Perez")
+    index.remove(blocked)
+
+    assert users_of(index, "do") == []
+    assert users_of(index, "pep") == ["pepo"]
+    assert users_of(index, "jo") == ["pepo"]
+    assert index.stats()["outdated_users"] == 2
+
+
+def test_changes_made_during_a_build_are_kept():
+    index = PrefixIndex()
+    signed_up, blocked = uuid4(), uuid4()
+
+    def entries():
+        yield blocked, "pepa", "Dona Pepa"
+        # Committed while the build is still reading the users
+        index.add(signed_up, "pepo", "Don Pepo")
+        index.remove(blocked)
+
+    index.build(entries())
+
+    assert users_of(index, "pep") == ["pepo"]
+    assert index.stats()["delta_keys"] == 2
+
+
+def test_remove_only_drops_that_user():
+    index = PrefixIndex()
+    kept, removed = uuid4(), uuid4()
+    index.add(kept, "pepo", "Pepo")
+    index.add(removed, "pepe", "Pepo")
+
+    index.remove(removed)
+    index.remove(uuid4())
+
+    assert index.search("pep", 10) == [(kept, "pepo", "Pepo")]
+
+
+def test_rebuild_loads_the_users_that_are_not_blocked():
+    utils.empty_database()
+    user, blocked = [
+        utils.create_user(
+            SignUpSchema(
+                email=f"{name}@test.com",
+                password="pepo",
+                user=name,
+                name="Don Pepo",
+                location="ARG",
+            )
+        )
+        for name in ["Pepo", "Pepa"]
+    ]
+    users_service.block_user(next(database.get_db()), blocked.id)
+    index = PrefixIndex()
+
+    autocomplete.rebuild(index)
+
+    assert users_of(index, "pep") == [user.user]
+    assert index.built_at is not None
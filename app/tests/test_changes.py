@@ -0,0 +1,187 @@
+import asyncio
+import time
+from uuid import uuid4
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.repositories import database
+from app.repositories import users as users_repository
+from app.services import changes
+from app.services.autocomplete import PrefixIndex
+from app.services.changes import ChangesListener
+from app.services.graph import SocialGraph
+from app.services.profiles import ProfileCache
+from app.tests import utils
+from app.utils.schemas import SignUpSchema
+
+
+def create_pepo():
+    utils.empty_database()
+    return utils.create_user(
+        SignUpSchema(
+            email="donpepo@test.com",
+            password="pepo",
+            user="Pepo",
+            name="Don Pepo",
+            location="ARG",
+        )
+    )
+
+
+def set_location(user_id, location: str):
+    db = next(database.get_db())
+    users_repository.set_location(db, user_id, location)
+
+
+def test_a_change_in_one_worker_is_dropped_from_the_cache_of_the_others():
+    user = create_pepo()
+
+    async def invalidation_latency() -> float:
+        # Two workers, each with its own cache and listener
+        caches = [ProfileCache(ttl=60, max_size=10) for _ in range(2)]
+        listeners = [ChangesListener(cache) for cache in caches]
+        tasks = [asyncio.create_task(listener.listen()) for listener in listeners]
+        try:
+            while not all(listener.connected for listener in listeners):
+                await asyncio.sleep(0.01)
+            for cache in caches:
+                cache.set(user.model_dump(mode="json"), cache.generation())
+
+            start = time.perf_counter()
+            # A third worker changes the user, without touching their caches
+            await run_in_threadpool(set_location, user.id, "URY")
+            while any(cache.get_by_id(user.id) for cache in caches):
+                await asyncio.sleep(0.001)
+            return time.perf_counter() - start
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    latency = asyncio.run(invalidation_latency())
+
+    assert latency < 1
+
+
+def test_a_change_to_every_user_drops_the_whole_cache():
+    cache = ProfileCache(ttl=60, max_size=10)
+    listener = ChangesListener(cache, connect=None)
+    user = create_pepo()
+    cache.set(user.model_dump(mode="json"), cache.generation())
+
+    asyncio.run(listener.apply(f"name:{user.id}"))
+    assert cache.get_by_id(user.id) is None
+
+    cache.set(user.model_dump(mode="json"), cache.generation())
+    asyncio.run(listener.apply("counts:"))
+
+    assert cache.get_by_id(user.id) is None
+    assert listener.stats()["received"] == 2
+
+
+def test_a_notified_name_change_or_block_updates_the_autocomplete_index():
+    index = PrefixIndex()
+    listener = ChangesListener(ProfileCache(ttl=60, max_size=10), None, index)
+    user = create_pepo()
+    index.add(user.id, "Pepo", "Don Pepo")
+    db = next(database.get_db())
+    users_repository.update_name(db, user.id, "Pepito")
+
+    asyncio.run(listener.apply(f"name:{user.id}"))
+
+    assert index.search("pepi", 10) == [(user.id, "Pepo", "Pepito")]
+
+    asyncio.run(listener.apply(f"block:{user.id}"))
+
+    assert index.search("pepo", 10) == []
+
+    asyncio.run(listener.apply(f"unblock:{user.id}"))
+
+    assert index.search("pepo", 10) == [(user.id, "Pepo", "Pepito")]
+
+
+def test_a_notified_follow_updates_the_social_graph():
+    graph = SocialGraph()
+    listener = ChangesListener(ProfileCache(ttl=60, max_size=10), None, graph=graph)
+    follower, followed = uuid4(), uuid4()
+
+    asyncio.run(listener.apply(f"follow:{follower}:{followed}"))
+
+    assert graph.is_following(follower, followed)
+    assert not graph.is_following(followed, follower)
+
+    asyncio.run(listener.apply(f"unfollow:{follower}:{followed}"))
+
+    assert not graph.is_following(follower, followed)
+
+
+def test_a_follow_is_notified_with_the_follower_then_the_followed():
+    graph = SocialGraph()
+    pepo = create_pepo()
+    pepa = utils.create_user(
+        SignUpSchema(
+            email="donapepa@test.com",
+            password="pepa",
+            user="Pepa",
+            name="Doña Pepa",
+            location="ARG",
+        )
+    )
+
+    async def notified_follow():
+        listener = ChangesListener(ProfileCache(ttl=60, max_size=10), graph=graph)
+        task = asyncio.create_task(listener.listen())
+        try:
+            while not listener.connected:
+                await asyncio.sleep(0.01)
+            db = next(database.get_db())
+            await run_in_threadpool(users_repository.add_follower, db, pepo.id, pepa.id)
+            while not graph.is_following(pepo.id, pepa.id):
+                await asyncio.sleep(0.001)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(asyncio.wait_for(notified_follow(), 5))
+
+
+def test_a_signup_in_another_worker_is_added_to_the_autocomplete_index():
+    utils.empty_database()
+    index = PrefixIndex()
+
+    async def notified_signup():
+        listener = ChangesListener(ProfileCache(ttl=60, max_size=10), index=index)
+        task = asyncio.create_task(listener.listen())
+        try:
+            while not listener.connected:
+                await asyncio.sleep(0.01)
+            user = await run_in_threadpool(
+                utils.create_user,
+                SignUpSchema(
+                    email="donpepo@test.com",
+                    password="pepo",
+                    user="Pepo",
+                    name="Don Pepo",
+                    location="ARG",
+                ),
+            )
+            while not index.search("pepo", 10):
+                await asyncio.sleep(0.001)
+            return user
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    user = asyncio.run(asyncio.wait_for(notified_signup(), 5))
+
+    assert index.search("pepo", 10) == [(user.id, "Pepo", "Don Pepo")]
+
+
+def test_does_not_listen_through_pgbouncer_without_a_direct_url(monkeypatch):
+    monkeypatch.setattr(changes, "DB_PGBOUNCER", True)
+    monkeypatch.setattr(changes, "CHANGES_DATABASE_URL", None)
+    listener = ChangesListener(connect=None)
+
+    asyncio.run(asyncio.wait_for(changes.keep_listening(0, listener), 1))
+
+    assert listener.stats()["connections"] == 0
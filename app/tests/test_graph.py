@@ -0,0 +1,208 @@
+from uuid import UUID, uuid4
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.repositories import users as users_repository
+from app.services import graph, recommendations
+from app.services.graph import SocialGraph
+from app.tests import utils
+from app.utils.schemas import SignUpSchema
+
+
+def built_graph(follows: list[tuple[int, int]], size: int = 5):
+    """A graph of `size` users, ordered by id, with the follows between them"""
+    ids = sorted(uuid4() for _ in range(size))
+    social_graph = SocialGraph()
+    social_graph.build(ids, sorted((ids[a], ids[b]) for a, b in follows))
+    return social_graph, ids
+
+
+def test_is_following_after_the_build():
+    social_graph, ids = built_graph([(0, 1), (0, 2), (1, 0)])
+
+    assert social_graph.is_following(ids[0], ids[1])
+    assert social_graph.is_following(ids[1], ids[0])
+    assert not social_graph.is_following(ids[1], ids[2])
+    assert not social_graph.is_following(ids[0], uuid4())
+
+
+def test_follows_and_unfollows_after_the_build():
+    social_graph, ids = built_graph([(0, 1)])
+    newcomer = uuid4()
+
+    social_graph.unfollow(ids[0], ids[1])
+    social_graph.follow(ids[0], ids[2])
+    social_graph.follow(newcomer, ids[0])
+
+    assert not social_graph.is_following(ids[0], ids[1])
+    assert social_graph.is_following(ids[0], ids[2])
+    assert social_graph.is_following(newcomer, ids[0])
+    assert social_graph.followers_count(ids[0]) == 1
+    assert social_graph.followeds_count(ids[0]) == 1
+
+    social_graph.follow(ids[0], ids[1])
+
+    assert social_graph.is_following(ids[0], ids[1])
+    assert social_graph.followeds_count(ids[0]) == 2
+
+
+def test_mutual_follows_and_common_followers():
+    social_graph, ids = built_graph([(0, 1), (1, 0), (0, 2), (3, 1), (3, 2), (4, 2)])
+
+    assert social_graph.mutual_follows(ids[0]) == [ids[1]]
+    assert set(social_graph.common_followers(ids[1], ids[2])) == {ids[0], ids[3]}
+    assert social_graph.common_followers(ids[1], uuid4()) == []
+
+
+def test_two_hop_candidates_are_ranked_and_leave_out_followeds():
+    social_graph, ids = built_graph(
+        [(0, 1), (0, 2), (1, 3), (2, 3), (2, 4), (1, 2), (3, 0)]
+    )
+
+    assert social_graph.two_hop_candidates(ids[0], 10) == [(ids[3], 2), (ids[4], 1)]
+    assert social_graph.two_hop_candidates(ids[0], 1) == [(ids[3], 2)]
+
+
+def test_changes_made_during_a_build_are_kept():
+    social_graph, ids = built_graph([])
+
+    def follows():
+        # Another request follows while the build reads the follows
+        social_graph.follow(ids[2], ids[3])
+        yield (ids[0], ids[1])
+
+    social_graph.build(ids, follows())
+
+    assert social_graph.is_following(ids[0], ids[1])
+    assert social_graph.is_following(ids[2], ids[3])
+
+
+def test_rebuild_loads_the_follows():
+    utils.empty_database()
+    pepo, pepa = [
+        utils.create_user(
+            SignUpSchema(
+                email=f"{name}@test.com",
+                password="pepo",
+                user=name,
+                name="Don Pepo",
+                location="ARG",
+            )
+        )
+        for name in ["Pepo", "Pepa"]
+    ]
+    utils.follow(pepo.id, pepa.id)
+    social_graph = SocialGraph()
+
+    graph.rebuild(social_graph)
+
+    assert social_graph.is_following(UUID(str(pepo.id)), UUID(str(pepa.id)))
+    assert not social_graph.is_following(UUID(str(pepa.id)), UUID(str(pepo.id)))
+    assert social_graph.built_at is not None
+
+
+def test_rebuild_copies_the_same_graph_as_the_built_one():
+    utils.empty_database()
+    created = [
+        utils.create_user(
+            SignUpSchema(
+                email=f"pepo{i}@test.com",
+                password="pepo",
+                user=f"Pepo{i}",
+                name="Don Pepo",
+                location="ARG",
+            )
+        )
+        for i in range(5)
+    ]
+    ids = sorted(UUID(str(user.id)) for user in created)
+    follows = [(0, 1), (0, 2), (1, 0), (2, 4), (3, 4), (4, 0)]
+    for a, b in follows:
+        utils.follow(ids[a], ids[b])
+    built = SocialGraph()
+    built.build(ids, sorted((ids[a], ids[b]) for a, b in follows))
+    copied = SocialGraph()
+
+    graph.rebuild(copied)
+
+    assert copied.stats()["users"] == 5
+    assert copied.stats()["built_follows"] == len(follows)
+    for user_id in ids:
+        assert copied.followers_count(user_id) == built.followers_count(user_id)
+        assert copied.followeds_count(user_id) == built.followeds_count(user_id)
+        assert copied.mutual_follows(user_id) == built.mutual_follows(user_id)
+
+
+def test_recommendations_find_the_followeds_of_the_followeds_in_the_graph(
+    monkeypatch,
+):
+    utils.empty_database()
+    pepo, pepa, pepe = [
+        utils.create_user(
+            SignUpSchema(
+                email=f"{name}@test.com",
+                password="pepo",
+                user=name,
+                name="Don Pepo",
+                location=location,
+            )
+        )
+        for name, location in [("Pepo", "ARG"), ("Pepa", "USA"), ("Pepe", "ATG")]
+    ]
+    utils.follow(pepo.id, pepa.id)
+    monkeypatch.setattr(graph, "SOCIAL_GRAPH_ENABLED", True)
+    graph.rebuild()
+    # Only the graph knows about this follow
+    graph.social_graph.follow(pepa.id, pepe.id)
+
+    try:
+        recommendations.rebuild()
+        response = TestClient(app).get(f"/users/recommendations/{pepo.id}")
+    finally:
+        graph.social_graph.clear()
+
+    assert [user["id"] for user in response.json()] == [str(pepe.id)]
+
+
+def test_the_graph_and_the_database_take_the_same_two_hop_candidates(monkeypatch):
+    utils.empty_database()
+    pepo, *others = [
+        utils.create_user(
+            SignUpSchema(
+                email=f"pepo{i}@test.com",
+                password="pepo",
+                user=f"Pepo{i}",
+                name="Don Pepo",
+                location=location,
+            )
+        )
+        for i, location in enumerate(["ARG", "USA", "ATG", "URY", "BRA", "CHL", "PER"])
+    ]
+    followeds, candidates = others[:2], others[2:]
+    for followed in followeds:
+        utils.follow(pepo.id, followed.id)
+    # Every candidate is followed by one followed user, the last one by both
+    utils.follow(followeds[0].id, candidates[0].id)
+    utils.follow(followeds[1].id, candidates[1].id)
+    utils.follow(followeds[0].id, candidates[2].id)
+    utils.follow(followeds[1].id, candidates[3].id)
+    utils.follow(followeds[0].id, candidates[3].id)
+    for module in [users_repository, graph]:
+        monkeypatch.setattr(module, "RECOMMENDATIONS_CANDIDATES_PER_SOURCE", 2)
+
+    def recommended() -> list[str]:
+        recommendations.rebuild(max_age=0)
+        response = TestClient(app).get(f"/users/recommendations/{pepo.id}")
+        return [user["id"] for user in response.json()]
+
+    from_database = recommended()
+    monkeypatch.setattr(graph, "SOCIAL_GRAPH_ENABLED", True)
+    graph.rebuild()
+    try:
+        from_graph = recommended()
+    finally:
+        graph.social_graph.clear()
+
+    tied = sorted(candidates[:3], key=lambda user: user.id)[0]
+    assert from_database == from_graph == [str(candidates[3].id), str(tied.id)]
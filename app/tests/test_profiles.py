@@ -0,0 +1,221 @@
+from uuid import UUID, uuid4
+
+from app.services.profiles import ProfileCache
+from app.utils.schemas import User
+
+
+class FakeRedis:
+    """Local stand-in for a Redis server, keeping bytes like `redis.Redis`"""
+
+    def __init__(self):
+        self.values: dict[str, bytes] = {}
+        self.down = False
+
+    def get(self, key: str) -> bytes | None:
+        if self.down:
+            raise ConnectionError
+        return self.values.get(key)
+
+    def set(self, key: str, value: str | bytes, px: int):
+        if self.down:
+            raise ConnectionError
+        self.values[key] = value.encode() if isinstance(value, str) else value
+
+    def delete(self, *keys: str):
+        if self.down:
+            raise ConnectionError
+        for key in keys:
+            self.values.pop(key, None)
+
+    def scan_iter(self, match: str, count: int):
+        if self.down:
+            raise ConnectionError
+        prefix = match.removesuffix("*")
+        return [key.encode() for key in self.values if key.startswith(prefix)]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def profile(name: str = "Pepo") -> dict:
+    return User(
+        id=uuid4(),
+        email=f"{name.lower()}@test.com",
+        user=name,
+        name=f"Don {name}",
+        is_blocked=False,
+        location="ARG",
+        goals=[],
+        interests=[],
+        followers_count=0,
+        followeds_count=0,
+        twitsnaps_count=0,
+        version=1,
+    ).model_dump(mode="json")
+
+
+def test_caches_by_id_and_email_until_the_ttl():
+    clock = FakeClock()
+    cache = ProfileCache(ttl=10, max_size=10, clock=clock)
+    pepo = profile()
+
+    assert cache.get_by_id(UUID(pepo["id"])) is None
+    cache.set(pepo, cache.generation())
+    clock.now = 4
+
+    assert cache.get_by_id(UUID(pepo["id"])) == pepo
+    assert cache.get_by_email(pepo["email"]) == pepo
+
+    clock.now = 10
+
+    assert cache.get_by_id(UUID(pepo["id"])) is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["max_hit_age"] == 4
+
+
+def test_evicts_the_least_recently_used_profile():
+    cache = ProfileCache(ttl=10, max_size=2)
+    pepo, pepa, pepe = profile("Pepo"), profile("Pepa"), profile("Pepe")
+    cache.set(pepo, cache.generation())
+    cache.set(pepa, cache.generation())
+    cache.get_by_id(UUID(pepo["id"]))
+
+    cache.set(pepe, cache.generation())
+
+    assert cache.get_by_id(UUID(pepa["id"])) is None
+    assert cache.get_by_id(UUID(pepo["id"])) == pepo
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_drops_the_profile_and_its_email():
+    cache = ProfileCache(ttl=10, max_size=10)
+    pepo, pepa = profile("Pepo"), profile("Pepa")
+    cache.set(pepo, cache.generation())
+    cache.set(pepa, cache.generation())
+
+    cache.invalidate(UUID(pepo["id"]))
+
+    assert cache.get_by_id(UUID(pepo["id"])) is None
+    assert cache.get_by_email(pepo["email"]) is None
+    assert cache.get_by_id(UUID(pepa["id"])) == pepa
+
+
+def test_a_profile_read_before_an_invalidation_is_not_cached():
+    cache = ProfileCache(ttl=10, max_size=10)
+    pepo = profile()
+
+    generation = cache.generation()
+    # Another request changes the user while this one reads it
+    cache.invalidate(UUID(pepo["id"]))
+    cache.set(pepo, generation)
+
+    assert cache.get_by_id(UUID(pepo["id"])) is None
+
+
+def test_invalidating_another_user_keeps_caching_the_profile():
+    cache = ProfileCache(ttl=10, max_size=10)
+    pepo, pepa = profile(), profile("Pepa")
+
+    generation = cache.generation()
+    cache.invalidate(UUID(pepa["id"]))
+    cache.set(pepo, generation)
+
+    assert cache.get_by_id(UUID(pepo["id"])) == pepo
+
+
+def test_a_forgotten_invalidation_still_turns_down_older_profiles():
+    cache = ProfileCache(ttl=10, max_size=1)
+    pepo, pepa = profile(), profile("Pepa")
+
+    generation = cache.generation()
+    cache.invalidate(UUID(pepo["id"]))
+    cache.invalidate(UUID(pepa["id"]))
+    cache.set(pepo, generation)
+
+    assert cache.get_by_id(UUID(pepo["id"])) is None
+
+
+def test_a_profile_read_before_an_invalidation_is_not_shared():
+    shared = FakeRedis()
+    cache = ProfileCache(ttl=10, max_size=10, shared=shared)
+    pepo = profile()
+
+    generation = cache.generation()
+    cache.invalidate(UUID(pepo["id"]), shared=False)
+    cache.set(pepo, generation)
+
+    assert f"users:profile:{pepo['id']}" not in shared.values
+
+
+def test_a_profile_invalidated_while_being_shared_is_dropped_from_there():
+    shared = FakeRedis()
+    cache = ProfileCache(ttl=10, max_size=10, shared=shared)
+    pepo = profile()
+    shared_set = shared.set
+
+    def set_while_invalidated(key: str, value: str | bytes, px: int):
+        shared_set(key, value, px)
+        if key.startswith("users:profile:"):
+            # A notification of another worker's change arrives meanwhile
+            cache.invalidate(UUID(pepo["id"]), shared=False)
+
+    shared.set = set_while_invalidated
+    cache.set(pepo, cache.generation())
+
+    assert f"users:profile:{pepo['id']}" not in shared.values
+
+
+def test_workers_share_the_profiles_through_the_shared_tier():
+    shared = FakeRedis()
+    worker, other_worker = [
+        ProfileCache(ttl=10, max_size=10, shared=shared) for _ in range(2)
+    ]
+    pepo = profile()
+    worker.set(pepo, worker.generation())
+
+    assert other_worker.get_by_email(pepo["email"]) == pepo
+    assert other_worker.stats()["shared_hits"] == 1
+
+    worker.invalidate(UUID(pepo["id"]))
+
+    assert f"users:profile:{pepo['id']}" not in shared.values
+
+
+def test_invalidate_all_clears_the_shared_tier_unless_told_otherwise():
+    shared = FakeRedis()
+    worker, other_worker = [
+        ProfileCache(ttl=10, max_size=10, shared=shared) for _ in range(2)
+    ]
+    pepo, pepa = profile(), profile("Pepa")
+    worker.set(pepo, worker.generation())
+    other_worker.set(pepa, other_worker.generation())
+
+    worker.invalidate_all(shared=False)
+
+    assert f"users:profile:{pepo['id']}" not in shared.values
+    assert f"users:profile:{pepa['id']}" in shared.values
+
+    worker.invalidate_all()
+
+    assert other_worker.get_by_id(UUID(pepa["id"])) == pepa
+    assert other_worker.stats()["shared_hits"] == 0
+    assert not [key for key in shared.values if key.startswith("users:profile:")]
+
+
+def test_the_shared_tier_being_down_is_a_miss():
+    shared = FakeRedis()
+    cache = ProfileCache(ttl=10, max_size=10, shared=shared)
+    pepo = profile()
+    shared.down = True
+
+    cache.set(pepo, cache.generation())
+    cache.invalidate(UUID(pepo["id"]))
+
+    assert cache.get_by_id(UUID(pepo["id"])) is None
+    assert cache.stats()["shared_errors"] == 4
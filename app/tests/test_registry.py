@@ -0,0 +1,405 @@
+import asyncio
+import time
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+from jwt.algorithms import ECAlgorithm
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services import registry
+from app.services.registry import (
+    ApiKeyCache,
+    KeySet,
+    RegistryClient,
+    ServiceRegistration,
+    verify_token,
+)
+
+
+class FakeRegistry:
+    """Local stand-in for the services registry that counts the calls it gets"""
+
+    def __init__(self, valid_keys: set[str]):
+        self.valid_keys = valid_keys
+        self.calls = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        if request.url.params["apiKey"] in self.valid_keys:
+            return httpx.Response(200, json={"valid": True})
+        return httpx.Response(401, json={"detail": "Invalid API key"})
+
+    def client(self) -> RegistryClient:
+        return fake_client(self.handler)
+
+
+def fake_client(handler) -> RegistryClient:
+    return RegistryClient(
+        limits=httpx.Limits(max_connections=5),
+        timeout=httpx.Timeout(1),
+        http2=False,
+        transport=httpx.MockTransport(handler),
+    )
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def before_each():
+    registry.api_key_cache.clear()
+
+
+def validate_many(fake_registry: FakeRegistry, api_key: str, times: int) -> list[bool]:
+    async def run():
+        client = fake_registry.client()
+        try:
+            return [
+                await registry.validate_api_key(api_key, client) for _ in range(times)
+            ]
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+
+def test_same_valid_key_only_reaches_the_registry_once():
+    fake_registry = FakeRegistry(valid_keys={"good-key"})
+
+    results = validate_many(fake_registry, "good-key", times=50)
+
+    assert results == [True] * 50
+    assert fake_registry.calls == 1
+    assert registry.api_key_cache.hits == 49
+    assert registry.api_key_cache.misses == 1
+
+
+def test_rejected_key_is_negatively_cached():
+    fake_registry = FakeRegistry(valid_keys=set())
+
+    results = validate_many(fake_registry, "bad-key", times=10)
+
+    assert results == [False] * 10
+    assert fake_registry.calls == 1
+
+
+def test_registry_errors_are_not_cached():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(503)
+
+    async def run():
+        client = fake_client(handler)
+        results = [await registry.validate_api_key("key", client) for _ in range(3)]
+        await client.close()
+        return results
+
+    assert asyncio.run(run()) == [True] * 3
+    assert len(calls) == 3
+
+
+def test_registry_client_reuses_one_client_and_counts_requests():
+    fake_registry = FakeRegistry(valid_keys={"good-key"})
+    client = fake_registry.client()
+
+    async def run():
+        first = client.open()
+        await client.get("https://registry.test/api/registry/validate?apiKey=a")
+        await client.get("https://registry.test/api/registry/validate?apiKey=b")
+        assert client.open() is first
+        await client.close()
+
+    asyncio.run(run())
+
+    stats = client.stats()
+    assert stats["open"] is False
+    assert stats["requests"] == 2
+    assert stats["in_flight"] == 0
+    assert stats["peak_in_flight"] == 1
+    assert stats["http2_responses"] == 0
+
+
+def test_app_lifespan_opens_and_closes_the_registry_client():
+    with TestClient(app) as client:
+        assert registry.registry_client.stats()["open"] is True
+        response = client.get("/users/metrics")
+        assert response.json()["registry_client"]["open"] is True
+
+    assert registry.registry_client.stats()["open"] is False
+
+
+def test_cache_entries_expire_after_their_ttl():
+    clock = FakeClock()
+    cache = ApiKeyCache(ttl=60, negative_ttl=5, max_size=10, clock=clock)
+    cache.set("good-key", True)
+    cache.set("bad-key", False)
+
+    clock.now = 10
+    assert cache.get("good-key") is True
+    assert cache.get("bad-key") is None
+
+    clock.now = 61
+    assert cache.get("good-key") is None
+
+
+def test_cache_evicts_least_recently_used_key():
+    cache = ApiKeyCache(ttl=60, negative_ttl=5, max_size=2)
+    cache.set("a", True)
+    cache.set("b", True)
+    cache.get("a")
+    cache.set("c", True)
+
+    assert cache.get("a") is True
+    assert cache.get("b") is None
+    assert cache.get("c") is True
+    assert cache.stats()["evictions"] == 1
+
+
+def test_concurrent_validations_of_the_same_key_share_one_registry_call():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200)
+
+    async def run():
+        client = fake_client(handler)
+        results = await asyncio.gather(
+            *[registry.validate_api_key("burst-key", client) for _ in range(20)],
+            *[registry.validate_api_key("other-key", client) for _ in range(20)],
+        )
+        await client.close()
+        return results
+
+    assert asyncio.run(run()) == [True] * 40
+    assert len(calls) == 2
+    assert registry.api_key_validations.stats()["in_flight"] == 0
+
+
+def test_concurrent_validations_share_the_registry_error():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        raise httpx.ConnectError("registry is down")
+
+    async def run():
+        client = fake_client(handler)
+        results = await asyncio.gather(
+            *[registry.validate_api_key("burst-key", client) for _ in range(10)],
+            return_exceptions=True,
+        )
+        await client.close()
+        return results
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(isinstance(result, httpx.ConnectError) for result in results)
+    assert len({id(result) for result in results}) == 1
+
+
+PRIVATE_KEY = ec.generate_private_key(ec.SECP256R1())
+OTHER_PRIVATE_KEY = ec.generate_private_key(ec.SECP256R1())
+
+
+def public_jwk(kid: str, private_key=PRIVATE_KEY) -> dict:
+    jwk = ECAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    return {**jwk, "kid": kid, "alg": "ES256"}
+
+
+def public_keys(kid: str = "k1") -> dict:
+    return registry.public_keys({"keys": [public_jwk(kid)]})
+
+
+def sign(
+    kid: str,
+    private_key=PRIVATE_KEY,
+    expires_in: float = 60,
+    audience: str = registry.TOKEN_AUDIENCE,
+    issuer: str = registry.TOKEN_ISSUER,
+) -> str:
+    return jwt.encode(
+        {
+            "sub": "feed-service",
+            "aud": audience,
+            "iss": issuer,
+            "exp": time.time() + expires_in,
+        },
+        private_key,
+        algorithm="ES256",
+        headers={"kid": kid},
+    )
+
+
+def keyset_registry(keys: list[dict]) -> RegistryClient:
+    return fake_client(lambda request: httpx.Response(200, json={"keys": keys}))
+
+
+def test_tokens_are_verified_against_the_refreshed_keyset():
+    keys = KeySet(max_staleness=60, fallback="stale")
+    client = keyset_registry([public_jwk("k1")])
+
+    asyncio.run(registry.refresh_keyset(client, keys))
+
+    assert verify_token(sign("k1"), keys)
+    assert verify_token("Bearer " + sign("k1"), keys)
+    assert not verify_token(sign("k1", OTHER_PRIVATE_KEY), keys)
+    assert not verify_token(sign("k2"), keys)
+    assert not verify_token(sign("k1", expires_in=-1), keys)
+    assert not verify_token(sign("k1", audience="feed"), keys)
+    assert not verify_token(sign("k1", issuer="https://evil.test"), keys)
+    assert not verify_token("not-a-token", keys)
+    assert client.stats()["requests"] == 1
+
+
+def test_tokens_without_audience_or_issuer_are_rejected():
+    keys = KeySet(max_staleness=60, fallback="stale")
+    keys.replace(public_keys())
+    token = jwt.encode(
+        {"sub": "feed-service", "exp": time.time() + 60},
+        PRIVATE_KEY,
+        algorithm="ES256",
+        headers={"kid": "k1"},
+    )
+
+    assert not verify_token(token, keys)
+
+
+def test_shared_secrets_in_the_keyset_are_ignored():
+    secret = "a-signing-secret-long-enough-for-hs256"
+    keys = KeySet(max_staleness=60, fallback="stale")
+    client = keyset_registry(
+        [
+            {
+                "kid": "k1",
+                "kty": "oct",
+                "alg": "HS256",
+                "k": jwt.utils.base64url_encode(secret.encode()).decode(),
+            },
+            public_jwk("k2"),
+        ]
+    )
+
+    asyncio.run(registry.refresh_keyset(client, keys))
+    token = jwt.encode(
+        {
+            "aud": registry.TOKEN_AUDIENCE,
+            "iss": registry.TOKEN_ISSUER,
+            "exp": time.time() + 60,
+        },
+        secret,
+        algorithm="HS256",
+        headers={"kid": "k1"},
+    )
+
+    assert keys.stats()["keys"] == 1
+    assert not verify_token(token, keys)
+    assert verify_token(sign("k2"), keys)
+
+
+def test_failed_refresh_keeps_serving_the_stale_keyset():
+    clock = FakeClock()
+    keys = KeySet(max_staleness=60, fallback="stale", clock=clock)
+    keys.replace(public_keys())
+
+    clock.now = 120
+    asyncio.run(
+        registry.refresh_keyset(fake_client(lambda request: httpx.Response(503)), keys)
+    )
+
+    assert keys.stats()["stale"] is True
+    assert keys.stats()["refresh_failures"] == 1
+    assert verify_token(sign("k1"), keys)
+
+
+def test_failed_refresh_rejects_tokens_once_stale_with_reject_fallback():
+    clock = FakeClock()
+    keys = KeySet(max_staleness=60, fallback="reject", clock=clock)
+    keys.replace(public_keys())
+    token = sign("k1")
+
+    clock.now = 30
+    assert verify_token(token, keys)
+
+    clock.now = 120
+    assert not verify_token(token, keys)
+
+
+def test_bootstrap_retries_until_the_registry_answers():
+    answers = [
+        httpx.ConnectError("registry is down"),
+        httpx.Response(503),
+        httpx.Response(200, json={"apiKey": "my-key"}),
+    ]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    state = ServiceRegistration()
+    asyncio.run(registry.bootstrap("users", fake_client(handler), state, backoff=0.001))
+
+    assert state.ready is True
+    assert state.api_key == "my-key"
+    assert state.attempts == 3
+    assert state.last_error is None
+
+
+def test_bootstrap_retries_a_malformed_answer():
+    answers = [
+        httpx.Response(200, text="<html>Service Unavailable</html>"),
+        httpx.Response(200, json={"key": "my-key"}),
+        httpx.Response(200, json={"apiKey": "my-key"}),
+    ]
+    state = ServiceRegistration()
+
+    asyncio.run(
+        registry.bootstrap(
+            "users",
+            fake_client(lambda request: answers.pop(0)),
+            state,
+            backoff=0.001,
+        )
+    )
+
+    assert state.ready is True
+    assert state.api_key == "my-key"
+    assert state.attempts == 3
+
+
+def test_bootstrap_without_an_api_key_in_the_registry_is_ready():
+    state = ServiceRegistration()
+    asyncio.run(
+        registry.bootstrap(
+            "users", fake_client(lambda request: httpx.Response(404)), state
+        )
+    )
+
+    assert state.ready is True
+    assert state.api_key is None
+    assert state.attempts == 1
+
+
+def test_ready_endpoint_reflects_the_bootstrap():
+    client = TestClient(app)
+    registry.registration.ready = False
+    assert client.get("/users/ready").status_code == 503
+
+    asyncio.run(registry.bootstrap(service_id=None))
+    assert client.get("/users/ready").json() == {"ready": True}
@@ -41,9 +41,18 @@ class TestUserRepository(unittest.TestCase):
         )
 
     def test_get_users(self):
-        self.db_mock.query.return_value.all.return_value = [self.user]
-        users = get_users(self.db_mock)
+        query = self.db_mock.query.return_value.options.return_value
+        query.order_by.return_value.limit.return_value.all.return_value = [self.user]
+        users = get_users(self.db_mock, 10)
         self.assertEqual(users, [self.user])
+        query.filter.assert_not_called()
+
+    def test_get_users_after_cursor(self):
+        query = self.db_mock.query.return_value.options.return_value.filter.return_value
+        query.order_by.return_value.limit.return_value.all.return_value = [self.user2]
+        users = get_users(self.db_mock, 10, after=self.user.id)
+        self.assertEqual(users, [self.user2])
+        query.order_by.return_value.limit.assert_called_once_with(10)
 
     def test_insert_user(self):
         new_user = schemas.NewUser(
@@ -120,103 +129,117 @@ class TestUserRepository(unittest.TestCase):
         self.assertEqual(updated_user.goals, goals)
         self.db_mock.commit.assert_called_once()
 
+    @property
+    def follow_users(self):
+        return self.db_mock.query.return_value.filter.return_value
+
     def test_add_follower(self):
-        # Simulate `get_user_by_id` returning two users: the follower and the followed
-        self.db_mock.query.return_value.filter.return_value.first.side_effect = [
-            self.user,  # source user (follower)
-            self.user2,  # followed user
+        # Both users come from the same query
+        self.follow_users.all.return_value = [
+            self.user,
+            self.user2,
         ]
-        # Initially the source user is not following the followed user
-        self.user.followeds = []
-        self.user2.followers = []
+        self.db_mock.execute.return_value.rowcount = 1
 
         updated_user = add_follower(self.db_mock, self.user.id, self.user2.id)
 
-        self.assertIn(self.user, self.user2.followers)
-        self.assertIn(self.user2, self.user.followeds)
+        self.assertEqual(updated_user, self.user)
+        # The insert, the counts updates of the users and of the followed
+        # user's interests and the change notifications
+        self.assertEqual(self.db_mock.execute.call_count, 4)
         self.db_mock.commit.assert_called_once()
-        self.db_mock.refresh.assert_any_call(self.user)
-        self.db_mock.refresh.assert_any_call(self.user2)
 
     def test_add_follower_already_following(self):
-        # Simulate `get_user_by_id` returning two users: the follower and the followed
-        self.db_mock.query.return_value.filter.return_value.first.side_effect = [
-            self.user,  # source user (follower)
-            self.user2,  # followed user
+        self.follow_users.all.return_value = [
+            self.user,
+            self.user2,
         ]
-
-        self.user.followeds = [self.user2]
-        self.user2.followers = [self.user]
+        # The insert found the follow and did nothing
+        self.db_mock.execute.return_value.rowcount = 0
 
         with self.assertRaises(NotAllowed):
             add_follower(self.db_mock, self.user.id, self.user2.id)
 
+        self.db_mock.commit.assert_not_called()
+
+    def test_add_follower_followed_not_found(self):
+        self.follow_users.all.return_value = [self.user]
+
+        with self.assertRaises(UserNotFound) as context:
+            add_follower(self.db_mock, self.user.id, self.user2.id)
+
+        self.assertEqual(str(context.exception), "Followed user not found")
+        self.db_mock.execute.assert_not_called()
+
     def test_remove_follow(self):
-        # Simulate `get_user_by_id` returning two users: the follower and the followed
-        self.db_mock.query.return_value.filter.return_value.first.side_effect = [
-            self.user,  # source user (follower)
-            self.user2,  # followed user
+        self.follow_users.all.return_value = [
+            self.user,
+            self.user2,
         ]
-
-        self.user.followeds = [self.user2]
-        self.user2.followers = [self.user]
+        self.db_mock.execute.return_value.rowcount = 1
 
         updated_user = remove_follow(self.db_mock, self.user.id, self.user2.id)
 
-        self.assertNotIn(self.user, self.user2.followers)
-        self.assertNotIn(self.user2, self.user.followeds)
+        self.assertEqual(updated_user, self.user)
+        # The delete, the counts updates of the users and of the followed
+        # user's interests and the change notifications
+        self.assertEqual(self.db_mock.execute.call_count, 4)
         self.db_mock.commit.assert_called_once()
-        self.db_mock.refresh.assert_any_call(self.user)
-        self.db_mock.refresh.assert_any_call(self.user2)
 
     def test_remove_follow_not_following(self):
-        # Simulate `get_user_by_id` returning two users: the follower and the followed
-        self.db_mock.query.return_value.filter.return_value.first.side_effect = [
-            self.user,  # source user (follower)
-            self.user2,  # followed user
+        self.follow_users.all.return_value = [
+            self.user,
+            self.user2,
         ]
-
-        self.user.followeds = []
-        self.user2.followers = []
+        # The delete found no follow
+        self.db_mock.execute.return_value.rowcount = 0
 
         with self.assertRaises(NotAllowed):
             remove_follow(self.db_mock, self.user.id, self.user2.id)
 
+        self.db_mock.commit.assert_not_called()
+
     def test_get_followers(self):
-        self.user.followers = [self.user2]
         self.db_mock.query.return_value.filter.return_value.first.return_value = (
             self.user
         )
+        query = self.db_mock.query.return_value.join.return_value.filter.return_value
+        query.order_by.return_value.options.return_value.limit.return_value.all.return_value = [
+            self.user2
+        ]
 
-        followers = get_followers(self.db_mock, self.user.id)
+        followers = get_followers(self.db_mock, self.user.id, 10)
 
-        self.assertEqual(followers, self.user.followers)
+        self.assertEqual(followers, [self.user2])
         self.db_mock.query.return_value.filter.return_value.first.assert_called_once()
 
     def test_get_followers_user_not_found(self):
         self.db_mock.query.return_value.filter.return_value.first.return_value = None
 
         with self.assertRaises(UserNotFound) as context:
-            get_followers(self.db_mock, self.user.id)
+            get_followers(self.db_mock, self.user.id, 10)
 
         self.assertEqual(str(context.exception), "No user was found for the given id")
 
     def test_get_followeds(self):
-        self.user.followeds = [self.user2]
         self.db_mock.query.return_value.filter.return_value.first.return_value = (
             self.user
         )
+        query = self.db_mock.query.return_value.join.return_value.filter.return_value
+        query.order_by.return_value.options.return_value.limit.return_value.all.return_value = [
+            self.user2
+        ]
 
-        followeds = get_followeds(self.db_mock, self.user.id)
+        followeds = get_followeds(self.db_mock, self.user.id, 10)
 
-        self.assertEqual(followeds, self.user.followeds)
+        self.assertEqual(followeds, [self.user2])
         self.db_mock.query.return_value.filter.return_value.first.assert_called_once()
 
     def test_get_followeds_user_not_found(self):
         self.db_mock.query.return_value.filter.return_value.first.return_value = None
 
         with self.assertRaises(UserNotFound) as context:
-            get_followeds(self.db_mock, self.user.id)
+            get_followeds(self.db_mock, self.user.id, 10)
 
         self.assertEqual(str(context.exception), "No user was found for the given id")
 
@@ -238,7 +261,7 @@ class TestUserRepository(unittest.TestCase):
             },
         ]
 
-        recommendations = get_recommendations(self.db_mock, self.user.id)
+        recommendations = get_recommendations(self.db_mock, self.user.id, 10)
 
         self.assertEqual(len(recommendations), 2)
         self.assertEqual(recommendations[0]["name"], "Recommended User 1")
@@ -251,7 +274,7 @@ class TestUserRepository(unittest.TestCase):
 
         self.db_mock.execute.return_value.mappings.return_value = []
 
-        recommendations = get_recommendations(self.db_mock, self.user.id)
+        recommendations = get_recommendations(self.db_mock, self.user.id, 10)
 
         self.assertEqual(len(recommendations), 0)
 
@@ -264,7 +287,7 @@ class TestUserRepository(unittest.TestCase):
             {"id": str(uuid4()), "name": "Nearby User", "user": "nearby_user"}
         ]
 
-        recommendations = get_recommendations(self.db_mock, self.user.id)
+        recommendations = get_recommendations(self.db_mock, self.user.id, 10)
 
         self.assertEqual(len(recommendations), 1)
         self.assertEqual(recommendations[0]["name"], "Nearby User")
@@ -279,7 +302,7 @@ class TestUserRepository(unittest.TestCase):
             {"id": str(uuid4()), "name": "Interest-Based User", "user": "interest_user"}
         ]
 
-        recommendations = get_recommendations(self.db_mock, self.user.id)
+        recommendations = get_recommendations(self.db_mock, self.user.id, 10)
 
         self.assertEqual(len(recommendations), 1)
         self.assertEqual(recommendations[0]["name"], "Interest-Based User")
@@ -289,7 +312,7 @@ class TestUserRepository(unittest.TestCase):
         self.db_mock.query.return_value.filter.return_value.first.return_value = None
 
         with self.assertRaises(UserNotFound) as context:
-            get_recommendations(self.db_mock, self.user.id)
+            get_recommendations(self.db_mock, self.user.id, 10)
 
         self.assertEqual(str(context.exception), "No user was found for the given id")
 
@@ -0,0 +1,112 @@
+import importlib.util
+import os
+import pathlib
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import text
+
+from app.repositories import database
+from app.repositories import users as users_repository
+from app.tests import utils
+from app.utils.schemas import SignUpSchema
+
+TRIGRAM_MIGRATION = (
+    pathlib.Path(database.__file__).parent
+    / "migrations"
+    / "versions"
+    / "e5a1f3c9b2d4_trigram_index_on_user.py"
+)
+
+
+def has_pg_trgm() -> bool:
+    with database.engine.connect() as connection:
+        return (
+            connection.execute(
+                text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            ).first()
+            is not None
+        )
+
+
+@pytest.fixture
+def pg_trgm():
+    """
+    The search queries only run as written against the real extension.
+    Without it they're skipped, but they fail in the pipeline (CI), which must
+    run them.
+    """
+    if not has_pg_trgm():
+        if os.getenv("CI"):
+            pytest.fail("the test database doesn't have the pg_trgm extension")
+        pytest.skip("needs a Postgres with the pg_trgm extension")
+
+
+requires_pg_trgm = pytest.mark.usefixtures("pg_trgm")
+
+
+def trigram_index(connection) -> str | None:
+    return connection.execute(
+        text("SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_users_user_trgm'")
+    ).scalar()
+
+
+@requires_pg_trgm
+def test_the_trigram_migration_creates_and_drops_the_index():
+    spec = importlib.util.spec_from_file_location("trigram", TRIGRAM_MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+
+    with database.engine.connect() as connection:
+        with Operations.context(MigrationContext.configure(connection)):
+            migration.downgrade()
+            assert trigram_index(connection) is None
+
+            migration.upgrade()
+            index = trigram_index(connection)
+        connection.commit()
+
+    assert "USING gin" in index
+    assert "gin_trgm_ops" in index
+
+
+@requires_pg_trgm
+def test_searching_by_user_name_uses_the_trigram_index():
+    utils.empty_database()
+    for name in ["therealuser", "therealuser2", "realuser3"]:
+        utils.create_user(
+            SignUpSchema(
+                email=f"{name}@gmail.com",
+                password="pass",
+                user=name,
+                name=name,
+                location="ARG",
+            )
+        )
+    db = next(database.get_db())
+
+    # Too few users for the planner to prefer the index on its own
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = db.execute(
+        text('EXPLAIN SELECT id FROM users WHERE "user" % :query'),
+        {"query": "therealuser"},
+    ).all()
+
+    assert "ix_users_user_trgm" in "\n".join(row[0] for row in plan)
+
+
+@requires_pg_trgm
+def test_the_similarity_threshold_only_lasts_for_the_search_transaction():
+    db = next(database.get_db())
+    # The setting only exists once the extension is loaded by the connection
+    db.execute(text("SELECT similarity('a', 'b')"))
+    default = db.execute(text("SHOW pg_trgm.similarity_threshold")).scalar()
+
+    users_repository.search_users(db, "therealuser", 10)
+    during = db.execute(text("SHOW pg_trgm.similarity_threshold")).scalar()
+    db.commit()
+    after = db.execute(text("SHOW pg_trgm.similarity_threshold")).scalar()
+
+    assert float(during) == users_repository.SEARCH_SIMILARITY_THRESHOLD
+    assert after == default
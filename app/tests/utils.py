@@ -1,8 +1,11 @@
 import os
+from contextlib import contextmanager
 from uuid import UUID, uuid4
 
 from pydantic import EmailStr
+from sqlalchemy import event
 from app.repositories import models, users, database
+from app.services import autocomplete, profiles
 from app.services import users as users_service
 from app.utils import schemas
 
@@ -10,6 +13,8 @@ from app.utils import schemas
 def empty_database():
     db = next(database.get_db())
     users.empty_users(db=db)
+    autocomplete.user_index.clear()
+    profiles.profile_cache.clear()
 
 
 def create_user(new_user: schemas.SignUpSchema) -> schemas.User:
@@ -43,3 +48,22 @@ def generate_user(email: EmailStr, user: str, name: str, location: str) -> model
 def follow(source_id: UUID, followed_id: UUID):
     db = next(database.get_db())
     return users.add_follower(db, source_id, followed_id)
+
+
+@contextmanager
+def count_queries():
+    """Collects the SQL statements run by the app while inside the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = database.engine
+    if database.async_engine:
+        engine = database.async_engine.sync_engine
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
@@ -2,8 +2,6 @@ import os
 from dotenv import load_dotenv
 import pathlib
 
-import httpx
-
 # basedir = pathlib.Path(__file__).parents[1]
 # load_dotenv(basedir / ".env")
 load_dotenv()
@@ -24,22 +22,139 @@ else:
         "ENV variable not found, please especifiy one [production, development, test]"
     )
 
+# "sync" runs the endpoints' queries with psycopg2 on the threadpool, "async"
+# runs them with asyncpg on the event loop
+DB_MODE = os.getenv("DB_MODE", "sync")
+
+if DB_MODE not in ["sync", "async"]:
+    raise RuntimeError("DB_MODE must be one of [sync, async]")
+
+# Connection pool of each worker, keep workers * (size + overflow) below the
+# connection limit of the database. In async mode that pool is asyncpg's and
+# the exports and background rebuilds, which still use psycopg2, get a pool of
+# DB_SYNC_POOL_SIZE + DB_SYNC_MAX_OVERFLOW of their own, so each worker holds
+# up to size + overflow + sync size + sync overflow connections, plus the one
+# listening to the users changes in either mode
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_SYNC_POOL_SIZE = int(os.getenv("DB_SYNC_POOL_SIZE", "1"))
+DB_SYNC_MAX_OVERFLOW = int(os.getenv("DB_SYNC_MAX_OVERFLOW", "2"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+# Behind PgBouncer in transaction mode, server-side prepared statements can't
+# be reused across transactions, so asyncpg must not cache them
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+# Minimum trigram similarity (0 to 1) between a user name and the searched
+# text for the user to be a search result
+SEARCH_SIMILARITY_THRESHOLD = float(os.getenv("SEARCH_SIMILARITY_THRESHOLD", "0.1"))
+
+# Seconds between rebuilds of each worker's autocomplete index from the
+# database, which is how a worker sees the users changed by the others
+AUTOCOMPLETE_REBUILD_INTERVAL = float(os.getenv("AUTOCOMPLETE_REBUILD_INTERVAL", "300"))
+
+# Most ids plus emails looked up by a single POST /users/batch
+USERS_BATCH_MAX_SIZE = int(os.getenv("USERS_BATCH_MAX_SIZE", "100"))
+
+# Rows fetched per query while streaming a whole followers or followeds list
+FOLLOWS_EXPORT_BATCH_SIZE = int(os.getenv("FOLLOWS_EXPORT_BATCH_SIZE", "1000"))
+
+# Recommendations stored per user, the most a request can get
+RECOMMENDATIONS_PER_USER = int(os.getenv("RECOMMENDATIONS_PER_USER", "100"))
+# Stored recommendations are computed again once older than
+# RECOMMENDATIONS_MAX_AGE seconds, which is how the changes made by other
+# users reach them. Every RECOMMENDATIONS_REBUILD_INTERVAL seconds each worker
+# looks for them and recomputes them in transactions of
+# RECOMMENDATIONS_REBUILD_BATCH_SIZE users.
+RECOMMENDATIONS_MAX_AGE = float(os.getenv("RECOMMENDATIONS_MAX_AGE", "3600"))
+RECOMMENDATIONS_REBUILD_INTERVAL = float(
+    os.getenv("RECOMMENDATIONS_REBUILD_INTERVAL", "60")
+)
+RECOMMENDATIONS_REBUILD_BATCH_SIZE = int(
+    os.getenv("RECOMMENDATIONS_REBUILD_BATCH_SIZE", "100")
+)
+# Score of a candidate per followed user following them, per interest in
+# common and for living in the same location
+RECOMMENDATIONS_FOLLOWS_WEIGHT = float(os.getenv("RECOMMENDATIONS_FOLLOWS_WEIGHT", "3"))
+RECOMMENDATIONS_INTERESTS_WEIGHT = float(
+    os.getenv("RECOMMENDATIONS_INTERESTS_WEIGHT", "2")
+)
+RECOMMENDATIONS_LOCATION_WEIGHT = float(
+    os.getenv("RECOMMENDATIONS_LOCATION_WEIGHT", "1")
+)
+# Most candidates taken among the users sharing each interest, among the ones
+# in the same location and among the ones followed by the followed users, the
+# most followed of each, so scoring costs the same in any country
+RECOMMENDATIONS_CANDIDATES_PER_SOURCE = int(
+    os.getenv("RECOMMENDATIONS_CANDIDATES_PER_SOURCE", "1000")
+)
+
+# Keep a copy of the follows graph in the memory of each worker, rebuilt from
+# the database every SOCIAL_GRAPH_REBUILD_INTERVAL seconds, where the
+# recommendations find the users followed by the followed users
+SOCIAL_GRAPH_ENABLED = os.getenv("SOCIAL_GRAPH_ENABLED", "false").lower() == "true"
+SOCIAL_GRAPH_REBUILD_INTERVAL = float(
+    os.getenv("SOCIAL_GRAPH_REBUILD_INTERVAL", "1800")
+)
+
+# Profiles served by GET /users/{id} and /users/email/{email} are cached for
+# PROFILE_CACHE_TTL seconds, the most a profile changed by another worker or
+# service can be stale, in an LRU of each worker plus, when a Redis URL is
+# given and the redis package is installed, a tier shared by all of them
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "30"))
+PROFILE_CACHE_MAX_SIZE = int(os.getenv("PROFILE_CACHE_MAX_SIZE", "10000"))
+PROFILE_CACHE_REDIS_URL = os.getenv("PROFILE_CACHE_REDIS_URL")
+
+# Each worker listens to the users changed by any of them to drop them from
+# its caches, retrying every CHANGES_RECONNECT_INTERVAL seconds while the
+# connection is down
+CHANGES_RECONNECT_INTERVAL = float(os.getenv("CHANGES_RECONNECT_INTERVAL", "5"))
+# LISTEN holds a session, which a transaction pooler hands to other clients
+# between transactions, so behind PgBouncer (DB_PGBOUNCER) the workers only
+# listen given the URL of a direct connection to Postgres, otherwise their
+# caches are only as fresh as their TTLs and rebuilds
+CHANGES_DATABASE_URL = os.getenv("CHANGES_DATABASE_URL")
+
 
 SERVICE_ID = os.getenv("SERVICE_ID")
-REGISTRY_URL = os.getenv("REGISTRY_URL")
-
-API_KEY = None
-
-if env != "test":
-    if SERVICE_ID:
-        with httpx.Client() as client:
-            res = client.get(f"{REGISTRY_URL}/api/registry/{SERVICE_ID}")
-            if res.status_code != 200:
-                print("There is no api key for this microservice")
-            else:
-                API_KEY = res.json()["apiKey"]
-    else:
-        print("No service id was provided. You have to register the microservice.")
-
-    print(f"SERVICE_ID: {SERVICE_ID}")
-    print(f"API_KEY: {API_KEY}")
+REGISTRY_URL = os.getenv("REGISTRY_URL", "https://services-registry.onrender.com")
+
+# Validated API keys are cached in-process to avoid a registry round-trip per request
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "300"))
+API_KEY_CACHE_NEGATIVE_TTL = float(os.getenv("API_KEY_CACHE_NEGATIVE_TTL", "10"))
+API_KEY_CACHE_MAX_SIZE = int(os.getenv("API_KEY_CACHE_MAX_SIZE", "1024"))
+
+# Connection pool of the HTTP client shared by every call to the registry
+REGISTRY_MAX_CONNECTIONS = int(os.getenv("REGISTRY_MAX_CONNECTIONS", "20"))
+REGISTRY_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("REGISTRY_MAX_KEEPALIVE_CONNECTIONS", "10")
+)
+REGISTRY_KEEPALIVE_EXPIRY = float(os.getenv("REGISTRY_KEEPALIVE_EXPIRY", "30"))
+REGISTRY_TIMEOUT = float(os.getenv("REGISTRY_TIMEOUT", "5"))
+REGISTRY_CONNECT_TIMEOUT = float(os.getenv("REGISTRY_CONNECT_TIMEOUT", "2"))
+REGISTRY_HTTP2 = os.getenv("REGISTRY_HTTP2", "true").lower() == "true"
+
+# "registry" asks the registry for every uncached API key, "token" verifies
+# signed tokens locally against the public keys refreshed from the registry
+AUTH_MODE = os.getenv("AUTH_MODE", "registry")
+KEYSET_REFRESH_INTERVAL = float(os.getenv("KEYSET_REFRESH_INTERVAL", "60"))
+KEYSET_MAX_STALENESS = float(os.getenv("KEYSET_MAX_STALENESS", "600"))
+# What to do once the key set is older than KEYSET_MAX_STALENESS: keep using
+# it ("stale") or reject every token until a refresh succeeds ("reject")
+KEYSET_FALLBACK = os.getenv("KEYSET_FALLBACK", "stale")
+# Claims every token must carry: who issued it and which service it is for
+TOKEN_ISSUER = os.getenv("TOKEN_ISSUER", REGISTRY_URL)
+TOKEN_AUDIENCE = os.getenv("TOKEN_AUDIENCE", SERVICE_ID or "users")
+
+if AUTH_MODE not in ["registry", "token"]:
+    raise RuntimeError("AUTH_MODE must be one of [registry, token]")
+if KEYSET_FALLBACK not in ["stale", "reject"]:
+    raise RuntimeError("KEYSET_FALLBACK must be one of [stale, reject]")
+
+# The API key of this service is fetched from the registry in the background
+# at startup, retrying with an exponential backoff capped at the max
+REGISTRY_BOOTSTRAP_BACKOFF = float(os.getenv("REGISTRY_BOOTSTRAP_BACKOFF", "0.5"))
+REGISTRY_BOOTSTRAP_MAX_BACKOFF = float(
+    os.getenv("REGISTRY_BOOTSTRAP_MAX_BACKOFF", "30")
+)
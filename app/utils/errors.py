@@ -20,3 +20,9 @@ class BlockedUser(Exception):
     def __init__(self, message="This user is currently blocked"):
         self.message = message
         super().__init__(self.message)
+
+
+class InvalidCursor(Exception):
+    def __init__(self, message="The given cursor is not valid"):
+        self.message = message
+        super().__init__(self.message)
@@ -14,6 +14,7 @@ class Interests(str, Enum):
 
 class UserSummary(BaseModel):
     id: UUID
+    email: EmailStr
     user: str  # User's username
     name: str  # User's full name
 
@@ -56,15 +57,26 @@ class NewUser(BaseModel):
     location: str
 
 
+class UserExpansion(str, Enum):
+    followers = "followers"
+    followeds = "followeds"
+    twitsnaps = "twitsnaps"
+
+
 class User(NewUser):
     id: UUID
     location: str
     interests: list[Interests]
     goals: list[str]
-    followers: list[UUID]
-    followeds: list[UUID]
-    twitsnaps: list[UUID]
+    followers_count: int
+    followeds_count: int
+    twitsnaps_count: int
+    # Only filled when asked for with `?expand=`
+    followers: list[UUID] | None = None
+    followeds: list[UUID] | None = None
+    twitsnaps: list[UUID] | None = None
     is_blocked: bool
+    version: int
 
 
 class DatabaseUser(BaseModel):
@@ -118,6 +130,35 @@ class RecommendationUser(BaseModel):
     name: str
 
 
+class Follow(BaseModel):
+    follower_id: UUID
+    followed_id: UUID
+    # Counts right after following or unfollowing
+    follower_followeds_count: int
+    followed_followers_count: int
+
+
+class UsersBatchQuery(BaseModel):
+    ids: list[UUID] = []
+    emails: list[EmailStr] = []
+
+
+class UsersBatch(BaseModel):
+    # The found users by id, whether asked for by id or by email
+    users: dict[UUID, UserSummary]
+    # The asked ids and emails of no user, and of blocked users
+    missing: list[str]
+    blocked: list[str]
+    # How many of the found users came from the profile cache
+    cache_hits: int
+
+
+class UserSuggestion(BaseModel):
+    id: UUID
+    user: str
+    name: str
+
+
 class UserWithoutId(NewUser):
     location: str
     interests: list[Interests]
@@ -0,0 +1,103 @@
+"""
+Compares the cost of authenticating one request with each strategy:
+
+- registry, new client: what the middleware used to do, a fresh
+  `httpx.AsyncClient` and a registry call per request
+- registry, shared client: a registry call per request over the pooled client
+- token: local verification of a signed token against the key set
+
+The registry is a local HTTP server that answers after `--latency-ms`.
+
+Usage:
+    ENV=test python -m benchmarks.bench_auth [--requests 500] [--latency-ms 5]
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import jwt
+
+from app.services.registry import KeySet, RegistryClient, verify_token
+
+SECRET = "benchmark-signing-secret-long-enough"
+
+
+def start_fake_registry(latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def registry_new_client(url: str, requests: int):
+    for _ in range(requests):
+        async with httpx.AsyncClient() as client:
+            await client.get(url, params={"apiKey": "key"})
+
+
+async def registry_shared_client(url: str, requests: int):
+    client = RegistryClient(
+        limits=httpx.Limits(max_connections=10),
+        timeout=httpx.Timeout(5),
+        http2=False,
+    )
+    for _ in range(requests):
+        await client.get(url, params={"apiKey": "key"})
+    await client.close()
+
+
+async def token(url: str, requests: int):
+    keys = KeySet(max_staleness=600, fallback="stale")
+    keys.replace({"k1": SECRET})
+    signed = jwt.encode(
+        {"sub": "bench", "exp": time.time() + 600},
+        SECRET,
+        algorithm="HS256",
+        headers={"kid": "k1"},
+    )
+    for _ in range(requests):
+        assert verify_token(signed, keys)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    server = start_fake_registry(args.latency_ms / 1000)
+    url = f"http://127.0.0.1:{server.server_port}/api/registry/validate"
+
+    print(f"{'strategy':<28}{'per request':>14}{'requests/s':>14}")
+    for name, strategy in [
+        ("registry, new client", registry_new_client),
+        ("registry, shared client", registry_shared_client),
+        ("token", token),
+    ]:
+        start = time.perf_counter()
+        asyncio.run(strategy(url, args.requests))
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:<28}{elapsed / args.requests * 1e6:>11.1f} us"
+            f"{args.requests / elapsed:>14.0f}"
+        )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
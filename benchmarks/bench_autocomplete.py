@@ -0,0 +1,87 @@
+"""
+Build time, memory and lookup latency of the autocomplete prefix index with
+`--users` synthetic users, plus the cost of the incremental updates made on
+signup, rename and block. It doesn't need a database.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... python -m benchmarks.bench_autocomplete \\
+        [--users 1000000] [--lookups 10000]
+"""
+
+import argparse
+import random
+import statistics
+import string
+import time
+import tracemalloc
+from uuid import uuid4
+
+from app.services.autocomplete import PrefixIndex
+
+FIRST_NAMES = ["Juan", "Maria", "Jose", "Ana", "Luis", "Sofia", "Pedro", "Lucia"]
+LAST_NAMES = ["Perez", "Gonzalez", "Rodriguez", "Fernandez", "Lopez", "Garcia"]
+
+
+def random_user(i: int) -> tuple:
+    user = "".join(random.choices(string.ascii_lowercase, k=random.randint(3, 8)))
+    name = f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}"
+    return uuid4(), f"{user}{i}", name
+
+
+def percentiles(latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    return f"{p50 * 1e6:>10.1f}{p99 * 1e6:>10.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=10_000)
+    args = parser.parse_args()
+
+    entries = [random_user(i) for i in range(args.users)]
+
+    # Built once to time it and once more to measure what it keeps, as
+    # tracing the allocations slows it down
+    index = PrefixIndex()
+    start = time.perf_counter()
+    index.build(entries)
+    build = time.perf_counter() - start
+    index = PrefixIndex()
+    tracemalloc.start()
+    # Fresh strings, like the rows read from the database
+    index.build(
+        (user_id, user.encode().decode(), name.encode().decode())
+        for user_id, user, name in entries
+    )
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"build {build:.1f} s, {size / 2**20:.0f} MB, {index.stats()}")
+
+    print(f"\n{'operation':<24}{'p50 us':>10}{'p99 us':>10}")
+    for length in [1, 2, 3, 4]:
+        latencies = []
+        for _ in range(args.lookups):
+            prefix = random.choice(entries)[random.randint(1, 2)][:length]
+            start = time.perf_counter()
+            index.search(prefix, 10)
+            latencies.append(time.perf_counter() - start)
+        print(f"{f'search {length} chars':<24}{percentiles(latencies)}")
+
+    for name, update in [
+        ("add (signup)", lambda: index.add(*random_user(args.users))),
+        ("add (rename)", lambda: index.add(*random.choice(entries))),
+        ("remove (block)", lambda: index.remove(random.choice(entries)[0])),
+    ]:
+        latencies = []
+        for _ in range(1_000):
+            start = time.perf_counter()
+            update()
+            latencies.append(time.perf_counter() - start)
+        print(f"{name:<24}{percentiles(latencies)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Latency of hydrating `--size` users with `POST /users/batch` against one
+`GET /users/{id}` per user, both with an empty profile cache and with every
+user in it.
+
+It seeds `--users` users in the test database and removes them after.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... python -m benchmarks.bench_batch \\
+        [--users 100000] [--size 50] [--repeat 20]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.repositories import database
+from app.services import profiles
+from benchmarks.seed import remove_seeded_users, seed_users
+
+
+def median_ms(fn, repeat: int, cached: bool) -> float:
+    times = []
+    for _ in range(repeat):
+        if not cached:
+            profiles.profile_cache.invalidate_all()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    db = next(database.get_db())
+    client = TestClient(app)
+    try:
+        user_ids = [str(user_id) for user_id in seed_users(db, args.users)]
+        page = random.sample(user_ids, args.size)
+
+        def one_by_one():
+            for user_id in page:
+                client.get(f"/users/{user_id}").raise_for_status()
+
+        def batch():
+            client.post("/users/batch", json={"ids": page}).raise_for_status()
+
+        print(f"{'':<16}{'uncached ms':>14}{'cached ms':>12}")
+        for name, fn in [(f"{args.size} GETs", one_by_one), ("batch", batch)]:
+            uncached = median_ms(fn, args.repeat, cached=False)
+            one_by_one()
+            cached = median_ms(fn, args.repeat, cached=True)
+            print(f"{name:<16}{uncached:>14.1f}{cached:>12.1f}")
+    finally:
+        remove_seeded_users(db)
+        profiles.profile_cache.invalidate_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Load test of the sync (psycopg2 on the threadpool) and async (asyncpg on the
+event loop) database modes.
+
+For each DB_MODE a uvicorn worker is started against POSTGRES_URL, with a
+local stand-in registry that accepts every API key, and hammered with
+`--concurrency` simultaneous `GET /users/{id}` requests for `--duration`
+seconds. It creates one user, so point it at a scratch database.
+
+Usage:
+    POSTGRES_URL=postgresql://... python -m benchmarks.bench_db_modes \\
+        [--concurrency 200] [--duration 10]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from uuid import uuid4
+
+import httpx
+
+from benchmarks.bench_startup import free_port, start_slow_registry, wait_for
+
+HEADERS = {"Authorization": "bench-key"}
+
+
+async def hammer(url: str, concurrency: int, duration: float) -> list[float]:
+    latencies = []
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60, headers=HEADERS) as client:
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(url)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies
+
+
+def run_mode(mode: str, concurrency: int, duration: float) -> dict:
+    registry = start_slow_registry(delay=0)
+    port = free_port()
+    env = {
+        **os.environ,
+        "ENV": "development",
+        "DB_MODE": mode,
+        "REGISTRY_URL": f"http://127.0.0.1:{registry.server_port}",
+    }
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/users"
+        wait_for(lambda: httpx.post(f"{url}/ping"))
+        name = uuid4().hex[:12]
+        user = httpx.post(
+            f"{url}/signup",
+            headers=HEADERS,
+            json={
+                "email": f"{name}@bench.com",
+                "password": "bench",
+                "user": name,
+                "name": "Bench User",
+                "location": "ARG",
+            },
+        ).json()
+        latencies = asyncio.run(hammer(f"{url}/{user['id']}", concurrency, duration))
+    finally:
+        worker.terminate()
+        worker.wait()
+        registry.shutdown()
+
+    latencies.sort()
+    return {
+        "requests/s": len(latencies) / duration,
+        "p50 ms": statistics.median(latencies) * 1000,
+        "p99 ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{'mode':<8}{'requests/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for mode in ["sync", "async"]:
+        result = run_mode(mode, args.concurrency, args.duration)
+        print(
+            f"{mode:<8}{result['requests/s']:>12.0f}"
+            f"{result['p50 ms']:>10.1f}{result['p99 ms']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
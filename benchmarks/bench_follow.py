@@ -0,0 +1,60 @@
+"""
+Latency of `POST /users/follow/{id}` and `DELETE /users/follow/{id}` for a
+user who already follows each of the `--followeds` amounts of users, which
+should be about the same for all of them.
+
+It seeds the users in the test database and removes them after.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... python -m benchmarks.bench_follow \\
+        [--followeds 0 1000 10000 100000] [--repeat 50]
+"""
+
+import argparse
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.repositories import database
+from benchmarks.seed import remove_seeded_users, seed_followeds, seed_users
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--followeds", type=int, nargs="+", default=[0, 1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    db = next(database.get_db())
+    client = TestClient(app)
+    print(f"{'followeds':<12}{'follow ms':>12}{'unfollow ms':>12}")
+    for amount in args.followeds:
+        try:
+            [user_id, target] = seed_users(db, 2, prefix="subject")
+            if amount:
+                seed_followeds(db, user_id, seed_users(db, amount))
+
+            follows, unfollows = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                client.post(f"/users/follow/{user_id}", json=str(target))
+                follows.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                client.delete(
+                    f"/users/follow/{user_id}", params={"followed_id": str(target)}
+                ).raise_for_status()
+                unfollows.append(time.perf_counter() - start)
+        finally:
+            remove_seeded_users(db)
+        print(
+            f"{amount:<12}{statistics.median(follows) * 1000:>12.1f}"
+            f"{statistics.median(unfollows) * 1000:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Cost of listing the followers of a user with many followers: latency of the
+first and of a deep `GET /users/followers/{id}` page, and time and peak
+Python memory of producing the whole list for `/export`.
+
+The export is measured for `--followers` and a tenth of it, the peak memory
+should be about the same for both.
+
+It seeds the followers in the test database and removes them after.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... python -m benchmarks.bench_follows \\
+        [--followers 100000] [--limit 100]
+"""
+
+import argparse
+import time
+import tracemalloc
+from uuid import UUID
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.repositories import database
+from app.services import users as users_service
+from benchmarks.seed import (
+    remove_seeded_users,
+    seed_follow_chain,
+    seed_followers,
+    seed_users,
+)
+
+
+def page_latency(client: TestClient, url: str, limit: int, pages: int) -> float:
+    """Latency of the `pages`-th page, walking the ones before it"""
+    params = {"limit": limit}
+    for _ in range(pages - 1):
+        params["cursor"] = client.get(url, params=params).headers["X-Next-Cursor"]
+    start = time.perf_counter()
+    client.get(url, params=params).raise_for_status()
+    return time.perf_counter() - start
+
+
+def export(db: Session, user_id: UUID) -> tuple[int, float, int]:
+    # Consumes the body generator of `/export` directly, the test client
+    # would buffer the whole response and hide what the server holds
+    lines = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    for batch in users_service.export_followers(db, user_id):
+        lines += batch.count("\n")
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return lines, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--followers", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    db = next(database.get_db())
+    client = TestClient(app)
+    try:
+        [small, big] = seed_users(db, 2, prefix="celebrity")
+        seed_followers(db, small, seed_users(db, args.followers // 10, "small"))
+        follower_ids = seed_users(db, args.followers)
+        seed_follow_chain(db, follower_ids)
+        seed_followers(db, big, follower_ids)
+
+        url = f"/users/followers/{big}"
+        deep = args.followers // args.limit // 2
+        print(f"{'page':<24}{'ms':>10}")
+        for name, pages in [("first", 1), (f"#{deep}", deep)]:
+            latency = page_latency(client, url, args.limit, pages)
+            print(f"{name:<24}{latency * 1000:>10.1f}")
+
+        print(f"\n{'export':<24}{'lines':>10}{'s':>8}{'peak MB':>10}")
+        for celebrity in [small, big]:
+            with database.SessionLocal() as export_db:
+                lines, elapsed, peak = export(export_db, celebrity)
+            print(f"{'':<24}{lines:>10}{elapsed:>8.1f}{peak / 2**20:>10.1f}")
+    finally:
+        remove_seeded_users(db)
+
+
+if __name__ == "__main__":
+    main()
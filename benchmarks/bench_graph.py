@@ -0,0 +1,137 @@
+"""
+Follow queries answered by the in-memory social graph against the same ones
+in SQL, on a synthetic graph of `--users` users and about `--follows`
+follows, plus how long building the graph takes and the size of its arrays.
+
+Each query is timed for `--samples` random users, reporting the median.
+
+It seeds the users and follows in the test database and removes them after,
+seeding 10M follows takes several minutes.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... python -m benchmarks.bench_graph \\
+        [--users 1000000] [--follows 10000000] [--samples 200]
+"""
+
+import argparse
+import random
+import statistics
+import time
+from typing import Callable
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.repositories import database
+from app.services import graph
+from app.services.graph import SocialGraph
+from benchmarks.seed import remove_seeded_users, seed_random_follows, seed_users
+
+SQL = {
+    "is_following": text(
+        """
+        SELECT 1 FROM followers
+        WHERE follower_id = :user_id AND followed_id = :other_id
+        """
+    ),
+    "mutual_follows": text(
+        """
+        SELECT mine.followed_id
+        FROM followers mine
+        JOIN followers theirs ON (
+            theirs.follower_id = mine.followed_id
+            AND theirs.followed_id = mine.follower_id
+        )
+        WHERE mine.follower_id = :user_id
+        """
+    ),
+    "common_followers": text(
+        """
+        SELECT follower_id FROM followers WHERE followed_id = :user_id
+        INTERSECT
+        SELECT follower_id FROM followers WHERE followed_id = :other_id
+        """
+    ),
+    "two_hop_candidates": text(
+        """
+        SELECT theirs.followed_id, COUNT(*) AS paths
+        FROM followers mine
+        JOIN followers theirs ON (theirs.follower_id = mine.followed_id)
+        WHERE mine.follower_id = :user_id
+        AND theirs.followed_id != :user_id
+        AND theirs.followed_id NOT IN (
+            SELECT followed_id FROM followers WHERE follower_id = :user_id
+        )
+        GROUP BY theirs.followed_id
+        ORDER BY paths DESC
+        LIMIT 20
+        """
+    ),
+}
+
+
+def median_us(fn: Callable[[UUID, UUID], object], pairs: list[tuple[UUID, UUID]]):
+    times = []
+    for user_id, other_id in pairs:
+        start = time.perf_counter()
+        fn(user_id, other_id)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--follows", type=int, default=10_000_000)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    db: Session = next(database.get_db())
+    try:
+        user_ids = seed_users(db, args.users)
+        seed_random_follows(db, args.follows)
+
+        social_graph = SocialGraph()
+        start = time.perf_counter()
+        graph.rebuild(social_graph)
+        built = time.perf_counter() - start
+        stats = social_graph.stats()
+        arrays = sum(
+            len(values) * values.itemsize
+            for adjacency in [social_graph._followeds, social_graph._followers]
+            for values in [adjacency.offsets, adjacency.targets]
+        )
+        print(
+            f"built {stats['built_follows']} follows of {stats['users']} users "
+            f"in {built:.1f} s, arrays {arrays / 2**20:.0f} MB\n"
+        )
+
+        pairs = [
+            (random.choice(user_ids), random.choice(user_ids))
+            for _ in range(args.samples)
+        ]
+        queries = {
+            "is_following": social_graph.is_following,
+            "mutual_follows": lambda user_id, _: social_graph.mutual_follows(user_id),
+            "common_followers": social_graph.common_followers,
+            "two_hop_candidates": lambda user_id, _: (
+                social_graph.two_hop_candidates(user_id, 20)
+            ),
+        }
+        print(f"{'query':<22}{'SQL us':>10}{'graph us':>10}")
+        for name, in_memory in queries.items():
+
+            def in_sql(user_id, other_id):
+                db.execute(SQL[name], {"user_id": user_id, "other_id": other_id}).all()
+
+            sql_us = median_us(in_sql, pairs)
+            graph_us = median_us(in_memory, pairs)
+            print(f"{name:<22}{sql_us:>10.0f}{graph_us:>10.1f}")
+    finally:
+        db.rollback()
+        remove_seeded_users(db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+How long after a user changes in one worker the other workers drop it from
+their profile caches, for `--workers` listeners, each with its own cache and
+connection like a uvicorn worker, over `--changes` location changes.
+
+The latency is measured from the start of the change, so it includes its
+transaction.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... \\
+        python -m benchmarks.bench_invalidation [--workers 4] [--changes 200]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from app.repositories import database
+from app.repositories import users as users_repository
+from app.services.changes import ChangesListener
+from app.services import users as users_service
+from app.services.profiles import ProfileCache
+from benchmarks.seed import remove_seeded_users, seed_users
+
+
+async def measure(db: Session, args) -> tuple[list[float], list[float]]:
+    [user_id] = seed_users(db, 1)
+    profile = users_service.fetch_user_by_id(db, user_id)
+    caches = [ProfileCache(ttl=60, max_size=10) for _ in range(args.workers)]
+    listeners = [ChangesListener(cache) for cache in caches]
+    tasks = [asyncio.create_task(listener.listen()) for listener in listeners]
+    try:
+        while not all(listener.connected for listener in listeners):
+            await asyncio.sleep(0.01)
+
+        writes, latencies = [], []
+        for i in range(args.changes):
+            for cache in caches:
+                cache.set(profile, cache.generation())
+            start = time.perf_counter()
+            await run_in_threadpool(
+                users_repository.set_location, db, user_id, ["ARG", "URY"][i % 2]
+            )
+            writes.append(time.perf_counter() - start)
+            while any(cache.get_by_id(user_id) for cache in caches):
+                await asyncio.sleep(0)
+            latencies.append(time.perf_counter() - start)
+        return writes, latencies
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--changes", type=int, default=200)
+    args = parser.parse_args()
+
+    db: Session = next(database.get_db())
+    try:
+        writes, latencies = asyncio.run(measure(db, args))
+    finally:
+        remove_seeded_users(db)
+
+    def ms(values: list[float], q: int) -> float:
+        return statistics.quantiles(values, n=100)[q - 1] * 1000
+
+    print(f"{'':<22}{'p50 ms':>10}{'p99 ms':>10}")
+    print(f"{'change committed':<22}{ms(writes, 50):>10.2f}{ms(writes, 99):>10.2f}")
+    print(
+        f"{'dropped everywhere':<22}{ms(latencies, 50):>10.2f}"
+        f"{ms(latencies, 99):>10.2f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
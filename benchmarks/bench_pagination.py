@@ -0,0 +1,62 @@
+"""
+Latency of `GET /users/` pages along a full walk of the users table with the
+`X-Next-Cursor` header, to check that deep pages cost the same as the first.
+
+It seeds `--users` users in the test database and removes them after.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... python -m benchmarks.bench_pagination \\
+        [--users 100000] [--limit 100]
+"""
+
+import argparse
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.repositories import database
+from benchmarks.seed import remove_seeded_users, seed_users
+
+
+def walk(client: TestClient, limit: int) -> list[float]:
+    latencies = []
+    params = {"limit": limit}
+    while True:
+        start = time.perf_counter()
+        response = client.get("/users/", params=params)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return latencies
+        params["cursor"] = cursor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    db = next(database.get_db())
+    try:
+        seed_users(db, args.users)
+
+        latencies = walk(TestClient(app), args.limit)
+        tenth = max(len(latencies) // 10, 1)
+        print(f"{'pages':<24}{'p50 ms':>10}")
+        for name, window in [
+            ("first 10%", latencies[:tenth]),
+            ("middle 10%", latencies[len(latencies) // 2 :][:tenth]),
+            ("last 10%", latencies[-tenth:]),
+        ]:
+            print(f"{name:<24}{statistics.median(window) * 1000:>10.1f}")
+        print(f"{len(latencies)} pages of {args.limit}")
+    finally:
+        remove_seeded_users(db)
+
+
+if __name__ == "__main__":
+    main()
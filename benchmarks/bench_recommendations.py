@@ -0,0 +1,121 @@
+"""
+Latency of `GET /users/recommendations/{id}` served from the precomputed
+store, against running the per-request triple UNION it replaced, for a user
+in a country of each of the `--users` sizes, a tenth of them sharing an
+interest with them, who follows `--followeds` users.
+
+Also reports how long scoring the recommendations of that user takes, which
+the rebuild pays for each new user and each one who follows, unfollows or
+changes their interests or location. It should stay about the same for any
+country size.
+
+It seeds the users in the test database and removes them after each size.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... \\
+        python -m benchmarks.bench_recommendations \\
+        [--users 10000 100000 300000] [--followeds 50]
+"""
+
+import argparse
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.main import app
+from app.repositories import database
+from app.repositories import users as users_repository
+from benchmarks.seed import (
+    remove_seeded_users,
+    seed_followeds,
+    seed_follow_chain,
+    seed_interests,
+    seed_users,
+)
+
+# The query every request ran before the store
+TRIPLE_UNION = text(
+    """
+    WITH direct_followed AS (
+        SELECT followed_id FROM followers WHERE follower_id = :user_id
+    )
+    SELECT users.id, users.name, users.user
+    FROM direct_followed df
+    JOIN followers uf ON df.followed_id = uf.follower_id
+    JOIN users ON (uf.followed_id = users.id)
+    WHERE uf.followed_id NOT IN (
+        SELECT followed_id FROM followers WHERE follower_id = :user_id
+    )
+    UNION
+    SELECT u1.id, u1.name, u1.user FROM users u1
+    JOIN users_interests ui ON (u1.id = ui.id_user)
+    WHERE ui.interest IN (
+        SELECT ui.interest FROM users u
+        JOIN users_interests ui ON (u.id = ui.id_user)
+        WHERE u.id = :user_id
+    )
+    AND u1.id != :user_id
+    UNION
+    SELECT u1.id, u1.name, u1.user FROM users u1
+    WHERE u1.location = 'ARG' AND u1.id != :user_id
+    """
+)
+
+
+def median_ms(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def measure(db: Session, client: TestClient, users: int, args) -> list[float]:
+    [user_id] = seed_users(db, 1, prefix="subject")
+    others = seed_users(db, users)
+    seed_follow_chain(db, others)
+    seed_followeds(db, user_id, others[:: users // args.followeds])
+    seed_interests(db, [user_id, *others[::10]], "engineering")
+    url = f"/users/recommendations/{user_id}"
+
+    def triple_union():
+        db.execute(TRIPLE_UNION, {"user_id": user_id}).all()
+
+    def compute():
+        users_repository.compute_recommendations(db, user_id)
+        db.commit()
+
+    compute()
+    return [
+        median_ms(triple_union, 5),
+        median_ms(compute, 5),
+        median_ms(lambda: client.get(url).raise_for_status(), args.repeat),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--users", type=int, nargs="+", default=[10_000, 100_000, 300_000]
+    )
+    parser.add_argument("--followeds", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    db: Session = next(database.get_db())
+    client = TestClient(app)
+    print(f"{'country users':<16}{'UNION ms':>12}{'scoring ms':>12}{'served ms':>12}")
+    for users in args.users:
+        try:
+            times = measure(db, client, users, args)
+        finally:
+            remove_seeded_users(db)
+        print(f"{users:<16}" + "".join(f"{ms:>12.1f}" for ms in times))
+
+
+if __name__ == "__main__":
+    main()
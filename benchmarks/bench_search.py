@@ -0,0 +1,95 @@
+"""
+Latency of the user name search over a large synthetic users table, with
+the previous `similarity(...) > 0.1` filter, which has to compute the
+similarity of every row, and with the `%` operator that can use the
+trigram index of the `e5a1f3c9b2d4` migration.
+
+It seeds `--users` users with random names in the database and removes
+them after. The database needs the pg_trgm extension and the migrations
+applied, otherwise there is no index to compare against.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... python -m benchmarks.bench_search \\
+        [--users 1000000] [--runs 5]
+"""
+
+import argparse
+import statistics
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.repositories import database
+from app.repositories import users
+from benchmarks.seed import BENCH_DOMAIN, remove_seeded_users
+
+QUERIES = ["therealuser", "maria", "juan_perez", "xq9"]
+
+
+def seed_named_users(db: Session, amount: int):
+    db.execute(
+        text(
+            """
+            INSERT INTO users (id, email, "user", name, location)
+            SELECT gen_random_uuid(),
+                   'search' || i || '@' || :domain,
+                   substr(md5(random()::text), 1, 4 + i % 8) || i,
+                   'Bench User ' || i,
+                   'ARG'
+            FROM generate_series(1, :amount) AS i
+            """
+        ),
+        {"domain": BENCH_DOMAIN, "amount": amount},
+    )
+    db.commit()
+    db.execute(text("ANALYZE users"))
+
+
+def similarity_filter(db: Session, query: str, limit: int):
+    return db.execute(
+        text(
+            """
+            SELECT id FROM users
+            WHERE similarity("user", :query) > 0.1
+            ORDER BY similarity("user", :query) DESC
+            LIMIT :limit
+            """
+        ),
+        {"query": query, "limit": limit},
+    ).all()
+
+
+def measure(db: Session, search, runs: int) -> float:
+    latencies = []
+    for query in QUERIES:
+        for _ in range(runs):
+            start = time.perf_counter()
+            search(db, query, 10)
+            latencies.append(time.perf_counter() - start)
+            db.rollback()
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    db = next(database.get_db())
+    try:
+        seed_named_users(db, args.users)
+
+        print(f"{'search':<24}{'p50 ms':>10}")
+        for name, search in [
+            ("similarity() > 0.1", similarity_filter),
+            ("% operator", users.search_users),
+        ]:
+            print(f"{name:<24}{measure(db, search, args.runs) * 1000:>10.1f}")
+    finally:
+        remove_seeded_users(db)
+
+
+if __name__ == "__main__":
+    main()
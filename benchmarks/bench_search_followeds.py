@@ -0,0 +1,73 @@
+"""
+Latency of `search_followeds` for users following more and more accounts,
+loading the follow list to send it back as an `IN (...)` list, as before,
+and joining the follows table in the database.
+
+It seeds the users in the database and removes them after.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... python -m benchmarks.bench_search_followeds \\
+        [--sizes 100 1000 10000 50000] [--runs 5]
+"""
+
+import argparse
+import statistics
+import time
+from uuid import UUID
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.repositories import database, models, users
+from benchmarks.seed import remove_seeded_users, seed_followeds, seed_users
+
+
+def in_list(db: Session, user_id: UUID, query: str, limit: int):
+    user = users.get_user_by_id(db, user_id)
+    followeds = [followed.id for followed in user.followeds]
+    return (
+        db.query(models.User)
+        .filter(models.User.id.in_(followeds))
+        .filter(models.User.user.op("%")(query))
+        .order_by(func.similarity(models.User.user, query).desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def measure(db: Session, search, user_id: UUID, runs: int) -> float:
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        search(db, user_id, "bench42", 10)
+        latencies.append(time.perf_counter() - start)
+        # Starts each run with an empty session, like a new request
+        db.rollback()
+        db.expunge_all()
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1_000, 10_000, 50_000]
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    db = next(database.get_db())
+    try:
+        followeds = seed_users(db, max(args.sizes))
+        print(f"{'followeds':<12}{'IN list ms':>12}{'join ms':>12}")
+        for size in args.sizes:
+            [fan] = seed_users(db, 1, prefix=f"fan{size}_")
+            seed_followeds(db, fan, followeds[:size])
+            before = measure(db, in_list, fan, args.runs)
+            after = measure(db, users.search_followeds, fan, args.runs)
+            print(f"{size:<12}{before * 1000:>12.1f}{after * 1000:>12.1f}")
+    finally:
+        remove_seeded_users(db)
+
+
+if __name__ == "__main__":
+    main()
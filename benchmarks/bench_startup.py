@@ -0,0 +1,100 @@
+"""
+Measures how long a worker takes to serve its first request while the
+registry is slow to answer the API key bootstrap.
+
+A local stand-in registry answers every call after `--registry-delay`
+seconds. The app is started with uvicorn against it and polled until
+`POST /users/ping` answers (time to first request) and until
+`GET /users/ready` answers 200 (time to ready).
+
+Usage:
+    POSTGRES_URL=postgresql://... python -m benchmarks.bench_startup [--registry-delay 5]
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+
+def start_slow_registry(delay: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            body = b'{"apiKey": "bench-key"}'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(request, timeout: float = 60) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            if request().status_code == 200:
+                return time.perf_counter() - start
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--registry-delay", type=float, default=5)
+    args = parser.parse_args()
+
+    registry = start_slow_registry(args.registry_delay)
+    port = free_port()
+    env = {
+        **os.environ,
+        "ENV": "development",
+        "SERVICE_ID": "users",
+        "REGISTRY_URL": f"http://127.0.0.1:{registry.server_port}",
+    }
+
+    start = time.perf_counter()
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/users"
+        wait_for(lambda: httpx.post(f"{url}/ping"))
+        first_request = time.perf_counter() - start
+        wait_for(lambda: httpx.get(f"{url}/ready"))
+        ready = time.perf_counter() - start
+    finally:
+        worker.terminate()
+        worker.wait()
+        registry.shutdown()
+
+    print(f"registry delay:        {args.registry_delay:.2f} s")
+    print(f"time to first request: {first_request:.2f} s")
+    print(f"time to ready:         {ready:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+CPU time this process spends per `GET /users/{id}?expand=followers`
+response of a user with each of the `--followers` amounts, from the rows
+to the rendered body, leaving out the time waiting for the database.
+
+"validated" is how the endpoint worked before: the ids turned into UUIDs, a
+schemas.User built from them, then validated and serialized again by
+FastAPI for the response_model and rendered by JSONResponse. "orjson" is the
+current one: the ids read as text into the plain payload, rendered once by
+ORJSONResponse.
+
+It seeds the users in the test database and removes them after each size.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... \\
+        python -m benchmarks.bench_user_rendering [--followers 0 1000 100000]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import orjson
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.repositories import database, models
+from app.repositories import users as users_repository
+from app.services import users as users_service
+from app.utils import schemas
+from benchmarks.seed import remove_seeded_users, seed_followers, seed_users
+
+RESPONSE_FIELD = create_model_field(
+    name="Response_get_user", type_=schemas.User, mode="serialization"
+)
+
+
+def cpu_ms(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        times.append(time.process_time() - start)
+    return statistics.median(times) * 1000
+
+
+def validated(db: Session, user: models.User, loop: asyncio.AbstractEventLoop):
+    follows = models.followers_table.c
+    payload = users_service.__database_model_to_payload(db, user)
+    payload["followers"] = list(
+        db.scalars(select(follows.follower_id).where(follows.followed_id == user.id))
+    )
+    content = loop.run_until_complete(
+        serialize_response(
+            field=RESPONSE_FIELD,
+            response_content=schemas.User(**payload),
+            is_coroutine=True,
+        )
+    )
+    return JSONResponse(content).body
+
+
+def rendered_once(db: Session, user: models.User):
+    payload = users_service.__database_model_to_payload(
+        db, user, [schemas.UserExpansion.followers]
+    )
+    return ORJSONResponse(payload).body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--followers", type=int, nargs="+", default=[0, 1000, 100_000])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    db: Session = next(database.get_db())
+    loop = asyncio.new_event_loop()
+    print(f"{'followers':<12}{'bytes':>12}{'validated ms':>16}{'orjson ms':>12}")
+    for followers in args.followers:
+        try:
+            [celebrity] = seed_users(db, 1, prefix="celebrity")
+            if followers:
+                seed_followers(db, celebrity, seed_users(db, followers))
+            user = users_repository.get_user_by_id(db, celebrity)
+
+            # The same response, only the order of the fields differs
+            assert orjson.loads(validated(db, user, loop)) == orjson.loads(
+                rendered_once(db, user)
+            )
+            size = len(rendered_once(db, user))
+            before = cpu_ms(lambda: validated(db, user, loop), args.repeat)
+            after = cpu_ms(lambda: rendered_once(db, user), args.repeat)
+        finally:
+            remove_seeded_users(db)
+        print(f"{followers:<12}{size:>12}{before:>16.2f}{after:>12.2f}")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Response size and latency of `GET /users/{id}` for a user with many
+followers, compact (counts only) and with `?expand=followers`.
+
+It seeds `--followers` users in the test database and removes them after.
+
+Usage:
+    ENV=test TEST_POSTGRES_URL=postgresql://... python -m benchmarks.bench_user_response \\
+        [--followers 100000] [--runs 10]
+"""
+
+import argparse
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.repositories import database
+from benchmarks.seed import remove_seeded_users, seed_followers, seed_users
+
+
+def measure(client: TestClient, url: str, runs: int) -> tuple[int, float]:
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(url)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return len(response.content), statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--followers", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    db = next(database.get_db())
+    try:
+        [celebrity] = seed_users(db, 1, prefix="celebrity")
+        seed_followers(db, celebrity, seed_users(db, args.followers))
+
+        client = TestClient(app)
+        print(f"{'response':<24}{'bytes':>12}{'p50 ms':>10}")
+        for name, url in [
+            ("compact", f"/users/{celebrity}"),
+            ("?expand=followers", f"/users/{celebrity}?expand=followers"),
+        ]:
+            size, latency = measure(client, url, args.runs)
+            print(f"{name:<24}{size:>12}{latency * 1000:>10.1f}")
+    finally:
+        remove_seeded_users(db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Synthetic data for the benchmarks. Every seeded user has an email under
+BENCH_DOMAIN, so `remove_seeded_users` can clean them up afterwards.
+"""
+
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+BENCH_DOMAIN = "bench.twitsnap"
+
+
+def seed_users(db: Session, amount: int, prefix: str = "bench") -> list[UUID]:
+    rows = db.execute(
+        text(
+            """
+            INSERT INTO users (id, email, "user", name, location)
+            SELECT gen_random_uuid(),
+                   :prefix || i || '@' || :domain,
+                   :prefix || i,
+                   'Bench User ' || i,
+                   'ARG'
+            FROM generate_series(1, :amount) AS i
+            RETURNING id
+            """
+        ),
+        {"prefix": prefix, "domain": BENCH_DOMAIN, "amount": amount},
+    )
+    ids = [row.id for row in rows]
+    db.commit()
+    # Fresh planner statistics, otherwise the first queries plan for an empty table
+    db.execute(text("ANALYZE users"))
+    return ids
+
+
+def seed_followers(db: Session, followed_id: UUID, follower_ids: list[UUID]):
+    db.execute(
+        text(
+            """
+            INSERT INTO followers (follower_id, followed_id)
+            SELECT unnest(CAST(:follower_ids AS uuid[])), :followed_id
+            """
+        ),
+        {"follower_ids": follower_ids, "followed_id": followed_id},
+    )
+    db.commit()
+    db.execute(text("ANALYZE followers"))
+
+
+def seed_followeds(db: Session, follower_id: UUID, followed_ids: list[UUID]):
+    db.execute(
+        text(
+            """
+            INSERT INTO followers (follower_id, followed_id)
+            SELECT :follower_id, unnest(CAST(:followed_ids AS uuid[]))
+            """
+        ),
+        {"follower_id": follower_id, "followed_ids": followed_ids},
+    )
+    db.commit()
+    db.execute(text("ANALYZE followers"))
+
+
+def seed_follow_chain(db: Session, user_ids: list[UUID]):
+    """
+    Each user follows the next one, so the follows table has as many distinct
+    followeds as a real one instead of a single celebrity
+    """
+    db.execute(
+        text(
+            """
+            INSERT INTO followers (follower_id, followed_id)
+            SELECT * FROM unnest(CAST(:follower_ids AS uuid[]),
+                                 CAST(:followed_ids AS uuid[]))
+            """
+        ),
+        {"follower_ids": user_ids[:-1], "followed_ids": user_ids[1:]},
+    )
+    db.commit()
+    db.execute(text("ANALYZE followers"))
+
+
+def seed_interests(db: Session, user_ids: list[UUID], interest: str):
+    db.execute(
+        text(
+            """
+            INSERT INTO users_interests (id_user, interest)
+            SELECT unnest(CAST(:user_ids AS uuid[])), :interest
+            """
+        ),
+        {"user_ids": user_ids, "interest": interest},
+    )
+    db.commit()
+    db.execute(text("ANALYZE users_interests"))
+
+
+def seed_random_follows(db: Session, amount: int):
+    """
+    About `amount` follows between the seeded users, with the followeds skewed
+    so that a few of them have most of the followers, like a real graph
+    """
+    db.execute(
+        text(
+            """
+            CREATE TEMPORARY TABLE seeded AS
+            SELECT id, row_number() OVER () AS n
+            FROM users WHERE email LIKE '%@' || :domain
+            """
+        ),
+        {"domain": BENCH_DOMAIN},
+    )
+    db.execute(text("CREATE INDEX ON seeded (n)"))
+    db.execute(
+        text(
+            """
+            WITH size AS (SELECT COUNT(*) AS n FROM seeded),
+            pairs AS (
+                SELECT 1 + floor(random() * size.n) AS follower,
+                       1 + floor(power(random(), 3) * size.n) AS followed
+                FROM size, generate_series(1, :amount)
+            )
+            INSERT INTO followers (follower_id, followed_id)
+            SELECT follower.id, followed.id
+            FROM pairs
+            JOIN seeded follower ON (follower.n = pairs.follower)
+            JOIN seeded followed ON (followed.n = pairs.followed)
+            WHERE follower.id != followed.id
+            ON CONFLICT DO NOTHING
+            """
+        ),
+        {"amount": amount},
+    )
+    db.execute(text("DROP TABLE seeded"))
+    db.commit()
+    db.execute(text("ANALYZE followers"))
+
+
+def remove_seeded_users(db: Session):
+    db.execute(
+        text("DELETE FROM users WHERE email LIKE '%@' || :domain"),
+        {"domain": BENCH_DOMAIN},
+    )
+    db.commit()